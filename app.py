@@ -1,59 +1,359 @@
+import gzip
+import hashlib
+import hmac
+import io
+import logging
 import os
-import json
 import random
-from flask import Flask, flash, jsonify, render_template, request, redirect, url_for
+import time
+from collections import deque
+from urllib.parse import quote
+
+from flask import (Flask, Response, abort, flash, g, jsonify, make_response, render_template, request,
+                   redirect, send_file, stream_template, stream_with_context, url_for)
+
+from werkzeug.datastructures import MultiDict
 
 import database
+from archive import stream_zip
+from blueprint import BlueprintError, pick_stratified, solve_counts
+from codec import get_codec
+from exposure import ExposureSampler, UsageHistory
+from jobs import JobQueue
+from metrics import Registry
+from models import question_id
+from papers import (MAX_SEED, PaperCache, answer_key_document, answer_sections, new_seed, paper_document,
+                    paper_key)
+from pdf import PDFRenderer, RendererBusy, UnsupportedText, check_text
+from pools import PoolCache, assemble_paper, distinct_variants, pick_variants
+from profiling import RequestProfiler
+from search import SearchIndex
+from shards import ShardedBank
+from sqlite_store import migrate
+from storage import ConflictError, QuestionBank
+from taxonomy import TaxonomyIndex
+from timing import PhaseStats, PhaseTimer, activate, phase
 
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
 DATA_FILE = 'data.json'
-
-# Load data from JSON
+DB_FILE = 'questions.db'
+# Which questions went into which papers, for exposure weighting and reprints
+USAGE_FILE = 'usage.log'
+SHARD_DIR = 'shards'
+# 'json' keeps the bank in DATA_FILE, 'sqlite' in DB_FILE, 'sharded' one file per chapter in SHARD_DIR
+STORAGE_BACKEND = os.environ.get('QUESTION_BANK_BACKEND', 'json')
+GZIP_MIN_BYTES = 1024
+QUESTION_PAGE_SIZE = 100
+MAX_QUESTION_PAGE = 500
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE = 100
+MAX_VARIANTS = 26  # sets are lettered A-Z
+# Streamed pages are sent in pieces of about this many characters
+STREAM_CHUNK = 16 * 1024
+# Worker processes that lay out PDFs, and how many PDFs may be queued or rendering at once
+PDF_WORKERS = int(os.environ.get('PDF_WORKERS', 2))
+PDF_BACKLOG = int(os.environ.get('PDF_BACKLOG', 8))
+# Favour questions that have not been on a paper lately; 'off' draws uniformly
+EXPOSURE_WEIGHTING = os.environ.get('QUESTION_EXPOSURE', 'on') != 'off'
+# Threads that build queued bulk jobs
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+# Log level when run directly; DEBUG shows the generate form as it is read
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# Snapshot format of the json backend: 'json' (compact UTF-8) or 'pickle' (binary)
+SNAPSHOT_CODEC = os.environ.get('QUESTION_BANK_CODEC', 'json')
+# Requests carrying this token (X-Profile header or ?profile=) run under cProfile and
+# tracemalloc, with reports kept in PROFILE_DIR; unset, profiling and /admin/profiles are off
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_DIR = 'profiles'
+
+
+# The json backend's bank (snapshot and journal) in the configured format;
+# the other backends are first filled from it
+def json_bank():
+    if SNAPSHOT_CODEC == 'json':
+        return QuestionBank(DATA_FILE)
+    codec = get_codec(SNAPSHOT_CODEC)
+    snapshot = QuestionBank(os.path.splitext(DATA_FILE)[0] + codec.suffix, codec=codec)
+    snapshot.seed_from(QuestionBank(DATA_FILE))
+    return snapshot
+
+
+if STORAGE_BACKEND == 'sqlite':
+    bank = migrate(json_bank(), DB_FILE, once=True)
+elif STORAGE_BACKEND == 'sharded':
+    bank = ShardedBank(SHARD_DIR, codec=get_codec(SNAPSHOT_CODEC))
+    bank.seed_from(json_bank())
+else:
+    bank = json_bank()
+
+# Dropdown lists and categories, kept up to date as the bank changes
+taxonomy = TaxonomyIndex(bank)
+# Words of every question, answer, option and match pair, for /search
+search_index = SearchIndex(bank)
+# Candidate questions per selection for paper generation
+question_pools = PoolCache(bank)
+# Rendered papers by (selection, counts, marks, seed, bank version), for reprints and refreshes
+papers = PaperCache()
+# Their answer keys, rendered in the same pass
+answer_keys = PaperCache()
+# PDFs of the same papers, keyed the same way
+pdf_papers = PaperCache(size=32)
+pdf_renderer = PDFRenderer(workers=PDF_WORKERS, backlog=PDF_BACKLOG)
+# Question usage across papers and the sampler that reads it
+usage = UsageHistory(USAGE_FILE)
+exposure = ExposureSampler(usage)
+# Bulk generation jobs running in the background
+jobs = JobQueue(workers=JOB_WORKERS)
+# cProfile/tracemalloc reports of requests that asked for one
+profiler = RequestProfiler(PROFILE_DIR)
+# Time per request phase (load, pools, sample, render), totalled per endpoint
+phase_stats = PhaseStats()
+
+# Metrics of this process for GET /metrics
+metrics = Registry()
+request_count = metrics.counter('http_requests_total', 'Requests handled, by endpoint, method and status.',
+                                ('endpoint', 'method', 'status'))
+request_latency = metrics.histogram('http_request_duration_seconds',
+                                    'Time from receiving a request to sending the last byte.',
+                                    ('endpoint', 'method'))
+bank_io = metrics.histogram('question_bank_io_seconds', 'Time spent reading and writing the stored bank.',
+                            ('backend', 'operation'),
+                            buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+bank.observe(lambda operation, seconds: bank_io.observe(seconds, STORAGE_BACKEND, operation))
+
+# {cache: (hits, misses)} of the paper caches and the pool cache
+def cache_lookups():
+    lookups = {name: (cache.hits, cache.misses)
+               for name, cache in (('papers', papers), ('answer_keys', answer_keys), ('pdf_papers', pdf_papers))}
+    for level in ('selections', 'chapters'):
+        lookups[f'pools_{level}'] = (question_pools.hits[level], question_pools.misses[level])
+    return lookups
+
+metrics.collected('cache_lookups_total', 'Cache lookups, by cache and whether they hit.', 'counter',
+                  ('cache', 'result'),
+                  lambda: {key: value for name, (hits, misses) in cache_lookups().items()
+                           for key, value in (((name, 'hit'), hits), ((name, 'miss'), misses))})
+metrics.collected('cache_hit_ratio', 'Share of cache lookups served from the cache.', 'gauge', ('cache',),
+                  lambda: {(name,): hits / (hits + misses)
+                           for name, (hits, misses) in cache_lookups().items() if hits + misses})
+metrics.collected('request_phase_seconds_total', 'Time spent in each phase of a request, by endpoint.',
+                  'counter', ('endpoint', 'phase'),
+                  lambda: {(endpoint, name): stat['total'] for endpoint, phases in phase_stats.snapshot().items()
+                           for name, stat in phases.items()})
+
+# Load data from the bank (cached and shared: treat it as read-only)
 def load_data():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r') as f:
-            return json.load(f)
-    return {}
+    return bank.load()
 
-# Save data to JSON
+# Replace the whole bank
 def save_data(data):
-    with open(DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
+    bank.save(data)
+
+# JSON response the browser revalidates with If-None-Match instead of re-downloading;
+# large bodies are gzipped for clients that accept it
+def conditional_json(payload, compress=False):
+    response = jsonify(payload)
+    response.cache_control.no_cache = True
+    compress = (compress and len(response.get_data()) > GZIP_MIN_BYTES
+                and 'gzip' in request.accept_encodings)
+    etag = hashlib.md5(response.get_data()).hexdigest()
+    response.set_etag(etag + '-gz' if compress else etag)
+    response.vary.add('Accept-Encoding')
+    response = response.make_conditional(request)
+    if compress and response.status_code == 200:
+        response.set_data(gzip.compress(response.get_data(), 6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+# Whether the request carries PROFILE_TOKEN
+def has_profile_token():
+    token = request.headers.get('X-Profile') or request.args.get('profile', '')
+    return bool(PROFILE_TOKEN) and hmac.compare_digest(token.encode('utf-8'), PROFILE_TOKEN.encode('utf-8'))
+
+# A request with the token is profiled from here until its last byte is sent (see
+# record_timer); the report pages themselves are not
+@app.before_request
+def start_profile():
+    if has_profile_token() and request.endpoint not in ('profile_reports', 'profile_report'):
+        g.profile = profiler.start()
+
+# Every request times its phases; the ones it went through are sent back in a
+# Server-Timing header and added to phase_stats when the request is done, along
+# with its count and latency
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+    g.timer = PhaseTimer()
+    activate(g.timer)
+
+@app.after_request
+def server_timing(response):
+    g.status = response.status_code
+    timer = g.get('timer')
+    if timer is not None and timer.phases:
+        response.headers['Server-Timing'] = timer.server_timing()
+    if g.get('profile') is not None:
+        response.headers['X-Profile-Report'] = url_for('profile_report', report_id=g.profile.id)
+    return response
+
+# Count, latency, phase totals and profile of a finished request
+def record_request(timer, endpoint, method, path, status, started, session):
+    request_count.inc(endpoint, method, str(status))
+    request_latency.observe(time.perf_counter() - started, endpoint, method)
+    if timer.phases:
+        phase_stats.add(endpoint, timer)
+    if session is not None:
+        profiler.stop(session, f"{method} {path} {status}")
+
+# A streamed page runs this once when its view returns and again after the last
+# piece is sent; its timer is only recorded the second time, render time included
+@app.teardown_request
+def record_timer(exc):
+    if g.get('streaming'):
+        return
+    timer = g.pop('timer', None)
+    if timer is None:
+        return
+    activate(None)
+    record_request(timer, request.endpoint or 'unmatched', request.method, request.path,
+                   g.get('status', 500), g.started, g.pop('profile', None))
+
+# HTML response rendered while it is sent, STREAM_CHUNK characters at a time, so a
+# long page starts arriving at once and is never held in memory as a whole.
+# on_complete(html) gets the full page once the last piece is out (e.g. to cache it).
+# Rendering happens after the headers are sent, so it is left out of Server-Timing.
+def stream_page(template_name, on_complete=None, **context):
+    pieces = iter(stream_template(template_name, **context))
+    timer = g.timer
+    g.streaming = True
+    started = False
+
+    def chunks():
+        nonlocal started
+        started = True
+        sent = []
+        activate(timer)  # the view's teardown has already run by now
+        try:
+            while True:
+                # Only rendering is timed, not the wait while a piece is being sent
+                with timer.phase('render'):
+                    buffer, size = [], 0
+                    for piece in pieces:
+                        buffer.append(piece)
+                        size += len(piece)
+                        if size >= STREAM_CHUNK:
+                            break
+                    chunk = ''.join(buffer)
+                if not chunk:
+                    break
+                if on_complete is not None:
+                    sent.append(chunk)
+                yield chunk
+            if on_complete is not None:
+                on_complete(''.join(sent))
+        finally:
+            g.streaming = False
+
+    # A client that leaves before the first piece closes the response without chunks()
+    # ever running, and then teardown does not run again either: record the request here
+    request_g = g._get_current_object()
+    endpoint, method, path = request.endpoint, request.method, request.path
+
+    def closed():
+        if not started and request_g.pop('timer', None) is not None:
+            record_request(timer, endpoint, method, path, request_g.get('status', 500),
+                           request_g.started, request_g.pop('profile', None))
+
+    response = Response(stream_with_context(chunks()), mimetype='text/html')
+    response.call_on_close(closed)
+    return response
 
 # Home Page
 @app.route('/')
 def index():
-    data = load_data()
-    publications = list(data.keys())
+    publications = taxonomy.children([])
     return render_template('index.html', publications=publications)
 
 # Get subjects
 @app.route('/get_subjects/<publication>')
 def get_subjects(publication):
-    data = load_data()
-    subjects = list(data.get(publication, {}).keys())
-    return {"subjects": subjects}
+    subjects = taxonomy.children([publication])
+    return conditional_json({"subjects": subjects})
 
 # Get classes
 @app.route('/get_classes/<publication>/<subject>')
 def get_classes(publication, subject):
-    data = load_data()
-    classes = list(data.get(publication, {}).get(subject, {}).keys())
-    return {"classes": classes}
+    classes = taxonomy.children([publication, subject])
+    return conditional_json({"classes": classes})
 
 @app.route('/get_chapters/<publication>/<subject>/<class_name>')
 def get_chapters(publication, subject, class_name):
-    data = load_data()
-    class_data = data.get(publication, {}).get(subject, {}).get(class_name, {})
-
-    # If class_data is a dict → normal chapters
-    if isinstance(class_data, dict):
-        chapters = list(class_data.keys())
-    else:
-        # If it’s a list (wrong structure), just return empty
-        chapters = []
-
-    return {"chapters": chapters}
+    # Only dict-shaped classes have chapters; anything else gives an empty list
+    chapters = taxonomy.children([publication, subject, class_name])
+
+    return conditional_json({"chapters": chapters})
+
+
+# Publication -> subject -> class -> chapter -> {question type: count}, or the part of it
+# under ?publication=&subject=&class_name= - one request instead of a chain of dropdown fetches
+@app.route('/hierarchy')
+def hierarchy():
+    path = []
+    for level in ('publication', 'subject', 'class_name', 'chapter'):
+        name = request.args.get(level)
+        if not name:
+            break
+        path.append(name)
+    return conditional_json({"path": path, "tree": _as_nodes(taxonomy.hierarchy(path), len(path))},
+                            compress=True)
+
+# JSON objects lose their key order (Flask sorts keys, browsers put numeric keys first),
+# so the dropdown levels go out as [{"name": ..., "children": [...]}] lists in bank order
+def _as_nodes(tree, depth):
+    if depth >= 4:
+        return tree
+    key = "counts" if depth == 3 else "children"
+    return [{"name": name, key: _as_nodes(child, depth + 1)} for name, child in tree.items()]
+
+
+# One page of a question list: ?publication=&subject=&class_name=&chapter=&qtype=&offset=&limit=
+# Items keep their bank positions (offset + i), valid for the returned version
+@app.route('/questions')
+def questions_page():
+    path = [request.args.get(level, '') for level in ('publication', 'subject', 'class_name', 'chapter')]
+    qtype = request.args.get('qtype', '')
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', QUESTION_PAGE_SIZE, type=int), 1), MAX_QUESTION_PAGE)
+    version = bank.version  # read before the data so a stale page can only conflict
+    items = bank.chapter(path).get(qtype)
+    if not isinstance(items, list):
+        items = []
+    return conditional_json({"items": items[offset:offset + limit], "offset": offset,
+                             "total": len(items), "version": version}, compress=True)
+
+
+# Questions holding every word of ?q=, best matches first, within the optional
+# ?publication=&subject=&class_name=&chapter= prefix and ?qtype=; paged with &offset=&limit=.
+# Each result has the path, qtype and index that the edit and delete forms take, valid
+# for the returned version (sent back with them, so an index shifted since conflicts)
+@app.route('/search')
+def search_questions():
+    query = request.args.get('q', '').strip()
+    path = []
+    for level in ('publication', 'subject', 'class_name', 'chapter'):
+        name = request.args.get(level, '')
+        if not name:
+            break
+        path.append(name)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', SEARCH_PAGE_SIZE, type=int), 1), MAX_SEARCH_PAGE)
+    version = bank.version  # read before searching so stale results can only conflict
+    with phase('search'):
+        total, results = search_index.search(query, path, request.args.get('qtype') or None,
+                                             limit=limit, offset=offset)
+    return conditional_json({"query": query, "results": results, "offset": offset, "total": total,
+                             "version": version}, compress=True)
 
 
 # Show form to add a question
@@ -73,15 +373,13 @@ def save_question():
     match_key = request.form.get('match_key', '').strip()
     match_value = request.form.get('match_value', '').strip()
 
-    data = load_data()
-    data.setdefault(pub, {}).setdefault(sub, {}).setdefault(cls, {}).setdefault(ch, {}).setdefault(qtype, [])
-
+    new_items = []
     if qtype == "Match the Following" and match_key and match_value:
-        data[pub][sub][cls][ch][qtype].append({match_key: match_value})
+        new_items.append({match_key: match_value})
     elif question:
-        data[pub][sub][cls][ch][qtype].append(question)
+        new_items.append(question)
 
-    save_data(data)
+    bank.add_questions([pub, sub, cls, ch, qtype], new_items)
     return redirect(url_for('show_form'))
 
 # Generate question paper
@@ -193,290 +491,541 @@ def save_question():
 
 #     )
 
-@app.route('/generate', methods=['POST'])
-def generate_question_paper():
-    try:
-        data = load_data()
+# Everything a paper is drawn from, read from the /generate form: the selection's
+# candidate pools, count and marks per question type, and the manual questions.
+# Returns None when the form does not name an existing selection. `sets` is how many
+# papers of a batch are drawn from it without sharing questions.
+def paper_spec(form, sets=1):
+    pub = form.get('publication', '').strip()
+    sub = form.get('subject', '').strip()
+    cls = form.get('class', '').strip()
+    chapters = form.getlist('chapters')
+    
+    if not all([pub, sub, cls, chapters]):
+        return None
 
-        pub = request.form.get('publication', '').strip()
-        sub = request.form.get('subject', '').strip()
-        cls = request.form.get('class', '').strip()
-        chapters = request.form.getlist('chapters')
-        
-        if not all([pub, sub, cls, chapters]):
-            return redirect(request.referrer or url_for('index'))
+    version = bank.version  # before the pools, so a racing write can only cause a cache miss
+    # One pass over the ticked chapters gives a candidate pool per question type
+    with phase('pools'):
+        valid_chapters, pools = question_pools.pools([pub, sub, cls], chapters)
+    for chapter in chapters:
+        if chapter not in valid_chapters:
+            logger.warning("Chapter %r not found in data for %s/%s/%s", chapter, pub, sub, cls)
 
-        all_categories = set()
-        valid_chapters = []
-        
-        for chapter in chapters:
-            chapter_data = data.get(pub, {}).get(sub, {}).get(cls, {}).get(chapter, {})
-            if chapter_data:
-                valid_chapters.append(chapter)
-                for qtype in chapter_data.keys():
-                    all_categories.add(qtype)
-            else:
-                print(f"Warning: Chapter '{chapter}' not found in data for {pub}/{sub}/{cls}")
+    if not valid_chapters:
+        return None
 
-        if not valid_chapters:
-            return redirect(request.referrer or url_for('index'))
+    all_categories = set(pools)
+    all_categories.add("Manual Questions")
 
-        all_categories.add("Manual Questions")
+    question_counts = {}
+    marks = {}
+    formatted_questions = {}
 
-        question_counts = {}
-        marks = {}
-        formatted_questions = {}
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug("Generate form: %s", form.to_dict(flat=False))
 
-        # DEBUG: Print ALL form fields to see what's being submitted
-        print("=== COMPLETE FORM DATA ===")
-        for key, value in request.form.items():
-            print(f"Field: '{key}' = '{value}'")
-        print("==========================")
+    # Read each question type's count and mark
+    for qtype in all_categories:
+        # Create the key exactly as it should appear in the form
+        key = qtype.lower().replace(" ", "_")
+        
+        # Get count and mark values
+        count_field = f"{key}_count"
+        mark_field = f"{key}_mark"
+        
+        count_value = form.get(count_field, "0")
+        mark_value = form.get(mark_field, "")
+        
+        # Convert count to integer
+        try:
+            question_counts[qtype] = int(count_value)
+        except ValueError:
+            question_counts[qtype] = 0
+        
+        # Convert mark to float, 1.0 when missing or invalid
+        try:
+            marks[qtype] = float(mark_value) if mark_value.strip() else 1.0
+        except ValueError:
+            marks[qtype] = 1.0
 
-        # Process each question type with enhanced debugging
-        for qtype in all_categories:
-            # Create the key exactly as it should appear in the form
-            key = qtype.lower().replace(" ", "_")
+        if debug:
+            logger.debug("%s: %s=%r -> %d, %s=%r -> %g", qtype, count_field, count_value,
+                         question_counts[qtype], mark_field, mark_value, marks[qtype])
             
-            # Get count and mark values
-            count_field = f"{key}_count"
-            mark_field = f"{key}_mark"
+        formatted_questions[qtype] = []
+
+    # MANUAL OVERRIDE: If specific types are missing marks, set them manually
+    problematic_types = ["Choose the Best Answer", "Answer the Following"]
+    for ptype in problematic_types:
+        if ptype in all_categories:
+            # Try alternative field names
+            alt_keys = [
+                ptype.lower().replace(" ", "_"),
+                ptype.lower().replace("the ", "").replace(" ", "_"),  # "choose_best_answer"
+                ptype.lower().replace(" ", "_").replace("the_", ""),  # "choose_best_answer"
+                "choose_best_answer",  # Direct match
+                "answer_following"     # Direct match
+            ]
             
-            count_value = request.form.get(count_field, "0")
-            mark_value = request.form.get(mark_field, "")
-            
-            print(f"Looking for {qtype}:")
-            print(f"  Count field: '{count_field}' = '{count_value}'")
-            print(f"  Mark field: '{mark_field}' = '{mark_value}'")
-            
-            # Convert count to integer
-            try:
-                question_counts[qtype] = int(count_value)
-            except ValueError:
-                question_counts[qtype] = 0
-                print(f"  Invalid count value, using 0")
-            
-            # Convert mark to float
-            if mark_value and mark_value.strip():
-                try:
-                    marks[qtype] = float(mark_value)
-                    print(f"  ✓ Mark value found: {marks[qtype]}")
-                except ValueError:
-                    marks[qtype] = 1.0
-                    print(f"  ✗ Invalid mark value, using default 1.0")
-            else:
-                marks[qtype] = 1.0
-                print(f"  ✗ No mark value found, using default 1.0")
-                
-            formatted_questions[qtype] = []
-
-        # MANUAL OVERRIDE: If specific types are missing marks, set them manually
-        problematic_types = ["Choose the Best Answer", "Answer the Following"]
-        for ptype in problematic_types:
-            if ptype in all_categories:
-                # Try alternative field names
-                alt_keys = [
-                    ptype.lower().replace(" ", "_"),
-                    ptype.lower().replace("the ", "").replace(" ", "_"),  # "choose_best_answer"
-                    ptype.lower().replace(" ", "_").replace("the_", ""),  # "choose_best_answer"
-                    "choose_best_answer",  # Direct match
-                    "answer_following"     # Direct match
-                ]
-                
-                for alt_key in alt_keys:
-                    alt_mark_field = f"{alt_key}_mark"
-                    alt_value = request.form.get(alt_mark_field)
-                    if alt_value:
-                        print(f"Found alternative mark for {ptype}: {alt_key}_mark = {alt_value}")
-                        try:
-                            marks[ptype] = float(alt_value)
-                            break
-                        except ValueError:
-                            continue
+            for alt_key in alt_keys:
+                alt_mark_field = f"{alt_key}_mark"
+                alt_value = form.get(alt_mark_field)
+                if alt_value:
+                    logger.debug("Alternative mark for %s: %s = %r", ptype, alt_mark_field, alt_value)
+                    try:
+                        marks[ptype] = float(alt_value)
+                        break
+                    except ValueError:
+                        continue
+
+    if debug:
+        logger.debug("Marks: %s", marks)
+
+    # Manual questions handling
+    manual_text = form.get('manual_questions', '').strip()
+    manual_mark_value = form.get('manual_mark', "5.0")
+    try:
+        manual_mark = float(manual_mark_value)
+    except ValueError:
+        manual_mark = 5.0
+        
+    manual_format = form.get('manual_output_format', 'numbered')
+    question_type = form.get('question_type', 'Write essays on the following').strip()
+
+    if manual_text:
+        if manual_format == 'numbered':
+            manual_lines = [line.strip().replace('\r', '') for line in manual_text.split('\n') if line.strip()]
+            formatted_questions["Manual Questions"] = manual_lines
+            question_counts["Manual Questions"] = len(manual_lines)
+            marks["Manual Questions"] = manual_mark
+        else:
+            formatted_questions["Manual Questions"] = [manual_text]
+            question_counts["Manual Questions"] = 1
+            marks["Manual Questions"] = manual_mark
+    else:
+        all_categories.discard("Manual Questions")
+        question_counts.pop("Manual Questions", None)
+        marks.pop("Manual Questions", None)
+        formatted_questions.pop("Manual Questions", None)
+
+    # Blueprint mode: the counts come from the target total and per-type limits
+    strata, blueprint = None, None
+    if form.get('mode') == 'blueprint':
+        manual_total = question_counts.get("Manual Questions", 0) * marks.get("Manual Questions", 0)
+        question_counts.update(blueprint_counts(form, pools, marks, manual_total, sets))
+        cover = form.get('cover_chapters') == 'on'
+        with phase('pools'):
+            strata = question_pools.strata([pub, sub, cls], valid_chapters)
+        blueprint = (form.get('target_marks', type=float), cover)
+
+    return {
+        'publication': pub, 'subject': sub, 'class_name': cls, 'chapters': chapters,
+        'version': version, 'pools': pools, 'strata': strata, 'blueprint': blueprint,
+        'question_counts': question_counts, 'marks': marks, 'questions': formatted_questions,
+        # sorted so a seed draws the same questions in every process
+        'sample_counts': {qtype: count for qtype, count in sorted(question_counts.items())
+                          if qtype != "Manual Questions"},
+        'question_type': question_type, 'manual_format': manual_format, 'manual_mark': manual_mark,
+    }
+
+# Counts per question type that make up the form's target_marks (less what the manual
+# questions already take), within each type's <key>_min / <key>_max and its pool size,
+# of which each of `sets` disjoint sets gets its own share.
+# Raises BlueprintError when the target cannot be met.
+def blueprint_counts(form, pools, marks, manual_total=0, sets=1):
+    target = form.get('target_marks', type=float)
+    if target is None:
+        raise BlueprintError("enter a target total")
+    types = []
+    for qtype in sorted(pools):
+        key = qtype.lower().replace(" ", "_")
+        available = len(pools[qtype]) // sets
+        low = max(form.get(f"{key}_min", 0, type=int), 0)
+        high = form.get(f"{key}_max", available, type=int)
+        types.append((qtype, marks.get(qtype, 1.0), low, min(max(high, 0), available)))
+    return solve_counts(types, target - manual_total)
+
+# Usage-history id of a paper: its key without the bank version, so a paper code
+# brings back the same questions after unrelated edits to the bank
+def usage_id(spec, seed, variant=None):
+    return hashlib.blake2b(repr((paper_key(spec, seed)[:-1], variant)).encode('utf-8'),
+                           digest_size=12).hexdigest()
+
+# {qtype: records} for question ids saved in the usage history; ids no longer in the
+# pools (edited or deleted questions) are left out
+def recorded_picks(spec, recorded):
+    picked = {}
+    for qtype, ids in recorded.items():
+        by_id = exposure.index(spec['pools'].get(qtype, ()))
+        picked[qtype] = [by_id[qid] for qid in ids if qid in by_id]
+    return picked
+
+# {qtype: records} for `variants` new papers, drawn per type or, in blueprint mode,
+# spread over the chapters; weighted towards questions not used lately. No two sets have
+# the same questions where the pools allow it, and with `disjoint` none share any
+def pick_questions(spec, rng, variants=1, disjoint=False):
+    draw = {'draw': exposure.draw} if EXPOSURE_WEIGHTING else {}
+    if spec['strata'] is None:
+        return pick_variants(spec['pools'], spec['sample_counts'], variants, rng, disjoint, **draw)
+    if not disjoint:
+        return distinct_variants(lambda: pick_stratified(spec['strata'], spec['sample_counts'], rng,
+                                                         spec['blueprint'][1], **draw), variants)
+    used = set()
+    return [pick_stratified(spec['strata'], spec['sample_counts'], rng, spec['blueprint'][1], used, **draw)
+            for _ in range(variants)]
+
+# CompiledPaper for each set of a paper. A paper drawn before - same
+# form, paper code and set - gets its recorded questions back; a new one is drawn
+# and, with exposure weighting on, logged in the usage history.
+def draw_papers(spec, seed, labels=(None,), disjoint=False):
+    with phase('sample'):
+        ids = [usage_id(spec, seed, label) for label in labels]
+        recorded = [usage.recorded(paper_id) for paper_id in ids] if EXPOSURE_WEIGHTING else [None]
+        if all(r is not None for r in recorded):
+            picks = [recorded_picks(spec, r) for r in recorded]
+        else:
+            picks = pick_questions(spec, random.Random(seed), len(labels), disjoint)
+            if EXPOSURE_WEIGHTING:
+                for paper_id, picked in zip(ids, picks):
+                    usage.record(paper_id, {qtype: [question_id(r) for r in records]
+                                            for qtype, records in picked.items()})
+        # Column B of Match the Following and the word bank are shuffled with a generator
+        # of their own, so a recorded paper is laid out the same way again
+        return [assemble_paper(picked, random.Random(f"{seed}:{label or ''}"))
+                for picked, label in zip(picks, labels)]
+
+def draw_paper(spec, seed):
+    return draw_papers(spec, seed)[0]
+
+# Render one sampled paper of a spec; `variant` labels a set ("A", "B", ...) in batch mode
+def paper_context(spec, paper, seed, variant=None):
+    formatted_questions = dict(spec['questions'])
+    formatted_questions.update(paper.questions())
+    marks = spec['marks']
+
+    total_marks = 0.0
+    counts = {}
+    
+    for qtype in formatted_questions:
+        count = len(formatted_questions[qtype])
+        counts[qtype] = count
+        total_marks += count * marks.get(qtype, 0)
+
+    return dict(
+        subject=spec['subject'],
+        class_name=spec['class_name'],
+        questions=formatted_questions,
+        marks=marks,
+        question_counts=spec['question_counts'],
+        total_marks=total_marks,
+        counts=counts,
+        fill_options=paper.fill_options,
+        publication=spec['publication'],
+        question_type=spec['question_type'],
+        output_format=spec['manual_format'],
+        manual_marks=spec['manual_mark'],
+        seed=seed,
+        variant=variant
+    )
 
-        print(f"FINAL MARKS DICTIONARY: {marks}")
+def render_paper(spec, paper, seed, variant=None, form=None):
+    with phase('render'):
+        return render_template('question_paper.html', reprint_form=form,
+                               **paper_context(spec, paper, seed, variant))
 
-        # Manual questions handling
-        manual_text = request.form.get('manual_questions', '').strip()
-        manual_mark_value = request.form.get('manual_mark', "5.0")
-        try:
-            manual_mark = float(manual_mark_value)
-        except ValueError:
-            manual_mark = 5.0
-            
-        manual_format = request.form.get('manual_output_format', 'numbered')
-        question_type = request.form.get('question_type', 'Write essays on the following').strip()
-
-        if manual_text:
-            if manual_format == 'numbered':
-                manual_lines = [line.strip().replace('\r', '') for line in manual_text.split('\n') if line.strip()]
-                formatted_questions["Manual Questions"] = manual_lines
-                question_counts["Manual Questions"] = len(manual_lines)
-                marks["Manual Questions"] = manual_mark
-            else:
-                formatted_questions["Manual Questions"] = [manual_text]
-                question_counts["Manual Questions"] = 1
-                marks["Manual Questions"] = manual_mark
-        else:
-            all_categories.discard("Manual Questions")
-            question_counts.pop("Manual Questions", None)
-            marks.pop("Manual Questions", None)
-            formatted_questions.pop("Manual Questions", None)
+# Answer key of a drawn paper, straight from the CompiledPaper
+def answer_key_context(spec, paper, seed, variant=None):
+    return dict(subject=spec['subject'], class_name=spec['class_name'], seed=seed, variant=variant,
+                sections=answer_sections(paper))
 
-        # ... rest of your question collection code remains the same ...
+def render_answer_key(spec, paper, seed, variant=None):
+    with phase('render'):
+        return render_template('answer_key.html', **answer_key_context(spec, paper, seed, variant))
 
-        chapter_questions = {}
-        for qtype in all_categories:
-            if qtype in ["Match the Following", "Manual Questions", "Full Form"]:
-                continue
-                
-            chapter_questions[qtype] = []
-            
-            for chapter in valid_chapters:
-                chapter_data = data.get(pub, {}).get(sub, {}).get(cls, {}).get(chapter, {})
-                questions = chapter_data.get(qtype, [])
-                
-                for question in questions:
-                    if qtype == "Choose the Best Answer":
-                        if isinstance(question, dict) and 'question' in question:
-                            chapter_questions[qtype].append({
-                                'question': question['question'],
-                                'options': question.get('options', ['Option A', 'Option B', 'Option C', 'Option D'])
-                            })
-                        elif isinstance(question, str):
-                            chapter_questions[qtype].append({
-                                'question': question,
-                                'options': ['Option A', 'Option B', 'Option C', 'Option D']
-                            })
-                    else:
-                        if isinstance(question, dict) and 'question' in question:
-                            chapter_questions[qtype].append(question['question'])
-                        elif isinstance(question, str):
-                            chapter_questions[qtype].append(question)
-
-        # Full Form handling
-        if "Full Form" in all_categories:
-            full_form_items = []
-            
-            for chapter in valid_chapters:
-                chapter_data = data.get(pub, {}).get(sub, {}).get(cls, {}).get(chapter, {})
-                full_form_data = chapter_data.get("Full Form", [])
-                
-                for item in full_form_data:
-                    if isinstance(item, dict):
-                        for abbr, full_form in item.items():
-                            full_form_items.append(abbr)
-                    elif isinstance(item, str):
-                        full_form_items.append(item)
-
-            full_form_count = question_counts.get("Full Form", 0)
-            if full_form_items and full_form_count > 0:
-                formatted_questions["Full Form"] = random.sample(full_form_items, min(full_form_count, len(full_form_items)))
-            else:
-                formatted_questions["Full Form"] = []
+def attachment(filename):
+    return {'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename)}"}
 
-        for qtype in all_categories:
-            if qtype in ["Match the Following", "Manual Questions", "Full Form"]:
-                continue
-                
-            all_available = chapter_questions.get(qtype, [])
-            count_needed = question_counts.get(qtype, 0)
-            
-            if all_available and count_needed > 0:
-                selected = random.sample(all_available, min(count_needed, len(all_available)))
-                formatted_questions[qtype] = selected
-            else:
-                formatted_questions[qtype] = []
+# Paper code from the form, or a new one; the same code, form and bank version give the same paper
+def paper_seed(form):
+    seed = form.get('seed', type=int)
+    return seed % MAX_SEED if seed is not None else new_seed()
 
-        if "Match the Following" in all_categories:
-            match_pairs = []
-            
-            for chapter in valid_chapters:
-                items = data.get(pub, {}).get(sub, {}).get(cls, {}).get(chapter, {}).get("Match the Following", [])
-                for pair in items:
-                    if isinstance(pair, dict):
-                        for k, v in pair.items():
-                            match_pairs.append((k.strip(), v.strip()))
-                    elif isinstance(pair, (list, tuple)) and len(pair) == 2:
-                        match_pairs.append((pair[0].strip(), pair[1].strip()))
-
-            count_needed = question_counts.get("Match the Following", 0)
-            if match_pairs and count_needed > 0:
-                selected_match = random.sample(match_pairs, min(count_needed, len(match_pairs)))
-                left = [k for k, v in selected_match]
-                right = [v for k, v in selected_match]
-                random.shuffle(right)
-                formatted_questions["Match the Following"] = list(zip(left, right))
-            else:
-                formatted_questions["Match the Following"] = []
+@app.route('/generate', methods=['POST'])
+def generate_question_paper():
+    try:
+        spec = paper_spec(request.form)
+        if spec is None:
+            return redirect(request.referrer or url_for('index'))
 
-        if "Fill in the Blanks" in all_categories:
-            fib_all_questions = []
-            fib_all_answers = []
+        seed = paper_seed(request.form)
+        key = paper_key(spec, seed)
+        html = papers.get(key)
+        if html is not None:
+            return html
 
-            for chapter in valid_chapters:
-                chapter_data = data.get(pub, {}).get(sub, {}).get(cls, {}).get(chapter, {})
-                fib_raw = chapter_data.get("Fill in the Blanks", [])
+        paper = draw_paper(spec, seed)
 
-                for item in fib_raw:
-                    if isinstance(item, dict) and 'question' in item:
-                        fib_all_questions.append(item['question'])
-                        fib_all_answers.append(item.get('answer', ''))
-                    elif isinstance(item, str):
-                        fib_all_questions.append(item)
-                        fib_all_answers.append("")
+        # Cached once fully sent; the key comes from the same draw, ready for the Answer Key button
+        def cache(html):
+            papers.put(key, html)
+            answer_keys.put(key, render_answer_key(spec, paper, seed))
 
-            fib_count = question_counts.get("Fill in the Blanks", 0)
-            
-            if fib_all_questions and fib_count > 0:
-                selected_indices = random.sample(range(len(fib_all_questions)), min(fib_count, len(fib_all_questions)))
-                fill_questions = [fib_all_questions[i] for i in selected_indices]
-                selected_answers = [fib_all_answers[i] for i in selected_indices]
-                
-                options = list(dict.fromkeys([ans for ans in selected_answers if ans.strip()]))
-                random.shuffle(options)
-                
-                formatted_questions["Fill in the Blanks"] = fill_questions
+        return stream_page('question_paper.html', on_complete=cache, reprint_form=request.form,
+                           **paper_context(spec, paper, seed))
+
+    except BlueprintError:
+        raise
+    except Exception:
+        logger.exception("Error generating question paper")
+        return redirect(request.referrer or url_for('index'))
+    
+# A blueprint that cannot be met is the user's input, not a server fault
+@app.errorhandler(BlueprintError)
+def blueprint_error(e):
+    return Response(f"Cannot build this paper: {e}", 422, mimetype='text/plain')
+
+# Neither is a paper in a script the PDF fonts cannot print
+@app.errorhandler(UnsupportedText)
+def unsupported_text(e):
+    return Response(f"Cannot make a PDF of this paper: {e}", 422, mimetype='text/plain')
+
+# Counts the blueprint solver picks for the generate form, so the page can show them
+# before generating
+@app.route('/blueprint', methods=['POST'])
+def solve_blueprint():
+    form = request.form.copy()
+    form['mode'] = 'blueprint'
+    try:
+        spec = paper_spec(form)
+    except BlueprintError as e:
+        return jsonify({'error': str(e)}), 422
+    if spec is None:
+        return jsonify({'error': 'select a publication, subject, class and chapters'}), 422
+    counts = spec['question_counts']
+    total = sum(count * spec['marks'].get(qtype, 0) for qtype, count in counts.items())
+    return jsonify({'counts': counts, 'total': total})
+
+# One paper as a PDF, laid out in a worker process
+@app.route('/generate_pdf', methods=['POST'])
+def generate_pdf():
+    spec = paper_spec(request.form)
+    if spec is None:
+        return redirect(request.referrer or url_for('index'))
+
+    seed = paper_seed(request.form)
+    key = paper_key(spec, seed)
+    pdf = pdf_papers.get(key)
+    if pdf is None:
+        paper = draw_paper(spec, seed)
+        try:
+            with phase('render'):
+                pdf = pdf_renderer.render(paper_document(paper_context(spec, paper, seed)))
+        except RendererBusy:
+            return Response("Too many PDFs are being prepared, please try again shortly.", 503,
+                            headers={'Retry-After': '5'})
+        pdf_papers.put(key, pdf)
+    filename = f"{spec['subject']} {spec['class_name']} {seed}.pdf"
+    return send_file(io.BytesIO(pdf), mimetype='application/pdf', as_attachment=True, download_name=filename)
+
+# Answer key of the paper the same form and paper code give, as HTML or (format=pdf) PDF
+@app.route('/answer_key', methods=['POST'])
+def answer_key():
+    spec = paper_spec(request.form)
+    if spec is None:
+        return redirect(request.referrer or url_for('index'))
+
+    seed = paper_seed(request.form)
+    if request.form.get('format') == 'pdf':
+        paper = draw_paper(spec, seed)
+        try:
+            with phase('render'):
+                pdf = pdf_renderer.render(answer_key_document(answer_key_context(spec, paper, seed)))
+        except RendererBusy:
+            return Response("Too many PDFs are being prepared, please try again shortly.", 503,
+                            headers={'Retry-After': '5'})
+        filename = f"{spec['subject']} {spec['class_name']} {seed} answer key.pdf"
+        return send_file(io.BytesIO(pdf), mimetype='application/pdf', as_attachment=True,
+                         download_name=filename)
+
+    key = paper_key(spec, seed)
+    html = answer_keys.get(key)
+    if html is None:
+        html = render_answer_key(spec, draw_paper(spec, seed), seed)
+        answer_keys.put(key, html)
+    return html
+
+# Files for `variants` sets of one paper, each optionally followed by its answer key:
+# an iterator of (name, bytes), PDFs laid out a file or two ahead in the worker processes
+# while earlier ones are being sent. The sets are drawn, and PDFs checked for text they
+# cannot print (UnsupportedText), before it is returned, so nothing half-made gets sent
+def paper_files(spec, seed, variants, disjoint=False, as_pdf=False, with_keys=False, prefix=''):
+    labels = [chr(ord('A') + n) for n in range(variants)]
+    outputs = []
+    for label, paper in zip(labels, draw_papers(spec, seed, labels, disjoint=disjoint)):
+        outputs.append((f"Set {label}", False, paper, label))
+        if with_keys:
+            outputs.append((f"Set {label} - Answer Key", True, paper, label))
+
+    def html_files():
+        for name, is_key, paper, label in outputs:
+            if is_key:
+                html = render_answer_key(spec, paper, seed, label)
             else:
-                formatted_questions["Fill in the Blanks"] = []
-                options = []
-        else:
-            options = []
+                html = render_paper(spec, paper, seed, variant=label)
+            yield f"{prefix}{name}.html", html.encode('utf-8')
 
-        total_marks = 0.0
-        counts = {}
-        
-        for qtype in formatted_questions:
-            count = len(formatted_questions[qtype])
-            counts[qtype] = count
-            total_marks += count * marks.get(qtype, 0)
-
-        return render_template(
-            'question_paper.html',
-            subject=sub,
-            class_name=cls,
-            questions=formatted_questions,
-            marks=marks,
-            question_counts=question_counts,
-            total_marks=total_marks,
-            counts=counts,
-            fill_options=options,
-            publication=pub,
-            question_type=question_type,
-            output_format=manual_format,
-            manual_marks=manual_mark
-        )
+    if not as_pdf:
+        return html_files()
 
-    except Exception as e:
-        print(f"Error generating question paper: {str(e)}")
-        import traceback
-        traceback.print_exc()
+    documents = []
+    for name, is_key, paper, label in outputs:
+        if is_key:
+            document = answer_key_document(answer_key_context(spec, paper, seed, label))
+        else:
+            document = paper_document(paper_context(spec, paper, seed, label))
+        check_text(document)
+        documents.append((name, document))
+
+    def pdf_files():
+        pending = deque()
+        for name, document in documents:
+            pending.append((name, pdf_renderer.submit(document, block=True)))
+            if len(pending) > pdf_renderer.workers:
+                name, future = pending.popleft()
+                yield f"{prefix}{name}.pdf", future.result(pdf_renderer.timeout)
+        while pending:
+            name, future = pending.popleft()
+            yield f"{prefix}{name}.pdf", future.result(pdf_renderer.timeout)
+
+    return pdf_files()
+
+# Files a batch or job entry produces per set: the paper, and its key if asked for
+def files_per_set(form):
+    return 2 if form.get('answer_keys') in ('on', 'true', 'True') else 1
+
+def paper_variants(form):
+    return min(max(form.get('variants', 3, type=int), 1), MAX_VARIANTS)
+
+# Several shuffled sets of one paper, downloaded as a ZIP of HTML or PDF papers
+@app.route('/generate_batch', methods=['POST'])
+def generate_batch():
+    variants = paper_variants(request.form)
+    disjoint = request.form.get('no_overlap') == 'on'
+    spec = paper_spec(request.form, variants if disjoint else 1)
+    if spec is None:
         return redirect(request.referrer or url_for('index'))
-    
+    files = paper_files(spec, paper_seed(request.form), variants, disjoint=disjoint,
+                        as_pdf=request.form.get('format') == 'pdf',
+                        with_keys=files_per_set(request.form) == 2)
+    filename = f"{spec['subject']} {spec['class_name']} sets.zip"
+    return Response(stream_with_context(stream_zip(files)), mimetype='application/zip',
+                    headers=attachment(filename))
+
+# A job entry as the generate form would have posted it; list values repeat the field
+def job_form(entry):
+    if isinstance(entry, MultiDict):
+        return entry
+    return MultiDict([(name, str(value)) for name, values in entry.items()
+                      for value in (values if isinstance(values, list) else [values])])
+
+# Bulk generation: POST a JSON {"papers": [generate form fields, ...]} (each may set
+# variants, seed, no_overlap, format and answer_keys) or the generate form itself; the papers are
+# built in the background and /jobs/<id> reports progress and download links
+@app.route('/jobs', methods=['GET', 'POST'])
+def jobs_page():
+    if request.method == 'GET':
+        return render_template('jobs.html', jobs=[job.as_dict() for job in jobs.jobs()])
+
+    if request.is_json:
+        payload = request.get_json(silent=True) or {}
+        entries = payload.get('papers')
+        if not isinstance(entries, list) or not entries or not all(isinstance(e, dict) for e in entries):
+            return jsonify({'error': 'papers must be a non-empty list of objects'}), 400
+        forms = [job_form(entry) for entry in entries]
+        label = payload.get('label') or f"{len(forms)} papers"
+    else:
+        forms = [request.form.copy()]
+        label = f"{request.form.get('subject', '')} {request.form.get('class', '')}".strip()
+    for form in forms:
+        form.setdefault('variants', '1')
+
+    # Templates build links with url_for, so papers are rendered in a request context
+    # for this host
+    base_url = request.host_url
+
+    def work():
+        with app.test_request_context(base_url=base_url):
+            for n, form in enumerate(forms, 1):
+                variants = paper_variants(form)
+                disjoint = form.get('no_overlap') in ('on', 'true', 'True')
+                files = variants * files_per_set(form)
+                # Papers for the same selection share one candidate pool in question_pools
+                try:
+                    spec = paper_spec(form, variants if disjoint else 1)
+                except BlueprintError as e:
+                    for _ in range(files):
+                        yield None, f"paper {n}: {e}"
+                    continue
+                if spec is None:
+                    for _ in range(files):
+                        yield None, f"paper {n}: no questions for this selection"
+                    continue
+                prefix = f"{n:02d} {spec['subject']} {spec['class_name']}/"
+                try:
+                    made = paper_files(spec, paper_seed(form), variants, disjoint=disjoint,
+                                       as_pdf=form.get('format') == 'pdf',
+                                       with_keys=files_per_set(form) == 2, prefix=prefix)
+                except UnsupportedText as e:
+                    for _ in range(files):
+                        yield None, f"paper {n}: {e}"
+                    continue
+                yield from made
+
+    job = jobs.submit(work, total=sum(paper_variants(form) * files_per_set(form) for form in forms),
+                      label=label)
+    if not request.is_json:
+        return redirect(url_for('jobs_page'))
+    return jsonify(job_status_payload(job)), 202, {'Location': url_for('job_status', job_id=job.id)}
+
+def job_status_payload(job):
+    status = job.as_dict()
+    status['status_url'] = url_for('job_status', job_id=job.id)
+    status['files'] = [{'name': name, 'url': url_for('job_file', job_id=job.id, index=n)}
+                       for n, name in enumerate(status['files'])]
+    if job.status == 'done' and job.files:
+        status['archive_url'] = url_for('job_archive', job_id=job.id)
+    return status
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'unknown job'}), 404
+    return jsonify(job_status_payload(job))
+
+@app.route('/jobs/<job_id>/files/<int:index>')
+def job_file(job_id, index):
+    job = jobs.get(job_id)
+    if job is None or index >= len(job.files):
+        return jsonify({'error': 'unknown file'}), 404
+    name, payload = job.files[index]
+    mimetype = 'application/pdf' if name.endswith('.pdf') else 'text/html'
+    return send_file(io.BytesIO(payload), mimetype=mimetype, as_attachment=True,
+                     download_name=name.replace('/', ' - '))
+
+@app.route('/jobs/<job_id>/archive')
+def job_archive(job_id):
+    job = jobs.get(job_id)
+    if job is None or job.status != 'done':
+        return jsonify({'error': 'job is not finished'}), 404
+    return Response(stream_zip(list(job.files)), mimetype='application/zip',
+                    headers=attachment(f"{job.label or job.id}.zip"))
+
 @app.route('/add_question', methods=['GET', 'POST'])
 def add_question():
-    data = load_data()
-    publications = list(data.keys())
+    publications = taxonomy.children([])
     
     # Initialize selected values
     selected_pub = ''
@@ -510,23 +1059,16 @@ def add_question():
                                     selected_sub=selected_sub,
                                     selected_cls=selected_cls,
                                     selected_chapter=selected_chapter,
-                                    selected_qtype=selected_qtype,
-                                    data=data)
-            
-            # Initialize data structure
-            data.setdefault(publication, {}) \
-                .setdefault(subject, {}) \
-                .setdefault(class_name, {}) \
-                .setdefault(chapter, {}) \
-                .setdefault(qtype, [])
+                                    selected_qtype=selected_qtype)
             
             success_message = ""
+            new_items = []
             
             if qtype == "Match the Following":
                 match_key = request.form.get("match_key", "").strip()
                 match_value = request.form.get("match_value", "").strip()
                 if match_key and match_value:
-                    data[publication][subject][class_name][chapter][qtype].append({match_key: match_value})
+                    new_items.append({match_key: match_value})
                     success_message = f"Match pair added successfully: {match_key} → {match_value}"
                 else:
                     # flash('Both key and value are required for Match the Following!', 'error')
@@ -536,15 +1078,14 @@ def add_question():
                                         selected_sub=selected_sub,
                                         selected_cls=selected_cls,
                                         selected_chapter=selected_chapter,
-                                        selected_qtype=selected_qtype,
-                                        data=data)
+                                        selected_qtype=selected_qtype)
             
             elif qtype == "Fill in the Blanks":
                 question_text = request.form.get("fib_question", "").strip()
                 answer_text = request.form.get("fib_answer", "").strip()
                 if question_text and answer_text:
                     new_question = {"question": question_text, "answer": answer_text}
-                    data[publication][subject][class_name][chapter][qtype].append(new_question)
+                    new_items.append(new_question)
                     success_message = f"Fill in the Blank question added: {question_text}"
                 else:
                     # flash('Both question and answer are required for Fill in the Blanks!', 'error')
@@ -554,15 +1095,14 @@ def add_question():
                                         selected_sub=selected_sub,
                                         selected_cls=selected_cls,
                                         selected_chapter=selected_chapter,
-                                        selected_qtype=selected_qtype,
-                                        data=data)
+                                        selected_qtype=selected_qtype)
                     
             elif qtype == "True/False":
                 question_text = request.form.get("true_false_question", "").strip()
                 answer_text = request.form.get("true_false_answer", "").strip()
                 if question_text and answer_text:
                     new_question = {"question": question_text, "answer": answer_text}
-                    data[publication][subject][class_name][chapter][qtype].append(new_question)
+                    new_items.append(new_question)
                     success_message = f"True/False question added: {question_text}"
                 else:
                     # flash('Both question and answer are required for True/False!', 'error')
@@ -572,8 +1112,7 @@ def add_question():
                                         selected_sub=selected_sub,
                                         selected_cls=selected_cls,
                                         selected_chapter=selected_chapter,
-                                        selected_qtype=selected_qtype,
-                                        data=data)
+                                        selected_qtype=selected_qtype)
 
             elif qtype == "Choose the Best Answer":
                 question = request.form.get("best_answer_question", "").strip()
@@ -589,7 +1128,7 @@ def add_question():
                         "options": [option1, option2, option3, option4],
                         "answer": answer
                     }
-                    data[publication][subject][class_name][chapter][qtype].append(new_q)
+                    new_items.append(new_q)
                     success_message = f"MCQ question added: {question}"
                 else:
                     # flash('All fields (question, 4 options, and answer) are required for Choose the Best Answer!', 'error')
@@ -599,14 +1138,13 @@ def add_question():
                                         selected_sub=selected_sub,
                                         selected_cls=selected_cls,
                                         selected_chapter=selected_chapter,
-                                        selected_qtype=selected_qtype,
-                                        data=data)
+                                        selected_qtype=selected_qtype)
 
             elif qtype == "Full Form":
                 full_form_abbr = request.form.get("full_form_abbr", "").strip()
                 full_form_text = request.form.get("full_form_text", "").strip()
                 if full_form_abbr and full_form_text:
-                    data[publication][subject][class_name][chapter][qtype].append({full_form_abbr: full_form_text})
+                    new_items.append({full_form_abbr: full_form_text})
                     success_message = f"Full Form added: {full_form_abbr} = {full_form_text}"
                 else:
                     # flash('Both abbreviation and full form are required!', 'error')
@@ -616,8 +1154,7 @@ def add_question():
                                         selected_sub=selected_sub,
                                         selected_cls=selected_cls,
                                         selected_chapter=selected_chapter,
-                                        selected_qtype=selected_qtype,
-                                        data=data)
+                                        selected_qtype=selected_qtype)
 
             elif qtype == "One Word Answer":
                 # Handle One Word Answer type
@@ -626,7 +1163,7 @@ def add_question():
                 
                 if question_text and answer_text:
                     new_question = {"question": question_text, "answer": answer_text}
-                    data[publication][subject][class_name][chapter][qtype].append(new_question)
+                    new_items.append(new_question)
                     success_message = f"One Word Answer question added: {question_text}"
                 else:
                     # flash('Both question and answer are required for One Word Answer!', 'error')
@@ -636,8 +1173,7 @@ def add_question():
                                         selected_sub=selected_sub,
                                         selected_cls=selected_cls,
                                         selected_chapter=selected_chapter,
-                                        selected_qtype=selected_qtype,
-                                        data=data)
+                                        selected_qtype=selected_qtype)
 
             else:
                 # Handle other question types (Answer the Following, Short Answer, Long Answer, etc.)
@@ -645,7 +1181,7 @@ def add_question():
                 if question_text:
                     # For question types without separate answer field, store as simple strings
                     lines = [line.strip() for line in question_text.split('\n') if line.strip()]
-                    data[publication][subject][class_name][chapter][qtype].extend(lines)
+                    new_items.extend(lines)
                     success_message = f"{qtype} question(s) added successfully!"
                 else:
                     # flash('Question text is required!', 'error')
@@ -655,11 +1191,10 @@ def add_question():
                                         selected_sub=selected_sub,
                                         selected_cls=selected_cls,
                                         selected_chapter=selected_chapter,
-                                        selected_qtype=selected_qtype,
-                                        data=data)
+                                        selected_qtype=selected_qtype)
 
             # Save data and show success
-            save_data(data)
+            bank.add_questions([publication, subject, class_name, chapter, qtype], new_items)
             # flash(success_message, 'success')
             
             # Redirect with parameters to preserve selections
@@ -678,8 +1213,7 @@ def add_question():
                                 selected_sub=selected_sub,
                                 selected_cls=selected_cls,
                                 selected_chapter=selected_chapter,
-                                selected_qtype=selected_qtype,
-                                data=data)
+                                selected_qtype=selected_qtype)
     
     else:
         # GET request - get parameters for persistence
@@ -696,89 +1230,60 @@ def add_question():
                          selected_sub=selected_sub,
                          selected_cls=selected_cls,
                          selected_chapter=selected_chapter,
-                         selected_qtype=selected_qtype,
-                         data=data)
+                         selected_qtype=selected_qtype)
                            
                            
 @app.route('/get_questions/<publication>/<subject>/<class_name>/<chapter>')
 def get_questions(publication, subject, class_name, chapter):
-    data = load_data()
-    chapter_data = data.get(publication, {}).get(subject, {}).get(class_name, {}).get(chapter, {})
-    return chapter_data  # returns JSON of all question types
+    version = bank.version
+    chapter_data = bank.chapter([publication, subject, class_name, chapter])
+    # returns JSON of all question types; the version lets index-based edits detect changes
+    return chapter_data, {'X-Bank-Version': str(version)}
 
 @app.route('/add_pulication', methods=['GET', 'POST'])
 def add_pulication():
-    data = load_data()
-    
-    # Extract existing values for dropdowns
-    publications = list(data.keys())
-    subjects = set()
-    classes = set()
-    chapters = set()
-    
-    # Collect all existing subjects, classes, and chapters
-    for pub, pub_data in data.items():
-        for subject, subject_data in pub_data.items():
-            subjects.add(subject)
-            for class_name, class_data in subject_data.items():
-                classes.add(class_name)
-                for chapter in class_data.keys():
-                    chapters.add(chapter)
-    
     if request.method == 'POST':
         publication = request.form['publication']
         subject = request.form['subject']
         class_name = request.form['class_name']
         chapter = request.form['chapter']
 
-        # Make sure each level is dict
-        if publication not in data:
-            data[publication] = {}
-        if subject not in data[publication]:
-            data[publication][subject] = {}
-        if class_name not in data[publication][subject]:
-            data[publication][subject][class_name] = {}
-        if chapter not in data[publication][subject][class_name]:
-            data[publication][subject][class_name][chapter] = {}
-
-        save_data(data)
+        # Make sure each level exists
+        bank.ensure([publication, subject, class_name, chapter])
         return redirect(url_for('add_question'))
 
-    return render_template('add_pulication.html',
-                         publications=sorted(publications),
-                         subjects=sorted(subjects),
-                         classes=sorted(classes),
-                         chapters=sorted(chapters))
-
-def rename_key_in_json(filename, publication, subject=None, class_name=None, chapter=None,
+    # Existing values for the dropdowns, already sorted by the index
+    names = taxonomy.distinct()
+    response = make_response(render_template('add_pulication.html',
+                             publications=names['publication'],
+                             subjects=names['subject'],
+                             classes=names['class_name'],
+                             chapters=names['chapter']))
+    response.add_etag()
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def rename_key_in_json(publication, subject=None, class_name=None, chapter=None,
                        new_publication=None, new_subject=None, new_class=None, new_chapter=None):
-    with open(filename, "r") as f:
-        data = json.load(f)
-
-    if new_publication and publication in data:
-        data[new_publication] = data.pop(publication)
+    if new_publication:
+        bank.rename([publication], new_publication)
         publication = new_publication  # update reference
 
-    if subject and new_subject and subject in data[publication]:
-        data[publication][new_subject] = data[publication].pop(subject)
+    if subject and new_subject:
+        bank.rename([publication, subject], new_subject)
         subject = new_subject
 
-    if class_name and new_class and class_name in data[publication][subject]:
-        data[publication][subject][new_class] = data[publication][subject].pop(class_name)
+    if class_name and new_class:
+        bank.rename([publication, subject, class_name], new_class)
         class_name = new_class
 
-    if chapter and new_chapter and chapter in data[publication][subject][class_name]:
-        data[publication][subject][class_name][new_chapter] = \
-            data[publication][subject][class_name].pop(chapter)
-
-    with open(filename, "w") as f:
-        json.dump(data, f, indent=4)
+    if chapter and new_chapter:
+        bank.rename([publication, subject, class_name, chapter], new_chapter)
 
 
 @app.route('/rename', methods=['GET', 'POST'])
 def rename_page():
-    data = load_data()
-    publications = list(data.keys())
+    publications = taxonomy.children([])
 
     if request.method == 'POST':
         old_pub = request.form.get('old_publication')
@@ -792,7 +1297,6 @@ def rename_page():
 
         # ✅ Only rename fields where new value is provided
         rename_key_in_json(
-            'data.json',
             publication=old_pub,
             subject=old_sub,
             class_name=old_class,
@@ -805,7 +1309,7 @@ def rename_page():
 
         return redirect(url_for('rename_page'))
 
-    return render_template('rename.html', publications=publications, data=data)
+    return render_template('rename.html', publications=publications)
 
 @app.route('/rename_question', methods=['GET', 'POST'])
 def rename_question():
@@ -817,42 +1321,42 @@ def rename_question():
             chapter = request.form['chapter']
             qtype = request.form['qtype']
             old_index = int(request.form['old_question_index'])
+            version = request.form.get('version') or None
 
-            with open('data.json', 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            qlist = data[publication][subject][class_name][chapter][qtype]
+            path = [publication, subject, class_name, chapter, qtype]
+            item = bank.chapter(path[:4])[qtype][old_index]
 
             # Handle different question types
             if qtype in ["Fill in the Blanks", "True/False", "One Word Answer"]:
-                qlist[old_index]['question'] = request.form['question_text']
-                qlist[old_index]['answer'] = request.form['answer_text']
+                item = dict(item)
+                item['question'] = request.form['question_text']
+                item['answer'] = request.form['answer_text']
                 
             elif qtype in ["Answer the Following", "Short Answer", "Long Answer"]:
-                qlist[old_index] = request.form['simple_question']
+                item = request.form['simple_question']
                 
             elif qtype == "Match the Following":
                 left = request.form['match_left']
                 right = request.form['match_right']
-                qlist[old_index] = {left: right}
+                item = {left: right}
                 
             elif qtype == "Choose the Best Answer":
-                qlist[old_index]['question'] = request.form['question_mcq']
-                qlist[old_index]['options'] = [
+                item = dict(item)
+                item['question'] = request.form['question_mcq']
+                item['options'] = [
                     request.form.get('option1', ''),
                     request.form.get('option2', ''),
                     request.form.get('option3', ''),
                     request.form.get('option4', '')
                 ]
-                qlist[old_index]['answer'] = request.form['answer_mcq']
+                item['answer'] = request.form['answer_mcq']
                 
             elif qtype == "Full Form":
                 abbr = request.form['abbr']
                 full = request.form['full_form']
-                qlist[old_index] = {abbr: full}
+                item = {abbr: full}
 
-            with open('data.json', 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=4, ensure_ascii=False)
+            bank.replace_question(path, old_index, item, expected_version=version)
 
             # Flash success message (uncomment if you want messages)
             # flash('Question updated successfully!', 'success')
@@ -861,18 +1365,20 @@ def rename_question():
         except KeyError as e:
             # flash(f'Error: Missing field - {e}', 'error')
             return redirect(url_for('rename_question'))
+        except ConflictError:
+            # flash('The question bank changed, please pick the question again.', 'error')
+            return redirect(url_for('rename_question'))
         except Exception as e:
             # flash(f'Error updating question: {str(e)}', 'error')
             return redirect(url_for('rename_question'))
 
-    data = load_data()
-    return render_template('rename_question.html', data=data)
+    # Questions are fetched per chapter from /questions, which also hands out the version to submit
+    return render_template('rename_question.html', publications=taxonomy.children([]),
+                           version=bank.version)
 
 
 @app.route('/delete_question', methods=['GET', 'POST'])
 def delete_question():
-    data = load_data()
-
     if request.method == 'POST':
         try:
             publication = request.form['publication']
@@ -881,35 +1387,35 @@ def delete_question():
             chapter = request.form['chapter']
             qtype = request.form['qtype']
             question_index = int(request.form['question_index'])  # Individual question index
-
-            # Get the specific question list
-            qlist = data[publication][subject][class_name][chapter][qtype]
+            version = request.form.get('version') or None
 
             # Remove the individual question by its index
-            if 0 <= question_index < len(qlist):
-                deleted_question = qlist.pop(question_index)
-                save_data(data)
+            if bank.delete_question([publication, subject, class_name, chapter, qtype], question_index,
+                                    expected_version=version):
                 # flash('Individual question deleted successfully!', 'success')
+                pass
             else:
                 # flash('Question not found!', 'error')
                 pass
 
             return redirect(url_for('delete_question'))
 
+        except ConflictError:
+            # flash('The question bank changed, please pick the question again.', 'error')
+            return redirect(url_for('delete_question'))
         except Exception as e:
             # flash(f'Error deleting question: {str(e)}', 'error')
             return redirect(url_for('delete_question'))
 
     # GET request
-    publications = list(data.keys())
-    return render_template("delete_question.html", data=data, publications=publications)
+    # Questions are fetched per chapter from /questions, which also hands out the version to submit
+    return render_template("delete_question.html", publications=taxonomy.children([]),
+                           version=bank.version)
 
 
 
 @app.route('/delete', methods=['GET', 'POST'])
 def delete_page():
-    data = load_data()
-
     if request.method == 'POST':
         publication = request.form.get('publication')
         subject = request.form.get('subject')
@@ -919,38 +1425,31 @@ def delete_page():
         try:
             if publication and not subject:  
                 # Delete entire publication
-                if publication in data:
-                    del data[publication]
+                bank.delete([publication])
 
             elif publication and subject and not class_name:  
                 # Delete subject
-                if subject in data[publication]:
-                    del data[publication][subject]
+                bank.delete([publication, subject])
 
             elif publication and subject and class_name and not chapter:  
                 # Delete class
-                if class_name in data[publication][subject]:
-                    del data[publication][subject][class_name]
+                bank.delete([publication, subject, class_name])
 
             elif publication and subject and class_name and chapter:  
                 # Delete chapter
-                if chapter in data[publication][subject][class_name]:
-                    del data[publication][subject][class_name][chapter]
+                bank.delete([publication, subject, class_name, chapter])
 
-            save_data(data)
             return redirect(url_for('delete_page'))
 
         except Exception as e:
             return f"❌ Error: {e}"
 
-    publications = list(data.keys())
-    return render_template("delete.html", data=data, publications=publications)
+    return render_template("delete.html", publications=taxonomy.children([]))
 
 @app.route("/view_questions", methods=["GET", "POST"])
 def view_questions():
-    data = load_data()
-    publications = list(data.keys())
-    questions_data = None
+    publications = taxonomy.children([])
+    chapters, questions_data = None, None
     selected_pub = selected_sub = selected_class = selected_chapter = None
 
     if request.method == "POST":
@@ -962,15 +1461,19 @@ def view_questions():
         if not (selected_pub and selected_sub and selected_class):
             return "❌ Please select Publication, Subject, and Class"
 
+        # Read just the chapters being shown, each one as the page reaches it
+        class_path = [selected_pub, selected_sub, selected_class]
         if selected_chapter:  # one chapter only
-            questions_data = {selected_chapter: data[selected_pub][selected_sub][selected_class][selected_chapter]}
+            chapters = [selected_chapter]
         else:  # all chapters of the class
-            questions_data = data[selected_pub][selected_sub][selected_class]
+            chapters = taxonomy.children(class_path)
+        questions_data = ((chapter, bank.chapter(class_path + [chapter])) for chapter in chapters)
 
-    return render_template(
+    # A whole class can hold thousands of questions, so the page is streamed
+    return stream_page(
         "view_questions.html",
-        data=data,
         publications=publications,
+        chapters=chapters,
         questions_data=questions_data,
         selected_pub=selected_pub,
         selected_sub=selected_sub,
@@ -980,7 +1483,6 @@ def view_questions():
     
 @app.route('/get_question_types', methods=['POST'])
 def get_question_types():
-    data = load_data()
     req = request.get_json()
 
     pub = req.get("publication")
@@ -989,23 +1491,19 @@ def get_question_types():
     chapters = req.get("chapters", [])
 
     # Collect all unique question types from selected chapters
-    question_types = set()
-    for chapter in chapters:
-        chapter_data = data.get(pub, {}).get(sub, {}).get(cls, {}).get(chapter, {})
-        for qtype in chapter_data.keys():
-            question_types.add(qtype)
+    question_types = set(taxonomy.categories([pub, sub, cls, chapter] for chapter in chapters))
 
     # Always add Manual Questions
     question_types.add("Manual Questions")
 
-    return jsonify({"types": list(question_types)})
+    # Sorted: set order follows string hashing, which differs between worker processes
+    return conditional_json({"types": sorted(question_types)})
 
 
 
 @app.route("/add_category", methods=["GET", "POST"])
 def add_category():
-    data = load_data()
-    publications = list(data.keys())
+    publications = taxonomy.children([])
 
     if request.method == "POST":
         pub = request.form["publication"]
@@ -1015,37 +1513,31 @@ def add_category():
         new_category = request.form["new_category"]
 
         if pub and sub and cls and chapter and new_category:
-            if new_category not in data[pub][sub][cls][chapter]:
-                data[pub][sub][cls][chapter][new_category] = []
-                save_data(data)
+            if new_category not in bank.children([pub, sub, cls, chapter]):
+                bank.ensure([pub, sub, cls, chapter, new_category])
                 return "✅ Category Added Successfully!"
             else:
                 return "⚠️ Category already exists!"
 
-    return render_template("add_category.html", publications=publications, data=data)
+    return render_template("add_category.html", publications=publications)
 
 @app.route("/get_categories/<pub>/<sub>/<cls>", methods=["GET"])
 def get_categories(pub, sub, cls):
     chapters_param = request.args.get("chapters", "")
     selected_chapters = chapters_param.split(",") if chapters_param else []
 
-    data = load_data()
-    categories = set()
+    categories = []
 
     try:
-        for chapter in selected_chapters:
-            chapter = chapter.strip()
-            if chapter and chapter in data.get(pub, {}).get(sub, {}).get(cls, {}):
-                cats = list(data[pub][sub][cls][chapter].keys())
-                categories.update(cats)
-    except Exception as e:
-        print("❌ Error fetching categories:", e)
+        categories = taxonomy.categories([pub, sub, cls, chapter.strip()]
+                                         for chapter in selected_chapters if chapter.strip())
+    except Exception:
+        logger.exception("Error fetching categories")
 
-    return {"categories": sorted(list(categories))}
+    return conditional_json({"categories": categories})
 
 @app.route('/delete_question_type', methods=['GET', 'POST'])
 def delete_question_type():
-    data = load_data()
     message = None
 
     if request.method == 'POST':
@@ -1055,23 +1547,50 @@ def delete_question_type():
         chap = request.form['chapter']
         qtype = request.form['qtype']
 
-        try:
-            # Delete the question type from that chapter
-            del data[pub][sub][cls][chap][qtype]
-            
-            # If chapter is empty after deletion, you can optionally delete chapter
-            if not data[pub][sub][cls][chap]:
-                del data[pub][sub][cls][chap]
-
-            save_data(data)
+        # Delete the question type from that chapter, and the chapter if it is left empty
+        if bank.delete([pub, sub, cls, chap, qtype], prune=True):
             message = f"Deleted all '{qtype}' questions from chapter '{chap}'."
-
-        except KeyError:
+        else:
             message = "Selected questions not found."
 
-    return render_template('delete_question_type.html', data=data, message=message)
+    return render_template('delete_question_type.html', publications=taxonomy.children([]),
+                           message=message)
+
+
+# Phase timings totalled per endpoint since the server started, in seconds
+@app.route('/timings')
+def timings():
+    return jsonify(phase_stats.snapshot())
+
+# Stored profiling reports; these pages need PROFILE_TOKEN too and are hidden without it
+@app.route('/admin/profiles')
+def profile_reports():
+    if not has_profile_token():
+        abort(404)
+    return render_template('profiles.html', reports=profiler.reports(), token=PROFILE_TOKEN)
+
+# One report as text, or (?format=prof) its raw pstats file
+@app.route('/admin/profiles/<report_id>')
+def profile_report(report_id):
+    if not has_profile_token():
+        abort(404)
+    raw = request.args.get('format') == 'prof'
+    path = profiler.path(report_id, '.prof' if raw else '.txt')
+    if path is None:
+        abort(404)
+    if raw:
+        return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                         download_name=report_id + '.prof')
+    return send_file(path, mimetype='text/plain')
+
+# Request counts and latencies, bank I/O times and cache hit ratios in the Prometheus
+# text format; each worker process keeps its own
+@app.route('/metrics')
+def metrics_page():
+    return Response(metrics.render(), content_type=Registry.CONTENT_TYPE)
 
 
 # Run app
 if __name__ == '__main__':
+    logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
     app.run(debug=True)
@@ -0,0 +1,34 @@
+import zipfile
+
+
+class _Sink:
+    """Write-only file object that hands back what was written since the last drain."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(files):
+    """Yield a ZIP archive chunk by chunk from an iterable of (name, bytes).
+
+    Each file is compressed and sent as soon as it is produced, so the
+    whole archive never sits in memory.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, payload in files:
+            archive.writestr(name, payload)
+            yield sink.drain()
+    yield sink.drain()
@@ -0,0 +1,113 @@
+"""Compare load/save time and file size of the snapshot formats.
+
+Scales data.json up by cloning its publications (half of the clones get
+Devanagari text) and times each codec on the result.
+
+    python bench_codec.py --scale 200
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import codec
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _devanagari(value):
+    if isinstance(value, str):
+        return value + ' — प्रश्न उत्तर'
+    if isinstance(value, list):
+        return [_devanagari(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _devanagari(v) for k, v in value.items()}
+    return value
+
+
+def scaled_bank(scale):
+    with open(os.path.join(HERE, 'data.json'), 'r', encoding='utf-8') as f:
+        base = json.load(f)
+    bank = {}
+    for i in range(scale):
+        for pub, subjects in base.items():
+            bank[f"{pub} #{i}"] = _devanagari(subjects) if i % 2 else subjects
+    return bank
+
+
+class LegacyCodec:
+    """What save_data used to write: indent=4 with ASCII escapes."""
+
+    name = 'legacy json'
+
+    def dumps(self, obj):
+        return json.dumps(obj, indent=4).encode('utf-8')
+
+    def loads(self, payload):
+        return json.loads(payload)
+
+
+class StdlibCodec(codec.JSONCodec):
+    name = 'compact json (stdlib)'
+
+    def dumps(self, obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, payload):
+        return json.loads(payload)
+
+
+class OrjsonCodec(codec.JSONCodec):
+    name = 'compact json (orjson)'
+
+
+def best_of(repeat, fn):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(bank, codecs, repeat):
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for c in codecs:
+            path = os.path.join(tmp, 'bank')
+
+            def save():
+                with open(path, 'wb') as f:
+                    f.write(c.dumps(bank))
+
+            def load():
+                with open(path, 'rb') as f:
+                    return c.loads(f.read())
+
+            save_s = best_of(repeat, save)
+            load_s = best_of(repeat, load)
+            assert load() == bank
+            rows.append((c.name, os.path.getsize(path), save_s, load_s))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, default=200, help='copies of data.json')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    bank = scaled_bank(args.scale)
+    codecs = [LegacyCodec(), StdlibCodec()]
+    if codec.orjson is not None:
+        codecs.append(OrjsonCodec())
+    codecs.append(codec.PICKLE)
+
+    print(f"{'format':<24}{'size':>12}{'save ms':>10}{'load ms':>10}")
+    for name, size, save_s, load_s in run(bank, codecs, args.repeat):
+        print(f"{name:<24}{size / 1024:>10.0f}KB{save_s * 1000:>10.1f}{load_s * 1000:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""Time every route of the app on synthetic banks of several sizes.
+
+Each scale runs in a fresh process, in a scratch directory holding a
+synthetic data.json (see synthetic_bank.py). Routes are driven through
+Flask's test client and timed over --repeat runs (median and slowest),
+then run once more under tracemalloc for their peak memory; load_data and
+save_data are timed directly, with the bank's cache dropped (cold) and
+kept (warm).
+
+    python bench_routes.py --scales small,medium --backend json --repeat 5
+    python bench_routes.py --scales 4x4x5x12x40 --output results.json
+
+A scale is a preset name or publications x subjects x classes x chapters x
+questions per type and chapter.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+from synthetic_bank import count_questions, make_bank
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCALES = {
+    'small': (1, 2, 2, 5, 10),
+    'medium': (2, 3, 4, 10, 25),
+    'large': (4, 4, 5, 12, 40),
+}
+
+
+def parse_scale(spec):
+    if spec in SCALES:
+        return SCALES[spec]
+    sizes = tuple(int(n) for n in spec.split('x'))
+    if len(sizes) != 5:
+        raise argparse.ArgumentTypeError(f"{spec!r}: expected a preset or PxSxCxCHxQ")
+    return sizes
+
+
+def _fetch(client, method, url, expect=400, **kwargs):
+    response = client.open(url, method=method, **kwargs)
+    response.get_data()  # streamed pages render while being read
+    response.close()
+    if response.status_code >= expect:
+        raise RuntimeError(f"{method} {url}: {response.status_code}")
+    return response
+
+
+def benchmarks(app):
+    """[(name, prepare)]: prepare() does any untimed setup and returns the call to time."""
+    client = app.app.test_client()
+    pub = app.taxonomy.children([])[0]
+    sub = app.taxonomy.children([pub])[0]
+    cls = app.taxonomy.children([pub, sub])[0]
+    chapters = app.taxonomy.children([pub, sub, cls])
+    chapter = chapters[0]
+    qtypes = sorted(app.taxonomy.categories([[pub, sub, cls, ch] for ch in chapters]))
+
+    form = {'publication': pub, 'subject': sub, 'class': cls, 'chapters': chapters}
+    for qtype in qtypes:
+        key = qtype.lower().replace(' ', '_')
+        form[f'{key}_count'] = '5'
+        form[f'{key}_mark'] = '1'
+    # The PDF fonts only print Latin script; synthetic banks alternate Latin and
+    # Devanagari chapters, and the Devanagari ones are named in it too
+    pdf_form = dict(form, chapters=[ch for ch in chapters if ch.isascii()])
+    seeds = iter(range(1, 1 << 30))
+    qpath = '/'.join((pub, sub, cls, chapter))
+    add = {'publication': pub, 'subject': sub, 'class': cls, 'chapter': chapter,
+           'qtype': 'Fill in the Blanks', 'fib_question': 'Benchmark ______.', 'fib_answer': 'x'}
+    fib = [pub, sub, cls, chapter, 'Fill in the Blanks']
+
+    def get(url):
+        return lambda: lambda: _fetch(client, 'GET', url)
+
+    def post(url, data=None, **kwargs):
+        def prepare():
+            body = data() if callable(data) else data
+            return lambda: _fetch(client, 'POST', url, data=body, **kwargs)
+        return prepare
+
+    def delete_last():
+        index = len(app.bank.chapter(fib[:4]).get(fib[4], [])) - 1
+        data = {'publication': pub, 'subject': sub, 'class_name': cls, 'chapter': chapter,
+                'qtype': fib[4], 'question_index': str(index)}
+        return lambda: _fetch(client, 'POST', '/delete_question', data=data)
+
+    def load_cold():
+        app.bank.invalidate()
+        return app.load_data
+
+    def save():
+        data = app.load_data()
+        return lambda: app.save_data(data)
+
+    return [
+        ('load_data (cold)', load_cold),
+        ('load_data (warm)', lambda: app.load_data),
+        ('save_data', save),
+        ('GET /', get('/')),
+        ('GET /get_subjects', get(f'/get_subjects/{pub}')),
+        ('GET /get_classes', get(f'/get_classes/{pub}/{sub}')),
+        ('GET /get_chapters', get(f'/get_chapters/{pub}/{sub}/{cls}')),
+        ('GET /hierarchy (all)', get('/hierarchy')),
+        ('GET /hierarchy (pub)', get(f'/hierarchy?publication={pub}')),
+        ('GET /get_questions', get(f'/get_questions/{qpath}')),
+        ('GET /questions (page)', get(f'/questions?publication={pub}&subject={sub}&class_name={cls}'
+                                      f'&chapter={chapter}&qtype=Fill in the Blanks')),
+        ('POST /get_question_types', post('/get_question_types', json={
+            'publication': pub, 'subject': sub, 'class': cls, 'chapters': chapters})),
+        ('GET /search', get(f'/search?q=light+water&publication={pub}')),
+        ('GET /get_categories', get(f"/get_categories/{pub}/{sub}/{cls}?chapters={','.join(chapters)}")),
+        ('POST /view_questions (class)', post('/view_questions', {
+            'publication': pub, 'subject': sub, 'class_name': cls})),
+        ('POST /generate (new paper)', post('/generate', lambda: dict(form, seed=str(next(seeds))))),
+        ('POST /generate (cached)', post('/generate', dict(form, seed='7'))),
+        ('POST /answer_key', post('/answer_key', dict(form, seed='7'))),
+        ('POST /blueprint', post('/blueprint', dict(form, target_marks='40'))),
+        ('POST /generate_pdf', post('/generate_pdf', lambda: dict(pdf_form, seed=str(next(seeds))))),
+        ('POST /generate_batch (3 sets)', post('/generate_batch', lambda: dict(
+            form, seed=str(next(seeds)), variants='3'))),
+        ('POST /add_question', post('/add_question', add)),
+        ('POST /delete_question', delete_last),
+        ('GET /metrics', get('/metrics')),
+    ]
+
+
+def run_scale(workdir, backend, repeat):
+    os.chdir(workdir)
+    os.environ['QUESTION_BANK_BACKEND'] = backend
+    sys.path.insert(0, HERE)
+    import app
+
+    rows = []
+    for name, prepare in benchmarks(app):
+        times = []
+        for _ in range(repeat):
+            call = prepare()
+            start = time.perf_counter()
+            call()
+            times.append(time.perf_counter() - start)
+        call = prepare()
+        tracemalloc.start()
+        call()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        rows.append({'route': name, 'median_ms': statistics.median(times) * 1000,
+                     'max_ms': max(times) * 1000, 'peak_kib': peak / 1024})
+    app.pdf_renderer.shutdown()
+    return rows, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', default='small,medium,large',
+                        help=f"comma-separated presets ({', '.join(SCALES)}) or PxSxCxCHxQ")
+    parser.add_argument('--backend', choices=['json', 'sqlite', 'sharded'], default='json')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='also write the results here as JSON')
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for spec in args.scales.split(','):
+        sizes = parse_scale(spec)
+        workdir = tempfile.mkdtemp(prefix='qb-bench-')
+        bank = make_bank(*sizes)
+        with open(os.path.join(workdir, 'data.json'), 'w', encoding='utf-8') as f:
+            json.dump(bank, f, ensure_ascii=False, separators=(',', ':'))
+        size = os.path.getsize(os.path.join(workdir, 'data.json'))
+        entries = count_questions(bank)
+        del bank
+        try:
+            # Not a multiprocessing.Pool: its daemonic workers could not start the PDF renderers
+            with ProcessPoolExecutor(1, mp_context=ctx) as pool:
+                rows, max_rss = pool.submit(run_scale, workdir, args.backend, args.repeat).result()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        print(f"\nscale={spec} ({'x'.join(map(str, sizes))}) backend={args.backend} "
+              f"entries={entries} data.json={size / 1024:.0f}KB max RSS={max_rss / 1024:.0f}MB")
+        print(f"{'route':<32}{'median ms':>11}{'max ms':>10}{'peak KiB':>11}")
+        for row in rows:
+            print(f"{row['route']:<32}{row['median_ms']:>11.2f}{row['max_ms']:>10.2f}{row['peak_kib']:>11.0f}")
+        results.append({'scale': spec, 'sizes': sizes, 'backend': args.backend, 'entries': entries,
+                        'bytes': size, 'max_rss_kib': max_rss, 'routes': rows})
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+import bisect
+import heapq
+import math
+import random
+
+from pools import sample
+
+# Marks are entered in steps such as 1, 2 or 0.5; the solver works in whole units of
+# the smallest of these scales that makes every mark and the target integral
+_SCALES = (1, 2, 4, 5, 10, 20, 100)
+# Largest target, in those units, the solver builds a table for (it holds one cost per unit)
+MAX_UNITS = 20000
+
+
+class BlueprintError(ValueError):
+    pass
+
+
+def _scale(values):
+    for scale in _SCALES:
+        if all(abs(v * scale - round(v * scale)) < 1e-9 for v in values):
+            return scale
+    raise BlueprintError("marks must be multiples of 0.01")
+
+
+def _merge(unit, types, share, limit):
+    """Cheapest split of each total number of questions over types of the same mark.
+
+    `types` are (index, low, high) with `unit` marks a question, costing
+    (count x unit - share)^2 apiece. Costs are convex, so adding one question
+    at a time where it costs least gives the best split of every total
+    (up to `limit` questions): returns (fewest, [cost of fewest + n], [type
+    index of the n-th added question]).
+    """
+    counts = {i: low for i, low, _ in types}
+    fewest = sum(counts.values())
+    cost = sum((low * unit - share) ** 2 for _, low, _ in types)
+    costs, order = [cost], []
+    heap = [(unit * (2 * low * unit + unit - 2 * share), i, high) for i, low, high in types if low < high]
+    heapq.heapify(heap)
+    while heap and fewest + len(order) < limit:
+        step, i, high = heapq.heappop(heap)
+        cost += step
+        costs.append(cost)
+        order.append(i)
+        counts[i] += 1
+        if counts[i] < high:
+            heapq.heappush(heap, (unit * (2 * counts[i] * unit + unit - 2 * share), i, high))
+    return fewest, costs, order
+
+
+def _convolve(values, kernel, low):
+    """best[j] = min over i of values[i] + kernel[j - i - low], and the j - i reaching it.
+
+    The kernel is convex, so the i reaching the minimum does not go down as
+    j goes up and each row only searches between its neighbours' (divide and
+    conquer, O(n log n) rather than O(n x len(kernel))).
+    """
+    inf = float('inf')
+    n = len(values)
+    top = low + len(kernel) - 1
+    finite = [i for i, v in enumerate(values) if v != inf]
+    best, reach = [inf] * n, [0] * n
+    stack = [(0, n - 1, 0, len(finite) - 1)]
+    while stack:
+        first_row, last_row, lo, hi = stack.pop()
+        if first_row > last_row:
+            continue
+        j = (first_row + last_row) // 2
+        # Positions in `finite` of the columns row j can take at all
+        start = bisect.bisect_left(finite, j - top)
+        stop = bisect.bisect_right(finite, j - low) - 1
+        found = None
+        for p in range(max(lo, start), min(hi, stop) + 1):
+            i = finite[p]
+            c = values[i] + kernel[j - i - low]
+            if c <= best[j]:
+                best[j], found = c, p
+        if found is None:
+            # Unreachable: rows below can only use columns up to stop, rows above from start
+            stack.append((first_row, j - 1, lo, min(hi, stop)))
+            stack.append((j + 1, last_row, max(lo, start), hi))
+        else:
+            reach[j] = j - finite[found]
+            stack.append((first_row, j - 1, lo, found))
+            stack.append((j + 1, last_row, found, hi))
+    return best, reach
+
+
+def solve_counts(types, target):
+    """Question counts per type that add up to exactly `target` marks.
+
+    `types` is a list of (qtype, mark, low, high): every type gets between
+    low and high questions. Of all the ways to reach the target, the one
+    closest to an even split of the marks across the types is returned.
+    Types of the same mark are split greedily (_merge), and the knapsack
+    runs over the distinct marks only (_convolve), so large pools cost
+    O(marks x target x log target) rather than a pass per count. Raises
+    BlueprintError when no combination reaches the target, or when the
+    target needs more than MAX_UNITS steps of the smallest mark.
+    """
+    types = [(qtype, mark, low, high) for qtype, mark, low, high in types if high > 0 or low > 0]
+    for qtype, mark, low, high in types:
+        if mark <= 0:
+            raise BlueprintError(f"{qtype}: marks per question must be above 0")
+        if low > high:
+            raise BlueprintError(f"{qtype}: needs at least {low} questions but only {high} can be used")
+    if target <= 0:
+        raise BlueprintError("the target total must be above 0")
+    if not types:
+        raise BlueprintError("no question types to choose from")
+
+    lowest = sum(low * mark for _, mark, low, _ in types)
+    highest = sum(high * mark for _, mark, _, high in types)
+    unreachable = BlueprintError(f"no combination of questions adds up to {target:g} marks "
+                                 f"(these limits allow {lowest:g} to {highest:g})")
+    if not lowest - 1e-9 <= target <= highest + 1e-9:
+        raise unreachable
+
+    scale = _scale([target] + [mark for _, mark, _, _ in types])
+    units = [round(mark * scale) for _, mark, _, _ in types]
+    total = round(target * scale)
+    step = math.gcd(total, *units)
+    units = [u // step for u in units]
+    total //= step
+    if total > MAX_UNITS:
+        raise BlueprintError(f"a target of {target:g} marks is too large to work out with these marks")
+
+    # Even split: each type's share of the marks
+    share = total / len(types)
+    by_unit = {}
+    for i, ((_, _, low, high), unit) in enumerate(zip(types, units)):
+        by_unit.setdefault(unit, []).append((i, low, high))
+    groups = [(unit, _merge(unit, members, share, total // unit)) for unit, members in by_unit.items()]
+
+    inf = float('inf')
+    cost = [0.0] + [inf] * total
+    choices = []
+    for unit, (fewest, costs, _) in groups[:-1]:
+        best, choice = [inf] * (total + 1), [0] * (total + 1)
+        for residue in range(unit):
+            got, reach = _convolve(cost[residue::unit], costs, fewest)
+            best[residue::unit] = got
+            choice[residue::unit] = reach
+        cost = best
+        choices.append(choice)
+    # Only the target itself is needed from the last mark
+    unit, (fewest, costs, _) = groups[-1]
+    final, last = inf, None
+    for n, c in enumerate(costs):
+        reached = total - (fewest + n) * unit
+        if reached < 0:
+            break
+        if cost[reached] + c <= final:
+            final, last = cost[reached] + c, fewest + n
+    if last is None or final == inf:
+        raise unreachable
+
+    counts = [low for _, _, low, _ in types]
+    reached = total
+    for (unit, (fewest, _, order)), choice in zip(reversed(groups), [None] + choices[::-1]):
+        taken = last if choice is None else choice[reached]
+        reached -= taken * unit
+        for i in order[:taken - fewest]:
+            counts[i] += 1
+    return {qtype: count for (qtype, _, _, _), count in zip(types, counts)}
+
+
+def allocate(sizes, count):
+    """Split `count` draws over strata in proportion to their sizes (largest remainder),
+    never giving a stratum more than it holds."""
+    available = sum(sizes)
+    count = min(count, available)
+    if not count:
+        return [0] * len(sizes)
+    quotas = [count * size / available for size in sizes]
+    shares = [int(q) for q in quotas]
+    by_remainder = sorted(range(len(sizes)), key=lambda i: (shares[i] - quotas[i], i))
+    short = count - sum(shares)
+    for i in by_remainder:
+        if not short:
+            break
+        if shares[i] < sizes[i]:
+            shares[i] += 1
+            short -= 1
+    return shares
+
+
+def _cover(strata, shares, used):
+    """Move draws so every chapter that has questions gets at least one, where possible."""
+    picked = [sum(s.values()) for s in shares]
+    for empty, (_, records) in enumerate(strata):
+        if picked[empty]:
+            continue
+        for qtype in sorted(records):
+            if not any(id(r) not in used for r in records[qtype]):
+                continue
+            donors = [i for i, s in enumerate(shares) if s.get(qtype, 0) and picked[i] > 1]
+            if donors:
+                donor = max(donors, key=lambda i: (picked[i], -i))
+                shares[donor][qtype] -= 1
+                picked[donor] -= 1
+                shares[empty][qtype] = shares[empty].get(qtype, 0) + 1
+                picked[empty] += 1
+                break
+
+
+def pick_stratified(strata, question_counts, rng=random, cover=False, used=None, draw=sample):
+    """{qtype: selected records} like pools.pick_paper, with each type's draws spread over the chapters.
+
+    `strata` is [(chapter, {qtype: records})]. Each type's count is split
+    across the chapters in proportion to how many questions of that type
+    they hold; with cover=True, draws are then moved so every chapter gets
+    at least one question when there are enough to go round. Records whose
+    id() is in `used` are skipped, and the ones picked are added to it.
+    """
+    used = set() if used is None else used
+    shares = [{} for _ in strata]
+    for qtype, count in question_counts.items():
+        sizes = [sum(1 for r in records.get(qtype, ()) if id(r) not in used) for _, records in strata]
+        for i, share in enumerate(allocate(sizes, max(count, 0))):
+            if share:
+                shares[i][qtype] = share
+    if cover:
+        _cover(strata, shares, used)
+
+    picked = {qtype: [] for qtype in question_counts}
+    for (_, records), share in zip(strata, shares):
+        for qtype, n in share.items():
+            candidates = [r for r in records[qtype] if id(r) not in used]
+            picked[qtype].extend(draw(candidates, n, rng))
+    for selected in picked.values():
+        # Interleave the chapters rather than printing them one after another
+        rng.shuffle(selected)
+        used.update(id(r) for r in selected)
+    return picked
+
@@ -0,0 +1,55 @@
+import json
+import pickle
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+
+class JSONCodec:
+    """Compact UTF-8 JSON - orjson when installed, the stdlib otherwise.
+
+    Non-ASCII text (Devanagari etc.) is written as-is instead of \\uXXXX
+    escapes, and there is no indentation padding.
+    """
+
+    name = 'json'
+    suffix = '.json'
+
+    def dumps(self, obj):
+        if orjson is not None:
+            return orjson.dumps(obj)
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, payload):
+        if orjson is not None:
+            return orjson.loads(payload)
+        if isinstance(payload, bytes):
+            payload = payload.decode('utf-8')
+        return json.loads(payload)
+
+
+class PickleCodec:
+    """Binary snapshot; the fastest to load, but not human-editable."""
+
+    name = 'pickle'
+    suffix = '.pickle'
+
+    def dumps(self, obj):
+        return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, payload):
+        return pickle.loads(payload)
+
+
+JSON = JSONCodec()
+PICKLE = PickleCodec()
+CODECS = {codec.name: codec for codec in (JSON, PICKLE)}
+
+
+def get_codec(name):
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown codec {name!r}; expected one of {sorted(CODECS)}")
@@ -0,0 +1,254 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from fileio import FileLock, atomic_write
+from models import question_id
+
+DAY = 86400
+# Exposure below this is dropped when the log is compacted (about ten half-lives after one use)
+MIN_EXPOSURE = 1e-3
+
+
+class FenwickTree:
+    """Weights with O(log n) updates, prefix sums and weighted search."""
+
+    def __init__(self, weights):
+        self.weights = list(weights)
+        self._tree = [0.0] + self.weights
+        n = len(self._tree)
+        for i in range(1, n):
+            parent = i + (i & -i)
+            if parent < n:
+                self._tree[parent] += self._tree[i]
+
+    def __len__(self):
+        return len(self.weights)
+
+    def set(self, i, weight):
+        delta = weight - self.weights[i]
+        self.weights[i] = weight
+        i += 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def total(self):
+        total, i = 0.0, len(self.weights)
+        while i:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, target):
+        """Index whose weight interval holds `target` (0 <= target < total())."""
+        pos, step = 0, 1 << len(self.weights).bit_length()
+        while step:
+            nxt = pos + step
+            if nxt < len(self._tree) and self._tree[nxt] <= target:
+                pos = nxt
+                target -= self._tree[nxt]
+            step >>= 1
+        # Rounding can walk past the last index with non-zero weight
+        while pos >= len(self.weights) or self.weights[pos] == 0:
+            pos -= 1
+        return pos
+
+
+class UsageHistory:
+    """Which questions went into which papers, in an append-only log.
+
+    Each line records one paper: its id, when it was drawn and the question
+    ids per type. Exposure of a question is the number of papers it was in,
+    each use fading with the given half-life, kept as (value, as of) so an
+    update only touches the questions of the new paper. The log is shared
+    by all worker processes: refresh() folds in lines others have appended,
+    and it is compacted into a single snapshot line once `max_bytes` have
+    been appended after the last one. Compaction drops exposures that have
+    faded below MIN_EXPOSURE and papers older than `keep_days`, whose paper
+    codes then draw afresh.
+    """
+
+    def __init__(self, path, half_life_days=120, max_bytes=4 << 20, keep_days=365):
+        self.path = path
+        self.half_life = half_life_days * DAY
+        self.max_bytes = max_bytes
+        self.keep = keep_days * DAY
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(path + '.lock')
+        self._exposure = {}
+        self._papers = {}
+        self._paper_times = {}
+        self._offset = 0
+        self._snapshot_end = 0
+        self._inode = None
+        self._listeners = []
+        self.refresh()
+
+    def subscribe(self, listener):
+        """Call listener(ids) with the question ids whose exposure changed."""
+        self._listeners.append(listener)
+
+    def exposure(self, qid, now=None):
+        value, at = self._exposure.get(qid, (0.0, 0.0))
+        if not value:
+            return 0.0
+        now = time.time() if now is None else now
+        return value * 0.5 ** (max(now - at, 0) / self.half_life)
+
+    def recorded(self, paper_id):
+        """{qtype: [question ids]} of a paper drawn before, or None."""
+        self.refresh()
+        with self._lock:
+            return self._papers.get(paper_id)
+
+    def record(self, paper_id, picks):
+        """Log a new paper: {qtype: [question ids]} in the order they were drawn."""
+        line = json.dumps({'paper': paper_id, 'at': time.time(), 'picks': picks},
+                          ensure_ascii=False, separators=(',', ':')) + '\n'
+        with self._file_lock:
+            with open(self.path, 'ab') as f:
+                f.write(line.encode('utf-8'))
+            self.refresh()
+            if self._offset - self._snapshot_end > self.max_bytes:
+                self._compact()
+
+    def refresh(self):
+        """Fold in lines appended since the last call (by any process)."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        changed = []
+        with self._lock:
+            if st.st_ino != self._inode or st.st_size < self._offset:
+                # First load, or the log was compacted: start over
+                self._exposure.clear()
+                self._papers.clear()
+                self._paper_times.clear()
+                self._offset = 0
+                self._snapshot_end = 0
+                self._inode = st.st_ino
+                changed = None
+            if st.st_size == self._offset:
+                return
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                chunk = f.read(st.st_size - self._offset)
+            for line in chunk.splitlines(keepends=True):
+                if not line.endswith(b'\n'):
+                    break  # still being written
+                self._offset += len(line)
+                entry = json.loads(line)
+                if 'snapshot' in entry:
+                    self._snapshot_end = self._offset
+                ids = self._apply(entry)
+                if changed is not None:
+                    changed.extend(ids)
+            if changed is None:
+                changed = list(self._exposure)
+        for listener in self._listeners:
+            listener(changed)
+
+    def _apply(self, entry):
+        if 'snapshot' in entry:
+            self._exposure.update((qid, tuple(value)) for qid, value in entry['snapshot'].items())
+            self._papers.update(entry['papers'])
+            self._paper_times.update(entry.get('paper_times', {}))
+            return list(entry['snapshot'])
+        at = entry['at']
+        self._papers[entry['paper']] = entry['picks']
+        self._paper_times[entry['paper']] = at
+        ids = [qid for ids in entry['picks'].values() for qid in ids]
+        for qid in ids:
+            self._exposure[qid] = (self.exposure(qid, at) + 1.0, at)
+        return ids
+
+    def _compact(self):
+        now = time.time()
+        with self._lock:
+            # Papers from snapshots written before their times were kept count from now
+            times = {paper: self._paper_times.get(paper, now) for paper in self._papers}
+            kept = [paper for paper, at in times.items() if now - at <= self.keep]
+            snapshot = {'snapshot': {qid: list(value) for qid, value in self._exposure.items()
+                                     if self.exposure(qid, now) >= MIN_EXPOSURE},
+                        'papers': {paper: self._papers[paper] for paper in kept},
+                        'paper_times': {paper: times[paper] for paper in kept}}
+            atomic_write(self.path, json.dumps(snapshot, ensure_ascii=False, separators=(',', ':'))
+                         .encode('utf-8') + b'\n')
+        self.refresh()
+
+
+class ExposureSampler:
+    """Draws questions with odds that fall the more recently and often they were used.
+
+    A question's weight is 1 / (1 + strength x exposure). Each pool (a
+    tuple of records from PoolCache) gets a Fenwick tree of its weights,
+    so a draw of k questions costs O(k log n); when a paper is recorded
+    only the weights of its questions are updated in the cached trees.
+    Trees are rebuilt after `rebuild_after` seconds so older uses keep
+    fading.
+    """
+
+    def __init__(self, history, strength=4.0, size=64, rebuild_after=DAY):
+        self.history = history
+        self.strength = strength
+        self.size = size
+        self.rebuild_after = rebuild_after
+        self._lock = threading.Lock()
+        self._trees = OrderedDict()
+        history.subscribe(self._on_usage)
+
+    def weight(self, qid, now=None):
+        return 1.0 / (1.0 + self.strength * self.history.exposure(qid, now))
+
+    def _entry(self, pool, now):
+        key = id(pool)
+        entry = self._trees.get(key)
+        if entry is not None and entry[0] is pool and now - entry[4] < self.rebuild_after:
+            self._trees.move_to_end(key)
+            return entry
+        ids = [question_id(record) for record in pool]
+        positions = {}
+        for i, qid in enumerate(ids):
+            positions.setdefault(qid, []).append(i)
+        entry = (pool, ids, FenwickTree(self.weight(qid, now) for qid in ids), positions, now)
+        # Only the shared, cached tuples are worth keeping; per-call lists are not
+        if isinstance(pool, tuple):
+            self._trees[key] = entry
+            while len(self._trees) > self.size:
+                self._trees.popitem(last=False)
+        return entry
+
+    def draw(self, pool, k, rng):
+        """k distinct records of `pool`, weighted by exposure; same interface as pools.pick_paper's draw."""
+        now = time.time()
+        with self._lock:
+            _, _, tree, _, _ = self._entry(pool, now)
+            chosen = []
+            for _ in range(min(k, len(pool))):
+                total = tree.total()
+                if total <= 0:
+                    break
+                i = tree.find(rng.random() * total)
+                chosen.append((i, tree.weights[i]))
+                tree.set(i, 0.0)
+            for i, weight in chosen:
+                tree.set(i, weight)
+        return [pool[i] for i, _ in chosen]
+
+    def index(self, pool):
+        """{question id: record} for a pool."""
+        with self._lock:
+            _, ids, _, _, _ = self._entry(pool, time.time())
+        return dict(zip(ids, pool))
+
+    def _on_usage(self, ids):
+        now = time.time()
+        with self._lock:
+            for _, _, tree, positions, _ in self._trees.values():
+                for qid in ids:
+                    for i in positions.get(qid, ()):
+                        tree.set(i, self.weight(qid, now))
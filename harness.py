@@ -0,0 +1,138 @@
+"""Pieces shared by stress_writes.py and loadtest.py.
+
+Clients with one request() interface for the app in this process and for a
+running server, scratch banks to run against, the add and version-checked
+delete they both issue, and the check that every write landed.
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Status /add_question and /delete_question answer with when they worked (a redirect)
+WRITTEN = 302
+
+
+class TestClient:
+    """The app in this process, through Flask's test client."""
+
+    def __init__(self, app):
+        self.client = app.app.test_client()
+
+    def request(self, method, url, data=None, json_body=None):
+        response = self.client.open(url, method=method, data=data, json=json_body)
+        body = response.get_data()
+        response.close()
+        return response.status_code, body, response.headers
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPClient:
+    """A running server; redirects are reported, not followed."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(_NoRedirect)
+
+    def request(self, method, url, data=None, json_body=None):
+        headers = {}
+        payload = None
+        if json_body is not None:
+            payload = json.dumps(json_body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        elif data is not None:
+            payload = urllib.parse.urlencode(data, doseq=True).encode('utf-8')
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        req = urllib.request.Request(self.base_url + urllib.parse.quote(url, safe='/?=&%'),
+                                     data=payload, headers=headers, method=method)
+        try:
+            with self.opener.open(req, timeout=60) as response:
+                return response.status, response.read(), response.headers
+        except urllib.error.HTTPError as e:
+            return e.code, e.read(), e.headers
+
+
+def url_path(*parts):
+    return '/'.join(urllib.parse.quote(part, safe='') for part in parts)
+
+
+def scratch_bank(prefix, sizes=None):
+    """A temporary directory holding a copy of data.json, or a synthetic bank of the given sizes."""
+    workdir = tempfile.mkdtemp(prefix=prefix)
+    if sizes:
+        from synthetic_bank import make_bank
+        with open(os.path.join(workdir, 'data.json'), 'w', encoding='utf-8') as f:
+            json.dump(make_bank(*sizes), f, ensure_ascii=False, separators=(',', ':'))
+    else:
+        shutil.copy(os.path.join(HERE, 'data.json'), workdir)
+    return workdir
+
+
+def load_app(workdir, backend):
+    """app.py on the bank in workdir; the module is imported once per process."""
+    os.chdir(workdir)
+    os.environ['QUESTION_BANK_BACKEND'] = backend
+    sys.path.insert(0, HERE)
+    import app
+    return app
+
+
+# Writes under `path` ([publication, subject, class, chapter, qtype])
+
+def add_question(client, path, text):
+    status, _, _ = client.request('POST', '/add_question', data={
+        'publication': path[0], 'subject': path[1], 'class': path[2], 'chapter': path[3],
+        'qtype': path[4], 'normal_question': text})
+    return status
+
+
+def question_list(client, path):
+    """(questions, bank version they were read at)."""
+    status, body, headers = client.request('GET', f'/get_questions/{url_path(*path[:4])}')
+    questions = json.loads(body).get(path[4], []) if status == 200 else []
+    return questions, headers.get('X-Bank-Version')
+
+
+def delete_question(client, path, text):
+    """Delete `text` by index and bank version, retrying until it is gone; (status, attempts).
+
+    A write elsewhere between reading the list and deleting changes the
+    version, so the delete is refused and tried again; any other failure
+    ends the retries.
+    """
+    status, attempts = WRITTEN, 0
+    while True:
+        questions, version = question_list(client, path)
+        if text not in questions:
+            return status, attempts
+        status, _, _ = client.request('POST', '/delete_question', data={
+            'publication': path[0], 'subject': path[1], 'class_name': path[2],
+            'chapter': path[3], 'qtype': path[4],
+            'question_index': questions.index(text), 'version': version})
+        attempts += 1
+        if status != WRITTEN:
+            return status, attempts
+
+
+def check_writes(stored, added, deleted):
+    """(lost, unexpected) Counters: questions added and not deleted must be stored exactly once.
+
+    Only this run's questions count as unexpected, so a bank written to
+    before does not confuse the check.
+    """
+    stored, deleted = Counter(stored), set(deleted)
+    expected = Counter(q for q in added if q not in deleted)
+    lost = expected - stored
+    mine = set(added) | deleted
+    unexpected = Counter({q: n for q, n in (stored - expected).items() if q in mine})
+    return lost, unexpected
@@ -0,0 +1,88 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    """Progress and output of one background job."""
+
+    def __init__(self, total, label=''):
+        self.id = secrets.token_hex(8)
+        self.label = label
+        self.total = total
+        self.done = 0
+        self.status = 'queued'
+        self.files = []  # (name, bytes) in the order they were produced
+        self.errors = []
+        self.created = time.time()
+        self.finished = None
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'label': self.label,
+            'status': self.status,
+            'total': self.total,
+            'done': self.done,
+            'files': [name for name, _ in self.files],
+            'errors': list(self.errors),
+            'created': self.created,
+            'finished': self.finished,
+        }
+
+
+class JobQueue:
+    """In-process job runner: a small thread pool and the latest jobs' results.
+
+    submit() takes a work function that yields one (name, bytes) per
+    finished item, or (None, message) for an item that failed; progress is
+    counted per item. Finished jobs are kept in memory, oldest dropped
+    first once there are more than `keep`.
+    """
+
+    def __init__(self, workers=2, keep=20):
+        self.keep = keep
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, work, total, label=''):
+        job = Job(total, label)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim()
+        self._executor.submit(self._run, job, work)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        """Jobs, newest first."""
+        with self._lock:
+            return list(reversed(self._jobs.values()))
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished is not None]
+        while len(self._jobs) > self.keep and finished:
+            del self._jobs[finished.pop(0)]
+
+    def _run(self, job, work):
+        job.status = 'running'
+        try:
+            for name, payload in work():
+                if name is None:
+                    job.errors.append(payload)
+                else:
+                    job.files.append((name, payload))
+                job.done += 1
+            job.status = 'done'
+        except Exception as e:
+            job.errors.append(str(e))
+            job.status = 'failed'
+        job.finished = time.time()
+        with self._lock:
+            self._trim()
@@ -0,0 +1,79 @@
+import json
+import os
+
+from codec import JSON
+from fileio import atomic_write
+
+
+class Journal:
+    """Append-only log of bank mutations, one JSON object per line.
+
+    The first line is a header naming the snapshot the log applies to
+    (the snapshot file's [mtime_ns, size]) and the bank version of that
+    snapshot; a log whose base does not match the snapshot on disk has
+    already been folded into it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def size(self):
+        return self.stat()[1]
+
+    def stat(self):
+        """(inode, size) - the inode changes whenever the journal is reset."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None, 0
+        return st.st_ino, st.st_size
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def read(self, offset=0):
+        """Return (header, ops, end) for the complete lines after offset.
+
+        A torn last line (crash mid-append) is left out; `end` is the
+        offset just past the last complete line.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            return None, [], 0
+
+        header = None
+        ops = []
+        end = offset
+        for line in chunk.splitlines(keepends=True):
+            if not line.endswith(b'\n'):
+                break
+            record = JSON.loads(line)
+            end += len(line)
+            if 'op' in record:
+                ops.append(record)
+            else:
+                header = record
+        return header, ops, end
+
+    def append(self, op):
+        """Durably append one op and return the new journal size."""
+        line = JSON.dumps(op) + b'\n'
+        with open(self.path, 'ab') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
+
+    def truncate(self, size):
+        with open(self.path, 'r+b') as f:
+            f.truncate(size)
+            os.fsync(f.fileno())
+
+    def reset(self, base, seq=0):
+        """Atomically start an empty journal on top of snapshot `base`."""
+        header = json.dumps({'journal': 1, 'base': list(base) if base else None, 'seq': seq}) + '\n'
+        atomic_write(self.path, header.encode('utf-8'))
+        return len(header)
@@ -0,0 +1,239 @@
+"""Replay a mix of teacher requests from many processes and threads and report latency.
+
+Each thread loops until --duration is up, picking an operation by weight
+from --mix:
+
+    cascade   the generate page's dropdowns: subjects, classes, chapters, question types
+    generate  a new paper from a random set of chapters (POST /generate)
+    add       a new question (POST /add_question)
+    delete    one of the thread's own questions, by index and bank version (POST /delete_question)
+
+Questions are added under a "Load Test" publication. At the end the bank
+is read back: every question a thread added and did not delete must be
+there exactly once, so lost or misapplied writes show up.
+
+By default every worker process runs the app in-process on a scratch
+copy of data.json (or a synthetic bank, --scale); --url sends the same
+mix to a running server instead, which should be a scratch instance.
+
+    python loadtest.py --workers 4 --threads 8 --duration 30 --mix cascade=4,generate=3,add=2,delete=1
+    python loadtest.py --scale medium --backend sqlite
+    python loadtest.py --url http://127.0.0.1:5000 --workers 2 --threads 16
+"""
+import argparse
+import json
+import multiprocessing
+import random
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from harness import (WRITTEN, HTTPClient, TestClient, add_question, check_writes, delete_question, load_app,
+                     question_list, scratch_bank, url_path)
+
+PATH = ['Load Test', 'Writes', 'class 1', 'Chapter 1', 'Answer the Following']
+# Status each operation's requests answer with when they worked
+EXPECT = {'cascade': 200, 'generate': 200, 'add': WRITTEN, 'delete': WRITTEN}
+
+
+class Session:
+    """One simulated teacher: runs operations and records (operation, seconds, ok)."""
+
+    def __init__(self, client, name, rng):
+        self.client = client
+        self.name = name
+        self.rng = rng
+        self.samples = []
+        self.added = []
+        self.deleted = []
+        self.conflicts = 0
+        self._count = 0
+        self._publications = None
+
+    def _call(self, method, url, data=None, json_body=None):
+        return self.client.request(method, url, data, json_body)
+
+    def _json(self, url):
+        status, body, _ = self._call('GET', url)
+        if status != 200:
+            raise RuntimeError(f"GET {url}: {status}")
+        return json.loads(body)
+
+    def _pick(self, names):
+        if not names:
+            raise RuntimeError("empty dropdown")
+        return self.rng.choice(names)
+
+    def cascade(self):
+        """The generate page and its dropdowns, down to the question types of a class."""
+        if self._publications is None:
+            # The page lists them in its HTML; read once from the hierarchy instead of parsing it
+            tree = self._json('/hierarchy')['tree']
+            self._publications = [node['name'] for node in tree if node['name'] != PATH[0]]
+        self._call('GET', '/')
+        pub = self._pick(self._publications)
+        sub = self._pick(self._json(f'/get_subjects/{url_path(pub)}')['subjects'])
+        cls = self._pick(self._json(f'/get_classes/{url_path(pub, sub)}')['classes'])
+        chapters = self._json(f'/get_chapters/{url_path(pub, sub, cls)}')['chapters']
+        status, body, _ = self._call('POST', '/get_question_types', json_body={
+            'publication': pub, 'subject': sub, 'class': cls, 'chapters': chapters})
+        return status, (pub, sub, cls, chapters, json.loads(body)['types'] if status == 200 else [])
+
+    def generate(self):
+        for _ in range(10):
+            status, (pub, sub, cls, chapters, types) = self.cascade()
+            if chapters:
+                break
+        else:
+            raise RuntimeError("no class with chapters")
+        chosen = self.rng.sample(chapters, self.rng.randint(1, len(chapters)))
+        form = {'publication': pub, 'subject': sub, 'class': cls, 'chapters': chosen,
+                'seed': str(self.rng.randrange(1 << 30))}
+        for qtype in types:
+            key = qtype.lower().replace(' ', '_')
+            form[f'{key}_count'] = str(self.rng.randint(0, 5))
+            form[f'{key}_mark'] = str(self.rng.choice((1, 2, 5)))
+        # Only the paper itself is timed, not the dropdowns that chose it
+        start = time.perf_counter()
+        status, _, _ = self._call('POST', '/generate', data=form)
+        return status, time.perf_counter() - start
+
+    def add(self):
+        self._count += 1
+        text = f"{self.name}-q{self._count}"
+        status = add_question(self.client, PATH, text)
+        if status == EXPECT['add']:
+            self.added.append(text)
+        return status
+
+    def delete(self):
+        live = [q for q in self.added if q not in self.deleted]
+        if not live:
+            return self.add()  # nothing of its own to delete yet
+        victim = self.rng.choice(live)
+        status, attempts = delete_question(self.client, PATH, victim)
+        self.conflicts += max(attempts - 1, 0)
+        if victim not in question_list(self.client, PATH)[0]:
+            self.deleted.append(victim)
+        return status
+
+    def run(self, operation):
+        start = time.perf_counter()
+        try:
+            result = getattr(self, operation)()
+            if operation == 'cascade':
+                status, seconds = result[0], time.perf_counter() - start
+            elif operation == 'generate':
+                status, seconds = result
+            else:
+                status, seconds = result, time.perf_counter() - start
+            ok = status == EXPECT[operation]
+        except Exception:
+            seconds, ok = time.perf_counter() - start, False
+        self.samples.append((operation, seconds, ok))
+
+
+def _thread(client, name, mix, deadline, seed):
+    session = Session(client, name, random.Random(seed))
+    operations, weights = zip(*mix.items())
+    while time.monotonic() < deadline:
+        session.run(session.rng.choices(operations, weights)[0])
+    return session.samples, session.added, session.deleted, session.conflicts
+
+
+def _client(workdir, backend, url):
+    if url:
+        return lambda: HTTPClient(url)
+    app = load_app(workdir, backend)
+    return lambda: TestClient(app)
+
+
+def worker(workdir, backend, url, run, worker_id, threads, mix, duration):
+    make_client = _client(workdir, backend, url)
+    deadline = time.monotonic() + duration
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(
+            lambda t: _thread(make_client(), f"{run}-w{worker_id}-t{t}", mix, deadline,
+                              f"{run}:{worker_id}:{t}"),
+            range(threads)))
+    return ([s for r in results for s in r[0]], [q for r in results for q in r[1]],
+            [q for r in results for q in r[2]], sum(r[3] for r in results))
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of a sorted list."""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, -(-p * len(ordered) // 100) - 1))]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in EXPECT:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r} (choose from {', '.join(EXPECT)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4, help='processes')
+    parser.add_argument('--threads', type=int, default=8, help='threads per process')
+    parser.add_argument('--duration', type=float, default=20, help='seconds')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('cascade=4,generate=3,add=2,delete=1'))
+    parser.add_argument('--backend', choices=['json', 'sqlite', 'sharded'], default='json')
+    parser.add_argument('--scale', help='run on a synthetic bank (a bench_routes.py scale) instead of data.json')
+    parser.add_argument('--url', help='load a running server instead of in-process apps')
+    args = parser.parse_args()
+
+    workdir = None
+    if not args.url:
+        sizes = None
+        if args.scale:
+            from bench_routes import parse_scale
+            sizes = parse_scale(args.scale)
+        workdir = scratch_bank('qb-load-', sizes)
+
+    # Tags this run's questions, so a server loaded before does not confuse the write check
+    run = f"{random.randrange(16 ** 6):06x}"
+    ctx = multiprocessing.get_context('spawn')
+    start = time.perf_counter()
+    with ctx.Pool(args.workers) as pool:
+        results = pool.starmap(worker, [
+            (workdir, args.backend, args.url, run, w, args.threads, args.mix, args.duration)
+            for w in range(args.workers)])
+    elapsed = time.perf_counter() - start
+
+    samples = [s for r in results for s in r[0]]
+    added = [q for r in results for q in r[1]]
+    deleted = [q for r in results for q in r[2]]
+    conflicts = sum(r[3] for r in results)
+
+    # Read the writes back
+    stored, _ = question_list(_client(workdir, args.backend, args.url)(), PATH)
+    lost, extra = check_writes(stored, added, deleted)
+
+    target = args.url or f"in-process backend={args.backend}" + (f" scale={args.scale}" if args.scale else '')
+    print(f"{target}: {args.workers} processes x {args.threads} threads for {elapsed:.1f}s")
+    print(f"{'operation':<12}{'count':>8}{'errors':>8}{'per s':>9}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p99 ms':>10}{'max ms':>10}")
+    for operation in list(args.mix) + ['all']:
+        ops = [s for s in samples if operation in ('all', s[0])]
+        times = sorted(seconds * 1000 for _, seconds, _ in ops)
+        errors = sum(1 for *_, ok in ops if not ok)
+        print(f"{operation:<12}{len(ops):>8}{errors:>8}{len(ops) / elapsed:>9.1f}"
+              f"{percentile(times, 50):>10.1f}{percentile(times, 95):>10.1f}{percentile(times, 99):>10.1f}"
+              f"{(times[-1] if times else 0):>10.1f}")
+    print(f"writes: added={len(added)} deleted={len(deleted)} version conflicts retried={conflicts} "
+          f"lost={sum(lost.values())} unexpected={sum(extra.values())}")
+
+    if workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 1 if lost or extra else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+import math
+import threading
+from bisect import bisect_left
+
+# Prometheus' default latency buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per combination of label values."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *values, amount=1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, _labels(self.labels, key), value
+
+
+class Histogram:
+    """Observations counted into cumulative `le` buckets, with their sum and count."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def observe(self, amount, *values):
+        i = bisect_left(self.buckets, amount)
+        with self._lock:
+            entry = self._values.get(values)
+            if entry is None:
+                entry = self._values[values] = [[0] * len(self.buckets), 0.0]
+            entry[0][i] += 1
+            entry[1] += amount
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            running = 0
+            for bound, count in zip(self.buckets, counts):
+                running += count
+                yield (self.name + '_bucket', _labels(self.labels, key, [('le', _number(bound))]),
+                       running)
+            yield self.name + '_sum', _labels(self.labels, key), total
+            yield self.name + '_count', _labels(self.labels, key), running
+
+
+class Collected:
+    """Metric read when scraped: `collect()` returns {label values: number}."""
+
+    def __init__(self, name, help, kind, labels, collect):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def samples(self):
+        for key, value in sorted(self.collect().items()):
+            yield self.name, _labels(self.labels, key), value
+
+
+class Registry:
+    """The metrics of one process, rendered in the Prometheus text format (0.0.4)."""
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collected(self, name, help, kind, labels, collect):
+        return self.register(Collected(name, help, kind, labels, collect))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_number(value)}")
+        return '\n'.join(lines) + '\n'
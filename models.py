@@ -0,0 +1,184 @@
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+
+MCQ = "Choose the Best Answer"
+MATCH = "Match the Following"
+FULL_FORM = "Full Form"
+DEFAULT_OPTIONS = ('Option A', 'Option B', 'Option C', 'Option D')
+
+
+class Question:
+    """A question with an optional answer (FIB, True/False, One Word, essays...)."""
+
+    __slots__ = ('question', 'answer')
+
+    def __init__(self, question, answer=''):
+        self.question = question
+        self.answer = answer
+
+    def as_paper(self):
+        return self.question
+
+    def key(self):
+        return self.question
+
+    def answer_text(self):
+        return self.answer
+
+    def __repr__(self):
+        return f"Question({self.question!r}, {self.answer!r})"
+
+
+class MultipleChoice:
+    __slots__ = ('question', 'options', 'answer')
+
+    def __init__(self, question, options=DEFAULT_OPTIONS, answer=''):
+        self.question = question
+        self.options = tuple(options)
+        self.answer = answer
+
+    def as_paper(self):
+        return {'question': self.question, 'options': list(self.options)}
+
+    def key(self):
+        return self.question
+
+    def answer_text(self):
+        """The answer, led by its option letter when it is one of the options."""
+        answer = self.answer.strip()
+        for letter, option in zip('abcd', self.options):
+            if answer and answer.lower() in (option.strip().lower(), letter):
+                return f"{letter}. {option}"
+        return answer
+
+    def __repr__(self):
+        return f"MultipleChoice({self.question!r}, {self.options!r}, {self.answer!r})"
+
+
+class MatchPair:
+    __slots__ = ('left', 'right')
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+
+    def as_paper(self):
+        return (self.left, self.right)
+
+    def key(self):
+        return f"{self.left}\x00{self.right}"
+
+    def answer_text(self):
+        return self.right
+
+    def __repr__(self):
+        return f"MatchPair({self.left!r}, {self.right!r})"
+
+
+class FullForm:
+    __slots__ = ('abbr', 'expansion')
+
+    def __init__(self, abbr, expansion=''):
+        self.abbr = abbr
+        self.expansion = expansion
+
+    def as_paper(self):
+        return self.abbr
+
+    def key(self):
+        return self.abbr
+
+    def answer_text(self):
+        return self.expansion
+
+    def __repr__(self):
+        return f"FullForm({self.abbr!r}, {self.expansion!r})"
+
+
+def question_id(record):
+    """Stable id of a question: its kind and wording, hashed, so it survives restarts
+    and edits elsewhere in the bank."""
+    text = f"{type(record).__name__}\x00{record.key()}"
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def normalize_item(qtype, item):
+    """Records for one raw bank entry; malformed entries give none.
+
+    Mirrors what generate_question_paper accepted: plain strings, {question,
+    answer} dicts, MCQ dicts, {abbr: full} / {left: right} dicts (possibly
+    holding several pairs) and [left, right] lists.
+    """
+    if qtype == MCQ:
+        if isinstance(item, dict) and 'question' in item:
+            return [MultipleChoice(item['question'], item.get('options') or DEFAULT_OPTIONS,
+                                   item.get('answer') or '')]
+        if isinstance(item, str):
+            return [MultipleChoice(item)]
+        return []
+
+    if qtype == MATCH:
+        if isinstance(item, dict):
+            return [MatchPair(k.strip(), v.strip()) for k, v in item.items()]
+        if isinstance(item, (list, tuple)) and len(item) == 2:
+            return [MatchPair(item[0].strip(), item[1].strip())]
+        return []
+
+    if qtype == FULL_FORM:
+        if isinstance(item, dict):
+            return [FullForm(abbr, full) for abbr, full in item.items()]
+        if isinstance(item, str):
+            return [FullForm(item)]
+        return []
+
+    if isinstance(item, dict) and 'question' in item:
+        return [Question(item['question'], item.get('answer') or '')]
+    if isinstance(item, str):
+        return [Question(item)]
+    return []
+
+
+def normalize_chapter(chapter):
+    """{qtype: tuple of records} for one raw chapter dict; qtype names are interned."""
+    records = {}
+    for qtype, items in chapter.items():
+        qtype = sys.intern(qtype)
+        records[qtype] = tuple(
+            record for item in (items if isinstance(items, list) else ())
+            for record in normalize_item(qtype, item))
+    return records
+
+
+class RecordCache:
+    """LRU of normalised chapters keyed by path.
+
+    An entry stays valid while the backend hands back the very same raw
+    chapter object; every backend replaces (never edits) a chapter dict when
+    it changes, so identity is a free change check.
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, raw):
+        key = tuple(sys.intern(name) for name in path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is raw:
+                self._entries.move_to_end(key)
+                return entry[1]
+        records = normalize_chapter(raw)
+        with self._lock:
+            self._entries[key] = (raw, records)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return records
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
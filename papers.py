@@ -0,0 +1,182 @@
+import secrets
+import threading
+from collections import OrderedDict
+
+MAX_SEED = 10 ** 6
+
+
+def new_seed():
+    """A fresh paper code; small enough to read out or type back in."""
+    return secrets.randbelow(MAX_SEED)
+
+
+def paper_key(spec, seed):
+    """Cache key of one paper: what was asked for, the seed and the bank version it was drawn at."""
+    return (
+        spec['publication'], spec['subject'], spec['class_name'], tuple(spec['chapters']),
+        tuple(sorted(spec['question_counts'].items())), tuple(sorted(spec['marks'].items())),
+        tuple(spec['questions'].get("Manual Questions", ())), spec['question_type'],
+        spec['manual_format'], spec['manual_mark'], spec.get('blueprint'), seed, spec['version'],
+    )
+
+
+class PaperItem:
+    """One question as printed, with the bank question it came from and its answer."""
+
+    __slots__ = ('id', 'question', 'answer')
+
+    def __init__(self, id, question, answer=''):
+        self.id = id
+        self.question = question
+        self.answer = answer
+
+    def __repr__(self):
+        return f"PaperItem({self.id!r}, {self.question!r}, {self.answer!r})"
+
+
+class CompiledPaper:
+    """A drawn paper: per question type, its items in print order, plus the word bank.
+
+    Everything the paper and its answer key print is here, so neither
+    needs the bank again. Match the Following items are (left, right)
+    with the right column already shuffled; their answer is the right
+    side that belongs to the left.
+    """
+
+    __slots__ = ('items', 'fill_options')
+
+    def __init__(self, items, fill_options=()):
+        self.items = items
+        self.fill_options = list(fill_options)
+
+    def questions(self):
+        """{qtype: printed entries}, as question_paper.html takes them."""
+        return {qtype: [item.question for item in items] for qtype, items in self.items.items()}
+
+    def ids(self):
+        return {qtype: [item.id for item in items] for qtype, items in self.items.items()}
+
+
+class PaperCache:
+    """LRU of rendered papers keyed by paper_key().
+
+    The bank version is part of the key, so entries never go stale; old
+    ones simply fall out of the LRU.
+    """
+
+    def __init__(self, size=128):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+# Sections in the order question_paper.html prints them, with the mark each heading
+# falls back to when none was given (None: print the mark as entered)
+PAPER_SECTIONS = (
+    ("Fill in the Blanks", 1), ("Choose the Best Answer", None), ("True/False", 1),
+    ("Match the Following", 1), ("Full Form", 1), ("One Word Answer", 1),
+    ("Short Answer", 2), ("Long Answer", 5), ("Answer the Following", None),
+    ("Manual Questions", 5),
+)
+
+
+def paper_document(context):
+    """Plain-data layout of a rendered paper (the question_paper.html context) for the PDF writer."""
+    title = "Question Paper"
+    if context.get('variant'):
+        title += f" - Set {context['variant']}"
+    document = {
+        'title': title,
+        'code': context.get('seed'),
+        'info': [("Subject", context['subject']), ("Class", context['class_name']),
+                 ("Total Marks", f"{context['total_marks']:g}")],
+        'sections': [],
+    }
+    questions, counts = context['questions'], context['counts']
+    number = 1
+    for qtype, default in PAPER_SECTIONS:
+        items = questions.get(qtype)
+        if not items:
+            continue
+        mark = context['marks'].get(qtype) or default or 0
+        heading = context['question_type'] if qtype == "Manual Questions" else qtype
+        section = {
+            'heading': f"{number}. {heading}",
+            'marks': f"[{counts[qtype]} × {mark:g} = {counts[qtype] * mark:g} marks]",
+            'kind': 'list', 'items': list(items),
+        }
+        if qtype == "Fill in the Blanks" and context['fill_options']:
+            section['word_bank'] = f"[{', '.join(context['fill_options'])}]"
+        if qtype == "Choose the Best Answer":
+            section['kind'] = 'mcq'
+        elif qtype == "Match the Following":
+            section['kind'] = 'match'
+        elif qtype == "Manual Questions":
+            section['kind'] = 'numbered' if context['output_format'] == 'numbered' else 'text'
+        document['sections'].append(section)
+        number += 1
+    return document
+
+
+def answer_sections(paper):
+    """Answer key of a CompiledPaper in paper order: [{'heading', 'kind', 'rows': [(question, answer)]}]."""
+    sections = []
+    number = 1
+    for qtype, _ in PAPER_SECTIONS:
+        items = paper.items.get(qtype)
+        if not items:
+            continue
+        rows = []
+        for item in items:
+            question = item.question
+            if isinstance(question, dict):
+                question = question['question']
+            elif isinstance(question, tuple):
+                question = question[0]
+            rows.append((question, item.answer))
+        sections.append({'heading': f"{number}. {qtype}", 'kind': 'match' if qtype == "Match the Following" else 'list',
+                         'rows': rows})
+        number += 1
+    return sections
+
+
+def answer_key_document(context):
+    """paper_document() counterpart for an answer key context, for the PDF writer."""
+    title = "Answer Key"
+    if context.get('variant'):
+        title += f" - Set {context['variant']}"
+    document = {
+        'title': title,
+        'code': context.get('seed'),
+        'info': [("Subject", context['subject']), ("Class", context['class_name']), ("", "")],
+        'sections': [],
+    }
+    for section in context['sections']:
+        entry = {'heading': section['heading'], 'marks': '', 'kind': section['kind']}
+        if section['kind'] == 'match':
+            entry['items'] = section['rows']
+            entry['columns'] = ("Column A", "Matches")
+        else:
+            entry['items'] = [f"{question}  -  {answer or 'no answer recorded'}"
+                              for question, answer in section['rows']]
+        document['sections'].append(entry)
+    return document
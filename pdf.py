@@ -0,0 +1,321 @@
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4, in points
+MARGIN = 54
+BODY_SIZE = 11
+LEADING = 1.35
+
+# The two standard Type 1 fonts the paper uses; every PDF reader has them, so
+# nothing is embedded. Text is WinAnsi (cp1252) encoded, so documents holding
+# characters outside it (Devanagari, for one) are refused by check_text().
+FONTS = {'F1': 'Times-Roman', 'F2': 'Times-Bold'}
+
+# Advance widths of ' ' through '~' per 1000 units of font size (Adobe AFM metrics)
+_WIDTHS = {
+    'F1': (
+        250, 333, 408, 500, 500, 833, 778, 180, 333, 333, 500, 564, 250, 333, 250, 278,
+        500, 500, 500, 500, 500, 500, 500, 500, 500, 500, 278, 278, 564, 564, 564, 444,
+        921, 722, 667, 667, 722, 611, 556, 722, 722, 333, 389, 722, 611, 889, 722, 722,
+        556, 722, 667, 556, 611, 722, 722, 944, 722, 722, 611, 333, 278, 333, 469, 500,
+        333, 444, 500, 444, 500, 444, 333, 500, 500, 278, 278, 500, 278, 778, 500, 500,
+        500, 500, 333, 389, 278, 500, 500, 722, 500, 500, 444, 480, 200, 480, 541,
+    ),
+    'F2': (
+        250, 333, 555, 500, 500, 1000, 833, 278, 333, 333, 500, 570, 250, 333, 250, 278,
+        500, 500, 500, 500, 500, 500, 500, 500, 500, 500, 333, 333, 570, 570, 570, 500,
+        930, 722, 667, 722, 722, 667, 611, 778, 778, 389, 500, 778, 667, 944, 722, 778,
+        611, 778, 722, 556, 667, 722, 722, 1000, 722, 722, 667, 333, 278, 333, 581, 500,
+        333, 500, 556, 444, 556, 444, 333, 500, 556, 278, 333, 556, 278, 833, 556, 500,
+        556, 556, 444, 389, 333, 556, 500, 722, 500, 500, 444, 394, 220, 394, 520,
+    ),
+}
+_DEFAULT_WIDTH = 556
+
+
+class UnsupportedText(ValueError):
+    pass
+
+
+def _strings(value):
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _strings(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _strings(item)
+
+
+def check_text(document):
+    """Raise UnsupportedText if the document has characters the PDF fonts cannot print."""
+    missing = set()
+    for text in _strings(document):
+        try:
+            text.encode('cp1252')
+        except UnicodeEncodeError:
+            missing.update(ch for ch in text if not ch.isspace() and ch.encode('cp1252', 'ignore') == b'')
+    if missing:
+        sample = ' '.join(sorted(missing)[:10])
+        raise UnsupportedText(f"the PDF fonts only print Latin text, and this paper also has {sample}"
+                              f"{' ...' if len(missing) > 10 else ''}; download it as HTML instead")
+
+
+def _encode(text):
+    text = str(text)
+    try:
+        return text.encode('cp1252')
+    except UnicodeEncodeError:
+        # Spaces WinAnsi lacks (thin, ideographic ...) print as plain ones; check_text refuses the rest
+        return ''.join(' ' if ch.isspace() else ch for ch in text).encode('cp1252', 'replace')
+
+
+def _width(data, font, size):
+    widths = _WIDTHS[font]
+    return sum(widths[b - 32] if 32 <= b < 127 else _DEFAULT_WIDTH for b in data) * size / 1000
+
+
+def _escape(data):
+    return data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def _wrap(text, font, size, width):
+    """Encoded lines of at most `width` points; explicit newlines are kept."""
+    lines = []
+    for paragraph in _encode(text).split(b'\n'):
+        line = b''
+        for word in paragraph.split():
+            candidate = line + b' ' + word if line else word
+            if _width(candidate, font, size) <= width:
+                line = candidate
+                continue
+            if line:
+                lines.append(line)
+            # A word wider than the line is broken wherever it runs out of room
+            while _width(word, font, size) > width:
+                cut = 1
+                while cut < len(word) and _width(word[:cut + 1], font, size) <= width:
+                    cut += 1
+                lines.append(word[:cut])
+                word = word[cut:]
+            line = word
+        lines.append(line)
+    return lines
+
+
+class _Layout:
+    """Pages of content-stream operators, filled top to bottom."""
+
+    def __init__(self):
+        self.pages = []
+        self.y = 0
+        self._new_page()
+
+    def _new_page(self):
+        self.pages.append([])
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def need(self, height):
+        if self.y - height < MARGIN:
+            self._new_page()
+
+    def space(self, height):
+        self.y -= height
+
+    def text(self, x, data, font='F1', size=BODY_SIZE):
+        self.pages[-1].append(
+            b'BT /%s %g Tf %.2f %.2f Td (%s) Tj ET' % (font.encode(), size, x, self.y, _escape(data)))
+
+    def rule(self, x1, x2, y=None, width=0.8):
+        y = self.y if y is None else y
+        self.pages[-1].append(b'%g w %.2f %.2f m %.2f %.2f l S' % (width, x1, y, x2, y))
+
+    def paragraph(self, text, x=MARGIN, font='F1', size=BODY_SIZE, label=None):
+        """Wrapped text at x; a label ('a.') hangs to its left on the first line."""
+        height = size * LEADING
+        lines = _wrap(text, font, size, PAGE_WIDTH - MARGIN - x)
+        for n, line in enumerate(lines):
+            self.need(height)
+            self.space(height)
+            if n == 0 and label:
+                self.text(x - _width(_encode(label), font, size) - 4, _encode(label), font, size)
+            self.text(x, line, font, size)
+
+    def centered(self, text, font='F2', size=BODY_SIZE):
+        data = _encode(text)
+        self.need(size * LEADING)
+        self.space(size * LEADING)
+        self.text((PAGE_WIDTH - _width(data, font, size)) / 2, data, font, size)
+
+
+def _letter(n):
+    return chr(ord('a') + n % 26) + '.'
+
+
+def _section(layout, section):
+    height = BODY_SIZE * LEADING
+    # Keep a heading with at least the first line of its section
+    layout.need(height * 3)
+    layout.space(height * 0.6)
+    heading = _encode(section['heading'] + ' ')
+    layout.space(height)
+    layout.text(MARGIN, heading, 'F2')
+    layout.text(MARGIN + _width(heading, 'F2', BODY_SIZE), _encode(section['marks']))
+    layout.space(height * 0.3)
+
+    indent = MARGIN + 22
+    if section.get('word_bank'):
+        layout.paragraph("Word Bank: " + section['word_bank'], indent)
+        layout.space(height * 0.3)
+
+    kind = section['kind']
+    if kind == 'match':
+        middle = (indent + PAGE_WIDTH - MARGIN) / 2
+        column = middle - indent - 12
+        first, second = section.get('columns', ("Column A", "Column B"))
+        rows = [(first, second, 'F2')] + [(left, right, 'F1') for left, right in section['items']]
+        for left, right, font in rows:
+            left_lines = _wrap(left, font, BODY_SIZE, column)
+            right_lines = _wrap(right, font, BODY_SIZE, column)
+            layout.need(height * max(len(left_lines), len(right_lines)) + 4)
+            layout.space(2)
+            for n in range(max(len(left_lines), len(right_lines))):
+                layout.space(height)
+                if n < len(left_lines):
+                    layout.text(indent, left_lines[n], font)
+                if n < len(right_lines):
+                    layout.text(middle, right_lines[n], font)
+            layout.rule(indent, PAGE_WIDTH - MARGIN, layout.y - 5, 0.5)
+            layout.space(5)
+    elif kind == 'text':
+        layout.paragraph(section['items'][0], indent)
+    else:
+        for n, item in enumerate(section['items']):
+            label = f"{n + 1}." if kind == 'numbered' else _letter(n)
+            if kind == 'mcq':
+                layout.paragraph(item['question'], indent, label=label)
+                options = "     ".join(f"{_letter(i)} {option}" for i, option in enumerate(item['options'][:4]))
+                layout.paragraph(options, indent + 14)
+            else:
+                layout.paragraph(item, indent, label=label)
+
+
+def _layout(document):
+    layout = _Layout()
+    layout.centered(document['title'].upper(), 'F2', 16)
+    if document.get('code') is not None:
+        layout.centered(f"Paper code: {document['code']}", 'F1', 9)
+    layout.space(BODY_SIZE)
+
+    # Subject left, class centred, total marks right, as on the HTML paper
+    cells = [_encode(f"{label}: {value}" if label else "") for label, value in document['info']]
+    layout.space(BODY_SIZE * LEADING)
+    positions = [MARGIN, (PAGE_WIDTH - _width(cells[1], 'F1', BODY_SIZE)) / 2,
+                 PAGE_WIDTH - MARGIN - _width(cells[2], 'F1', BODY_SIZE)]
+    for x, cell in zip(positions, cells):
+        layout.text(x, cell)
+    layout.space(8)
+    layout.rule(MARGIN, PAGE_WIDTH - MARGIN, width=1.5)
+    layout.space(4)
+
+    for section in document['sections']:
+        _section(layout, section)
+
+    total = len(layout.pages)
+    for n, page in enumerate(layout.pages, 1):
+        footer = _encode(f"Page {n} of {total}")
+        page.append(b'BT /F1 9 Tf %.2f %.2f Td (%s) Tj ET'
+                    % ((PAGE_WIDTH - _width(footer, 'F1', 9)) / 2, MARGIN / 2, footer))
+    return layout.pages
+
+
+def render_pdf(document):
+    """PDF bytes for a papers.paper_document() layout."""
+    pages = _layout(document)
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        None,  # page tree, once the page objects are numbered
+    ]
+    fonts = b''
+    for name, base in FONTS.items():
+        objects.append(b'<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>'
+                       % base.encode())
+        fonts += b'/%s %d 0 R ' % (name.encode(), len(objects))
+
+    kids = []
+    for page in pages:
+        stream = zlib.compress(b'\n'.join(page))
+        objects.append(b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (len(stream), stream))
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << %s>> >> '
+                       b'/Contents %d 0 R >>' % (PAGE_WIDTH, PAGE_HEIGHT, fonts, len(objects)))
+        kids.append(b'%d 0 R' % len(objects))
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(kids), len(kids))
+
+    out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for offset in offsets:
+        out += b'%010d 00000 n \n' % offset
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+class RendererBusy(Exception):
+    pass
+
+
+class PDFRenderer:
+    """render_pdf() in a bounded pool of worker processes.
+
+    Layout is pure Python and CPU bound, so it runs outside the web
+    process's GIL. At most `backlog` documents are queued or rendering at
+    once; past that, render() raises RendererBusy instead of queueing more
+    work. The pool is started on first use.
+    """
+
+    def __init__(self, workers=2, backlog=8, timeout=60):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(backlog)
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    def submit(self, document, block=False):
+        """Future of the PDF bytes for `document`.
+
+        With block=True, waits (up to the timeout) for room in the backlog
+        rather than raising RendererBusy straight away. Raises UnsupportedText
+        (see check_text) before queueing a document it would misprint.
+        """
+        check_text(document)
+        acquired = self._slots.acquire(timeout=self.timeout) if block else self._slots.acquire(blocking=False)
+        if not acquired:
+            raise RendererBusy("too many PDFs are being rendered")
+        try:
+            future = self._executor().submit(render_pdf, document)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def render(self, document):
+        return self.submit(document).result(self.timeout)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
@@ -0,0 +1,203 @@
+import random
+import threading
+from collections import OrderedDict
+
+from models import MATCH, question_id
+from papers import CompiledPaper, PaperItem
+from timing import phase
+
+FILL_BLANKS = "Fill in the Blanks"
+# Redraws a set gets when it came out with the same questions as an earlier one
+VARIANT_ATTEMPTS = 10
+
+
+class PoolCache:
+    """Per-question-type candidate pools for a selection of chapters.
+
+    A selection (class path + ticked chapters) is scanned once: each
+    chapter's typed records are appended to the pool of their question type,
+    so the records keep their answers for answer keys and fill-in options.
+    Chapters and whole selections are cached; a write, by this process or
+    another (see BankBase.subscribe), drops the chapters it touched (and
+    every selection).
+    """
+
+    def __init__(self, bank, size=256):
+        self.bank = bank
+        self.size = size
+        self._lock = threading.Lock()
+        self._chapters = OrderedDict()
+        self._selections = OrderedDict()
+        self._version = None
+        # Lookups of whole selections and of single chapters, served from the cache or not
+        self.hits = {'selections': 0, 'chapters': 0}
+        self.misses = {'selections': 0, 'chapters': 0}
+        bank.subscribe(self._on_change)
+
+    def _put(self, cache, key, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.size:
+            cache.popitem(last=False)
+
+    def _chapter(self, version, path):
+        with self._lock:
+            records = self._chapters.get(path)
+            if records is not None:
+                self._chapters.move_to_end(path)
+                self.hits['chapters'] += 1
+                return records
+            self.misses['chapters'] += 1
+        with phase('load'):
+            records = self.bank.questions(list(path))
+        with self._lock:
+            if self._version == version:
+                self._put(self._chapters, path, records)
+        return records
+
+    def pools(self, class_path, chapters):
+        """(chapters that exist, {qtype: tuple of records}) for the given chapters of a class."""
+        version = self.bank.version
+        key = (tuple(class_path), tuple(chapters))
+        with self._lock:
+            if version != self._version:
+                self._reset(version)
+            cached = self._selections.get(key)
+            if cached is not None:
+                self._selections.move_to_end(key)
+                self.hits['selections'] += 1
+                return cached
+            self.misses['selections'] += 1
+
+        valid, pools = [], {}
+        for chapter in chapters:
+            records = self._chapter(version, key[0] + (chapter,))
+            if not records:
+                continue
+            valid.append(chapter)
+            for qtype, items in records.items():
+                pools.setdefault(qtype, []).extend(items)
+        result = (valid, {qtype: tuple(items) for qtype, items in pools.items()})
+
+        with self._lock:
+            if self._version == version:
+                self._put(self._selections, key, result)
+        return result
+
+    def strata(self, class_path, chapters):
+        """[(chapter, {qtype: records})] for the given chapters of a class that have questions."""
+        version = self.bank.version
+        with self._lock:
+            if version != self._version:
+                self._reset(version)
+        strata = []
+        for chapter in chapters:
+            records = self._chapter(version, tuple(class_path) + (chapter,))
+            if records:
+                strata.append((chapter, records))
+        return strata
+
+    def _reset(self, version):
+        self._chapters.clear()
+        self._selections.clear()
+        self._version = version
+
+    def _on_change(self, op, version):
+        with self._lock:
+            if op is None or self._version is None or version != self._version + 1:
+                self._reset(version)
+                return
+            self._version = version
+            self._selections.clear()
+            path = tuple(op['path'])
+            touched = [path]
+            if op['op'] == 'rename':
+                touched.append(path[:-1] + (op['name'],))
+            if op['op'] == 'delete' and op.get('prune'):
+                touched.append(path[:-1])
+            for cached in list(self._chapters):
+                if any(cached[:len(p)] == p or p[:len(cached)] == cached for p in touched):
+                    del self._chapters[cached]
+
+
+def sample(pool, k, rng):
+    """k distinct records of `pool`, drawn uniformly; the default `draw` of the pickers."""
+    return rng.sample(pool, k)
+
+
+def assemble_paper(picked, rng):
+    """CompiledPaper from {qtype: selected records}.
+
+    Match the Following keeps each pair's answer and shuffles the printed
+    right column; the Fill in the Blanks answers become the word bank.
+    """
+    items = {}
+    fill_options = []
+    for qtype, selected in picked.items():
+        if qtype == MATCH:
+            right = [pair.right for pair in selected]
+            rng.shuffle(right)
+            items[qtype] = [PaperItem(question_id(pair), (pair.left, shown), pair.right)
+                            for pair, shown in zip(selected, right)]
+        else:
+            items[qtype] = [PaperItem(question_id(record), record.as_paper(), record.answer_text())
+                            for record in selected]
+
+        if qtype == FILL_BLANKS:
+            fill_options = list(dict.fromkeys(r.answer for r in selected if r.answer.strip()))
+            rng.shuffle(fill_options)
+    return CompiledPaper(items, fill_options)
+
+
+def pick_paper(pools, question_counts, rng=random, draw=sample):
+    """{qtype: selected records}, each type's count drawn from its pool.
+
+    `draw(pool, k, rng)` picks k distinct records; the default gives every
+    record the same odds.
+    """
+    picked = {}
+    for qtype, count in question_counts.items():
+        pool = pools.get(qtype, ())
+        picked[qtype] = draw(pool, min(count, len(pool)), rng) if pool and count > 0 else []
+    return picked
+
+
+def distinct_variants(pick, variants, attempts=VARIANT_ATTEMPTS):
+    """`variants` results of pick() ({qtype: records}), no two with the same set of questions.
+
+    A set that repeats an earlier one is drawn again, up to `attempts`
+    times; when the pools are too small to give anything else it is kept.
+    Sets may still share some questions.
+    """
+    picked, seen = [], set()
+    for _ in range(variants):
+        for _ in range(attempts):
+            paper = pick()
+            questions = frozenset(question_id(r) for records in paper.values() for r in records)
+            if questions not in seen:
+                break
+        seen.add(questions)
+        picked.append(paper)
+    return picked
+
+
+def pick_variants(pools, question_counts, variants, rng=random, disjoint=False, draw=sample):
+    """`variants` pick_paper() results from the same pools.
+
+    Sets differ in at least one question where the pools allow it (see
+    distinct_variants). With disjoint=True no question appears in two
+    sets; every set then gets the same number of each type - the requested
+    count, or an equal share of the pool when it is too small for all sets
+    - so the sets stay worth the same marks.
+    """
+    if not disjoint:
+        return distinct_variants(lambda: pick_paper(pools, question_counts, rng, draw), variants)
+
+    picked = [{} for _ in range(variants)]
+    for qtype, count in question_counts.items():
+        pool = pools.get(qtype, ())
+        per_set = min(count, len(pool) // variants) if count > 0 else 0
+        drawn = draw(pool, per_set * variants, rng) if per_set else []
+        for n, paper in enumerate(picked):
+            paper[qtype] = drawn[n * per_set:(n + 1) * per_set]
+    return picked
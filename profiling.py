@@ -0,0 +1,136 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+import uuid
+
+_REPORT_ID = re.compile(r'^[0-9]{8}-[0-9]{6}-[0-9a-f]{6}$')
+
+
+class Session:
+    __slots__ = ('id', 'profile', 'started', 'baseline', 'owns_tracing')
+
+    def __init__(self, profile, started, baseline, owns_tracing):
+        # Known from the start, so the response can name the report it will get
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.profile = profile
+        self.started = started
+        self.baseline = baseline
+        self.owns_tracing = owns_tracing
+
+
+class RequestProfiler:
+    """Runs chosen requests under cProfile and tracemalloc and keeps their reports.
+
+    Each report is written to `directory` twice: <id>.prof holds the raw
+    pstats data (for pstats or snakeviz) and <id>.txt the slowest functions
+    and the lines that allocated the most. tracemalloc sees every thread, so
+    only one request is profiled at a time; a request that asks while
+    another is being profiled is served normally. The newest `keep` reports
+    are kept.
+    """
+
+    def __init__(self, directory, keep=50, top=40, frames=1):
+        self.directory = directory
+        self.keep = keep
+        self.top = top
+        self.frames = frames
+        self._busy = threading.Lock()
+
+    def start(self):
+        """Session for the calling thread's request, or None while another is profiled."""
+        if not self._busy.acquire(blocking=False):
+            return None
+        owns_tracing = not tracemalloc.is_tracing()
+        if owns_tracing:
+            tracemalloc.start(self.frames)
+            baseline = None
+        else:
+            # Traced from start-up (PYTHONTRACEMALLOC): report only what this request adds
+            baseline = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        profile = cProfile.Profile()
+        session = Session(profile, time.perf_counter(), baseline, owns_tracing)
+        profile.enable()
+        return session
+
+    def stop(self, session, label):
+        """End a session and write its report (under session.id)."""
+        session.profile.disable()
+        wall = time.perf_counter() - session.started
+        try:
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+            ))
+            peak = tracemalloc.get_traced_memory()[1]
+            if session.owns_tracing:
+                tracemalloc.stop()
+        finally:
+            self._busy.release()
+
+        if session.baseline is not None:
+            allocations = snapshot.compare_to(session.baseline, 'lineno')
+        else:
+            allocations = snapshot.statistics('lineno')
+
+        report_id = session.id
+        os.makedirs(self.directory, exist_ok=True)
+        session.profile.dump_stats(os.path.join(self.directory, report_id + '.prof'))
+
+        out = io.StringIO()
+        out.write(f"{label}\n")
+        out.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')}  wall {wall * 1000:.1f} ms  "
+                  f"peak traced memory {peak / 1024:.1f} KiB\n\n")
+        out.write(f"Top {self.top} functions by cumulative time\n")
+        stats = pstats.Stats(session.profile, stream=out)
+        stats.strip_dirs().sort_stats('cumulative').print_stats(self.top)
+        out.write(f"Top {self.top} lines by memory allocated and still held at the end\n\n")
+        for n, stat in enumerate(allocations[:self.top], 1):
+            frame = stat.traceback[0]
+            size = getattr(stat, 'size_diff', stat.size)
+            count = getattr(stat, 'count_diff', stat.count)
+            out.write(f"{n:>3}. {frame.filename}:{frame.lineno}  {size / 1024:.1f} KiB in {count} blocks\n")
+        with open(os.path.join(self.directory, report_id + '.txt'), 'w', encoding='utf-8') as f:
+            f.write(out.getvalue())
+
+        self._prune()
+
+    def _prune(self):
+        for report_id in [r['id'] for r in self.reports()][self.keep:]:
+            for suffix in ('.txt', '.prof'):
+                try:
+                    os.remove(os.path.join(self.directory, report_id + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def reports(self):
+        """[{'id', 'label', 'created'}] of the stored reports, newest first."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        reports = []
+        for name in sorted(names, reverse=True):
+            report_id, suffix = os.path.splitext(name)
+            if suffix != '.txt' or not _REPORT_ID.match(report_id):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                    label = f.readline().rstrip('\n')
+                created = os.path.getmtime(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            reports.append({'id': report_id, 'label': label, 'created': created})
+        return reports
+
+    def path(self, report_id, suffix):
+        """File of a stored report, or None for an unknown id."""
+        if not _REPORT_ID.match(report_id):
+            return None
+        path = os.path.join(self.directory, report_id + suffix)
+        return path if os.path.exists(path) else None
@@ -0,0 +1,219 @@
+import heapq
+import math
+import re
+import threading
+import unicodedata
+
+from models import FullForm, MatchPair, MultipleChoice, normalize_item
+from storage import CHAPTER_DEPTH
+
+# Word characters plus the combining marks and signs of the Indic script blocks (which
+# \w leaves out, splitting Devanagari words apart); the dandas stay separators
+_TOKEN = re.compile(r'[\w\u0300-\u036f\u0900-\u0963\u0966-\u0dff]+')
+
+
+def tokenize(text):
+    return _TOKEN.findall(unicodedata.normalize('NFKC', text).casefold())
+
+
+def _fields(qtype, item):
+    """(text, answer, options) shown for a raw bank entry, or None when it holds no question."""
+    records = normalize_item(qtype, item)
+    if not records:
+        return None
+    first = records[0]
+    if isinstance(first, MatchPair):
+        return '; '.join(f"{r.left} - {r.right}" for r in records), '', ()
+    if isinstance(first, MultipleChoice):
+        return first.question, first.answer, first.options
+    if isinstance(first, FullForm):
+        return first.abbr, first.expansion, ()
+    return first.question, first.answer, ()
+
+
+class _Postings:
+    """Documents and postings of one build of the index."""
+
+    def __init__(self):
+        self.postings = {}
+        self.docs = {}
+        self.chapters = {}
+        self.next_id = 0
+        self.total_length = 0
+
+    def add_chapter(self, key, chapter):
+        ids = []
+        for qtype, items in chapter.items():
+            if not isinstance(items, list):
+                continue
+            for index, item in enumerate(items):
+                fields = _fields(qtype, item)
+                if fields is None:
+                    continue
+                text, answer, options = fields
+                tokens = tokenize(' '.join((text, answer) + tuple(options)))
+                counts = {}
+                for token in tokens:
+                    counts[token] = counts.get(token, 0) + 1
+                doc_id = self.next_id
+                self.next_id += 1
+                self.docs[doc_id] = (key, qtype, index, len(tokens), text, answer, options, tuple(counts))
+                self.total_length += len(tokens)
+                for token, n in counts.items():
+                    self.postings.setdefault(token, {})[doc_id] = n
+                ids.append(doc_id)
+        if ids:
+            self.chapters[key] = ids
+
+    def remove_chapter(self, key):
+        for doc_id in self.chapters.pop(key, ()):
+            doc = self.docs.pop(doc_id)
+            self.total_length -= doc[3]
+            for token in doc[7]:
+                posting = self.postings[token]
+                del posting[doc_id]
+                if not posting:
+                    del self.postings[token]
+
+
+class SearchIndex:
+    """Inverted index over question text, answers, match pairs and MCQ options.
+
+    Every entry of a question list is one document, found by its chapter
+    path, question type and position in the list (the index that
+    delete_question and rename_question take). Queries match documents
+    holding all their words and are ranked with BM25.
+
+    The index subscribes to the bank: a write, by this process or replayed
+    from another one's, only marks the chapters under its path, and those
+    are re-read on the next search, so an edit costs one chapter rather
+    than the whole bank. The index is built by the first search, and when it
+    has to start over it is rebuilt aside while searches keep using the old
+    one.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, bank):
+        self.bank = bank
+        # _lock guards what the bank listener touches (version, dirty paths),
+        # _index_lock the current index, and _build_lock is held while one is
+        # filled from the bank. The bank is never called with _lock held:
+        # writers call _on_change with the bank's lock held.
+        self._lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._version = None
+        self._stale = True
+        self._dirty = set()
+        self._index = None
+        bank.subscribe(self._on_change)
+
+    # Index maintenance
+
+    def _read(self, index, prefix):
+        """Re-read every chapter under prefix (a chapter path or any shorter one) into index."""
+        for key in [k for k in index.chapters if k[:len(prefix)] == prefix]:
+            index.remove_chapter(key)
+        stack = [prefix]
+        while stack:
+            key = stack.pop()
+            if len(key) == CHAPTER_DEPTH:
+                index.add_chapter(key, self.bank.chapter(list(key)))
+            else:
+                stack.extend(key + (name,) for name in reversed(self.bank.children(list(key))))
+
+    def _sync(self):
+        version = self.bank.version
+        with self._lock:
+            full = self._stale or version != self._version
+            if full:
+                self._stale = False
+                self._version = version
+                self._dirty.clear()
+        if full:
+            with self._build_lock:
+                index = _Postings()
+                self._read(index, ())
+                with self._index_lock:
+                    self._index = index
+        # While a rebuild runs, the chapters written meanwhile stay marked
+        # for after the swap and searches use the index they have
+        if not self._build_lock.acquire(blocking=self._index is None):
+            return
+        try:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+            with self._index_lock:
+                # Parents first, so a chapter under a re-read subtree is not read twice
+                done = []
+                for prefix in sorted(dirty, key=len):
+                    if not any(prefix[:len(d)] == d for d in done):
+                        self._read(self._index, prefix)
+                        done.append(prefix)
+        finally:
+            self._build_lock.release()
+
+    def _on_change(self, op, version):
+        with self._lock:
+            if op is None or self._version is None or version != self._version + 1:
+                self._stale = True
+                return
+            self._version = version
+            path = tuple(op['path'])
+            self._dirty.add(path[:CHAPTER_DEPTH])
+            if op['op'] == 'rename' and len(path) <= CHAPTER_DEPTH:
+                self._dirty.add(path[:-1] + (op['name'],))
+
+    # Queries
+
+    def search(self, query, filters=None, qtype=None, limit=20, offset=0):
+        """(total matches, [result dicts]) for documents holding every word of `query`.
+
+        `filters` is a path prefix ([publication, subject, class, chapter],
+        any leading part) and `qtype` a question type to stay within.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        prefix = tuple(filters or ())
+        if not terms:
+            return 0, []
+        self._sync()
+        with self._index_lock:
+            index = self._index
+            if not index.docs:
+                return 0, []
+            postings = [index.postings.get(term) for term in terms]
+            if not all(postings):
+                return 0, []
+            # Walk the rarest word's documents and look the others up
+            order = sorted(range(len(terms)), key=lambda i: len(postings[i]))
+            rarest, others = postings[order[0]], [postings[i] for i in order[1:]]
+            n_docs = len(index.docs)
+            avg_length = index.total_length / n_docs
+            idf = [math.log(1 + (n_docs - len(p) + 0.5) / (len(p) + 0.5)) for p in postings]
+            idf = [idf[i] for i in order]
+
+            scored = []
+            for doc_id, tf in rarest.items():
+                doc = index.docs[doc_id]
+                if prefix and doc[0][:len(prefix)] != prefix or qtype and doc[1] != qtype:
+                    continue
+                if not all(doc_id in p for p in others):
+                    continue
+                norm = self.K1 * (1 - self.B + self.B * doc[3] / avg_length)
+                score = 0.0
+                for weight, n in zip(idf, [tf] + [p[doc_id] for p in others]):
+                    score += weight * n * (self.K1 + 1) / (n + norm)
+                scored.append((-score, doc[0], doc[1], doc[2], doc_id))
+            # Ties go in bank-path order, so pages stay put across re-indexing
+            best = heapq.nsmallest(offset + limit, scored)[offset:]
+            results = []
+            for score, key, doc_qtype, position, doc_id in best:
+                text, answer, options = index.docs[doc_id][4:7]
+                result = {'path': list(key), 'qtype': doc_qtype, 'index': position, 'question': text,
+                          'answer': answer, 'score': round(-score, 4)}
+                if options:
+                    result['options'] = list(options)
+                results.append(result)
+        return len(scored), results
@@ -0,0 +1,271 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+from codec import JSON
+from fileio import FileLock, atomic_write
+from storage import CHAPTER_DEPTH, BankBase, ConflictError, _node, apply_mutation, copy_path
+
+
+class ShardedBank(BankBase):
+    """Question bank split into one file per chapter.
+
+    `manifest.json` holds the publication -> subject -> class -> chapter
+    skeleton, each chapter naming its shard file under `chapters/`. Reads
+    load only the shards they touch and keep the hottest `cache_size` of
+    them in an LRU; writes rewrite one shard (and the manifest only when
+    the skeleton changes). A `version` file counts committed changes.
+    """
+
+    def __init__(self, directory, cache_size=64, codec=JSON):
+        super().__init__()
+        self.directory = directory
+        self.codec = codec
+        self.cache_size = cache_size
+        self.generation = 0
+        os.makedirs(os.path.join(directory, 'chapters'), exist_ok=True)
+        self.file_lock = FileLock(os.path.join(directory, '.lock'))
+        self._lock = threading.RLock()
+        self._manifest = None
+        self._manifest_stamp = None
+        self._shards = OrderedDict()
+        self._full = None
+        self._version = 0
+        self._version_stamp = None
+
+    # Files
+
+    def _path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def _shard_path(self, name):
+        return self._path('chapters', name + self.codec.suffix)
+
+    @staticmethod
+    def _stamp(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _read_file(self, path, default):
+        try:
+            with self._timed('load'), open(path, 'rb') as f:
+                return self.codec.loads(f.read())
+        except FileNotFoundError:
+            return default
+
+    def _write_file(self, path, obj):
+        with self._timed('save'):
+            atomic_write(path, self.codec.dumps(obj))
+
+    # Reads
+
+    def _manifest_tree(self):
+        path = self._path('manifest' + self.codec.suffix)
+        stamp = self._stamp(path)
+        if self._manifest is None or stamp != self._manifest_stamp:
+            self._manifest = self._read_file(path, {})
+            self._manifest_stamp = stamp
+        return self._manifest
+
+    def _shard(self, name):
+        stamp = self._stamp(self._shard_path(name))
+        cached = self._shards.get(name)
+        if cached is not None and cached[0] == stamp:
+            self._shards.move_to_end(name)
+            return cached[1]
+        data = self._read_file(self._shard_path(name), {})
+        self._shards[name] = (stamp, data)
+        self._shards.move_to_end(name)
+        while len(self._shards) > self.cache_size:
+            self._shards.popitem(last=False)
+        return data
+
+    # Probed on every request, so the file is only read again when a stat shows it was
+    # replaced (each write renames a new one into place), and not reported as a load
+    @property
+    def version(self):
+        path = self._path('version')
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return 0
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            if stamp != self._version_stamp:
+                try:
+                    with open(path, 'rb') as f:
+                        self._version = self.codec.loads(f.read())
+                except FileNotFoundError:
+                    return 0
+                self._version_stamp = stamp
+            return self._version
+
+    def chapter(self, path):
+        with self._lock:
+            name = _node(self._manifest_tree(), path)
+            return self._shard(name) if isinstance(name, str) else {}
+
+    def children(self, path):
+        with self._lock:
+            if len(path) == CHAPTER_DEPTH:
+                return list(self.chapter(path).keys())
+            node = _node(self._manifest_tree(), path)
+            return list(node.keys()) if isinstance(node, dict) else []
+
+    # Cached full tree - only the admin pages still need it
+    def load(self):
+        with self._lock:
+            version = self.version
+            if self._full is not None and self._full[0] == version:
+                return self._full[1]
+            tree = {}
+            for pub, subjects in self._manifest_tree().items():
+                tree[pub] = {}
+                for sub, classes in subjects.items():
+                    tree[pub][sub] = {}
+                    for cls, chapters in classes.items():
+                        tree[pub][sub][cls] = {ch: self._shard(name) for ch, name in chapters.items()}
+            self._full = (version, tree)
+            return tree
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._manifest = None
+            self._shards.clear()
+            self._full = None
+
+    # Writes
+
+    def _shard_names(self, node):
+        if isinstance(node, str):
+            return [node]
+        if isinstance(node, dict):
+            return [name for child in node.values() for name in self._shard_names(child)]
+        return []
+
+    def _remove_shards(self, names):
+        for name in names:
+            self._shards.pop(name, None)
+            try:
+                os.remove(self._shard_path(name))
+            except FileNotFoundError:
+                pass
+
+    def _apply_add(self, op, manifest):
+        path = list(op['path'])
+        skeleton = path[:CHAPTER_DEPTH]
+        new_manifest = manifest
+        if _node(manifest, skeleton) is None:
+            new_manifest = copy_path(manifest, skeleton[:-1])
+            node = new_manifest
+            for depth, level in enumerate(skeleton):
+                if depth == CHAPTER_DEPTH - 1:
+                    node[level] = uuid.uuid4().hex
+                else:
+                    node = node.setdefault(level, {})
+        changed = new_manifest is not manifest
+        if len(path) < CHAPTER_DEPTH:
+            return (new_manifest, {}, []) if changed else None
+
+        name = _node(new_manifest, skeleton)
+        shard = {} if changed else self._shard(name)
+        qtype = path[CHAPTER_DEPTH] if len(path) > CHAPTER_DEPTH else None
+        if qtype is not None and (qtype not in shard or op.get('items')):
+            shard = dict(shard)
+            shard[qtype] = shard.get(qtype, []) + list(op.get('items', []))
+            return new_manifest, {name: shard}, []
+        return (new_manifest, {name: shard}, []) if changed else None
+
+    def _apply(self, op):
+        """Return (manifest, {shard name: new shard}, removed shard names) or None."""
+        kind = op['op']
+        path = list(op['path'])
+        manifest = self._manifest_tree()
+
+        if kind in ('ensure', 'add'):
+            return self._apply_add(op, manifest)
+
+        if len(path) > CHAPTER_DEPTH:
+            # Question-type level: only the chapter's shard changes
+            name = _node(manifest, path[:CHAPTER_DEPTH])
+            if not isinstance(name, str):
+                return None
+            shard_op = dict(op, path=path[CHAPTER_DEPTH:])
+            shard = copy_path(self._shard(name), shard_op['path'])
+            if not apply_mutation(shard, shard_op):
+                return None
+            if kind == 'delete' and op.get('prune') and not shard:
+                # Last question type gone: drop the chapter as well
+                new_manifest = copy_path(manifest, path[:CHAPTER_DEPTH - 1])
+                del _node(new_manifest, path[:CHAPTER_DEPTH - 1])[path[CHAPTER_DEPTH - 1]]
+                return new_manifest, {}, [name]
+            return manifest, {name: shard}, []
+
+        # Skeleton-only changes: rename/delete of a publication .. chapter
+        new_manifest = copy_path(manifest, path[:-1])
+        parent = _node(new_manifest, path[:-1])
+        if not isinstance(parent, dict) or path[-1] not in parent:
+            return None
+        removed = []
+        if kind == 'rename' and op['name'] != path[-1]:
+            removed = self._shard_names(parent.get(op['name']))
+        elif kind == 'delete':
+            removed = self._shard_names(parent[path[-1]])
+        if not apply_mutation(new_manifest, op):
+            return None
+        return new_manifest, {}, removed
+
+    def _commit(self, manifest, shards, removed, op=None):
+        # Shards first, then the skeleton that points at them, then the version
+        for name, shard in shards.items():
+            self._write_file(self._shard_path(name), shard)
+        if manifest is not self._manifest:
+            self._write_file(self._path('manifest' + self.codec.suffix), manifest)
+        self._remove_shards(removed)
+        version = self.version + 1
+        self._write_file(self._path('version'), version)
+        self._manifest = None
+        self._full = None
+        self.generation += 1
+        self._notify(op, version)
+
+    def mutate(self, op, expected_version=None):
+        with self.file_lock, self._lock:
+            version = self.version
+            if expected_version is not None and int(expected_version) != version:
+                raise ConflictError(f"bank is at version {version}, not {expected_version}")
+            result = self._apply(op)
+            if result is None:
+                return False
+            self._commit(*result, op=op)
+            return True
+
+    # Replace the whole bank
+    def save(self, data):
+        with self.file_lock, self._lock:
+            old = self._shard_names(self._manifest_tree())
+            manifest, shards = {}, {}
+            for pub, subjects in data.items():
+                manifest[pub] = {}
+                for sub, classes in subjects.items():
+                    manifest[pub][sub] = {}
+                    for cls, chapters in classes.items():
+                        manifest[pub][sub][cls] = {}
+                        if not isinstance(chapters, dict):
+                            continue
+                        for ch, qtypes in chapters.items():
+                            name = uuid.uuid4().hex
+                            manifest[pub][sub][cls][ch] = name
+                            shards[name] = qtypes
+            self._commit(manifest, shards, old)
+
+    def seed_from(self, other):
+        """Split another bank into shards if this directory has never been written."""
+        with self.file_lock, self._lock:
+            if not os.path.exists(self._path('version')):
+                self.save(other.load())
@@ -0,0 +1,345 @@
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+
+from codec import JSON
+from storage import LEVELS, BankBase, ConflictError, QuestionBank
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    id          INTEGER PRIMARY KEY,
+    publication TEXT NOT NULL,
+    subject     TEXT NOT NULL DEFAULT '',
+    class_name  TEXT NOT NULL DEFAULT '',
+    chapter     TEXT NOT NULL DEFAULT '',
+    qtype       TEXT NOT NULL DEFAULT ''
+);
+CREATE UNIQUE INDEX IF NOT EXISTS nodes_path
+    ON nodes (publication, subject, class_name, chapter, qtype);
+CREATE TABLE IF NOT EXISTS questions (
+    id       INTEGER PRIMARY KEY,
+    node_id  INTEGER NOT NULL REFERENCES nodes (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    body     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS questions_node ON questions (node_id, position);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+"""
+
+
+def _key(path):
+    """Pad a path to the five level columns ('' marks an unused level)."""
+    path = list(path)
+    return tuple(path + [''] * (len(LEVELS) - len(path)))
+
+
+def _prefix_clause(path):
+    return ' AND '.join(f"{col} = ?" for col in LEVELS[:len(path)])
+
+
+class SQLiteBank(BankBase):
+    """Question bank stored in SQLite.
+
+    Every node of the publication -> subject -> class -> chapter -> qtype
+    hierarchy is a row in `nodes` (deeper columns left empty), so creating,
+    renaming or deleting a subtree only touches the rows under that prefix.
+    Questions hang off their qtype node in `questions`, one JSON body each.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.generation = 0
+        self._lock = threading.RLock()
+        self._data = None
+        self._stamp = None
+        self._chapters = {}
+        self._chapters_stamp = None
+        # One connection shared by all threads, serialised by self._lock;
+        # transactions are opened explicitly with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute('PRAGMA foreign_keys = ON')
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return self._conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _current_version(self, conn):
+        return conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    @property
+    def version(self):
+        with self._lock:
+            return self._current_version(self._connect())
+
+    def _bump_version(self, conn):
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+
+    def _stamp_now(self):
+        # data_version changes whenever another connection commits
+        conn = self._connect()
+        return (self.generation, conn.execute('PRAGMA data_version').fetchone()[0])
+
+    # Cached tree - callers must treat it as read-only
+    def load(self):
+        with self._lock:
+            stamp = self._stamp_now()
+            if self._data is None or stamp != self._stamp:
+                with self._timed('load'):
+                    self._data = self._read()
+                self._stamp = stamp
+            return self._data
+
+    def _read(self):
+        conn = self._connect()
+        data = {}
+        leaves = {}
+        for row in conn.execute(f"SELECT id, {', '.join(LEVELS)} FROM nodes ORDER BY id"):
+            path = [name for name in row[1:] if name != '']
+            node = data
+            for depth, name in enumerate(path):
+                leaf = depth == len(LEVELS) - 1
+                node = node.setdefault(name, [] if leaf else {})
+            if len(path) == len(LEVELS):
+                leaves[row[0]] = node
+        for node_id, body in conn.execute(
+                "SELECT node_id, body FROM questions ORDER BY node_id, position"):
+            leaves[node_id].append(JSON.loads(body))
+        return data
+
+    def chapter(self, path):
+        """Question lists of one chapter, read straight from the index.
+
+        Results are kept until the database changes so callers get the same
+        object back for an unchanged chapter.
+        """
+        key = tuple(path)
+        with self._lock:
+            stamp = self._stamp_now()
+            if stamp != self._chapters_stamp or len(self._chapters) > 256:
+                self._chapters, self._chapters_stamp = {}, stamp
+            if key in self._chapters:
+                return self._chapters[key]
+            chapter = {}
+            with self._timed('load'):
+                rows = self._connect().execute(
+                    f"SELECT n.qtype, q.body FROM nodes n LEFT JOIN questions q ON q.node_id = n.id "
+                    f"WHERE {_prefix_clause(path)} AND n.qtype != '' ORDER BY n.id, q.position",
+                    list(path))
+                for qtype, body in rows:
+                    items = chapter.setdefault(qtype, [])
+                    if body is not None:
+                        items.append(JSON.loads(body))
+            self._chapters[key] = chapter
+            return chapter
+
+    def children(self, path):
+        depth = len(path)
+        if depth >= len(LEVELS):
+            return []
+        # Rows for direct children: parent levels match, this level set, deeper levels empty
+        where = ([f"{col} = ?" for col in LEVELS[:depth]] + [f"{LEVELS[depth]} != ''"]
+                 + [f"{col} = ''" for col in LEVELS[depth + 1:]])
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT {LEVELS[depth]} FROM nodes WHERE {' AND '.join(where)} ORDER BY id",
+                list(path))
+            return [row[0] for row in rows]
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._data = None
+
+    # Writes
+
+    def _ensure(self, conn, path):
+        for depth in range(1, len(path) + 1):
+            conn.execute(
+                f"INSERT OR IGNORE INTO nodes ({', '.join(LEVELS)}) VALUES (?, ?, ?, ?, ?)",
+                _key(path[:depth]))
+        return conn.execute(
+            f"SELECT id FROM nodes WHERE {_prefix_clause(LEVELS)}", _key(path)).fetchone()[0]
+
+    def _node_id(self, conn, path):
+        row = conn.execute(
+            f"SELECT id FROM nodes WHERE {_prefix_clause(LEVELS)}", _key(path)).fetchone()
+        return row[0] if row else None
+
+    def _delete_subtree(self, conn, path):
+        return conn.execute(
+            f"DELETE FROM nodes WHERE {_prefix_clause(path)}", list(path)).rowcount
+
+    def _apply(self, conn, op):
+        kind = op['op']
+        path = list(op['path'])
+
+        if kind == 'ensure':
+            self._ensure(conn, path)
+            return True
+
+        if kind == 'add':
+            node_id = self._ensure(conn, path)
+            start = conn.execute(
+                "SELECT COALESCE(MAX(position), -1) + 1 FROM questions WHERE node_id = ?",
+                (node_id,)).fetchone()[0]
+            conn.executemany(
+                "INSERT INTO questions (node_id, position, body) VALUES (?, ?, ?)",
+                [(node_id, start + i, JSON.dumps(item).decode('utf-8'))
+                 for i, item in enumerate(op['items'])])
+            return True
+
+        if kind == 'rename':
+            if self._node_id(conn, path) is None:
+                return False
+            target = path[:-1] + [op['name']]
+            if target == path:
+                return True
+            # Renaming onto an existing name replaces it, as dict assignment did
+            self._delete_subtree(conn, target)
+            column = LEVELS[len(path) - 1]
+            conn.execute(
+                f"UPDATE nodes SET {column} = ? WHERE {_prefix_clause(path)}",
+                [op['name']] + path)
+            return True
+
+        if kind == 'delete':
+            if self._node_id(conn, path) is None:
+                return False
+            self._delete_subtree(conn, path)
+            parent = path[:-1]
+            if op.get('prune') and len(path) > 1:
+                children = conn.execute(
+                    f"SELECT COUNT(*) FROM nodes WHERE {_prefix_clause(parent)} "
+                    f"AND {LEVELS[len(parent)]} != ''", parent).fetchone()[0]
+                if not children:
+                    self._delete_subtree(conn, parent)
+            return True
+
+        node_id = self._node_id(conn, path)
+        if node_id is None or op['index'] < 0:
+            return False
+        row = conn.execute(
+            "SELECT id FROM questions WHERE node_id = ? ORDER BY position LIMIT 1 OFFSET ?",
+            (node_id, op['index'])).fetchone()
+        if row is None:
+            return False
+        if kind == 'replace':
+            conn.execute("UPDATE questions SET body = ? WHERE id = ?",
+                         (JSON.dumps(op['item']).decode('utf-8'), row[0]))
+        elif kind == 'delete_item':
+            conn.execute("DELETE FROM questions WHERE id = ?", (row[0],))
+        else:
+            raise ValueError(f"Unknown mutation: {kind}")
+        return True
+
+    def mutate(self, op, expected_version=None):
+        with self._lock:
+            with self._timed('save'), self._transaction() as conn:
+                # BEGIN IMMEDIATE holds the write lock, so the check and the
+                # write are atomic across worker processes
+                version = self._current_version(conn)
+                if expected_version is not None and int(expected_version) != version:
+                    raise ConflictError(f"bank is at version {version}, not {expected_version}")
+                changed = self._apply(conn, op)
+                if changed:
+                    self._bump_version(conn)
+            if changed:
+                self.generation += 1
+                self._data = None
+                self._notify(op, version + 1)
+            return changed
+
+    # Replace the whole bank in one transaction
+    def save(self, data):
+        with self._lock:
+            with self._timed('save'), self._transaction() as conn:
+                conn.execute("DELETE FROM nodes")
+                import_tree(conn, data, self._ensure)
+                self._bump_version(conn)
+            self.generation += 1
+            self._data = None
+            self._notify(None, self.version)
+
+
+def import_tree(conn, data, ensure):
+    for pub, subjects in data.items():
+        ensure(conn, [pub])
+        for sub, classes in subjects.items():
+            ensure(conn, [pub, sub])
+            for cls, chapters in classes.items():
+                ensure(conn, [pub, sub, cls])
+                if not isinstance(chapters, dict):
+                    continue
+                for chapter, qtypes in chapters.items():
+                    ensure(conn, [pub, sub, cls, chapter])
+                    for qtype, items in qtypes.items():
+                        node_id = ensure(conn, [pub, sub, cls, chapter, qtype])
+                        conn.executemany(
+                            "INSERT INTO questions (node_id, position, body) VALUES (?, ?, ?)",
+                            [(node_id, i, JSON.dumps(item).decode('utf-8'))
+                             for i, item in enumerate(items)])
+
+
+def legacy_tree(source):
+    """The bank `source` holds merged over the legacy database.question_database dict."""
+    data = {}
+    try:
+        import database
+        data.update(getattr(database, 'question_database', {}) or {})
+    except ImportError:
+        pass
+    for pub, subjects in source.load().items():
+        data.setdefault(pub, {}).update(subjects)
+    return data
+
+
+def migrate(source, db_path, once=False):
+    """Import a bank (plus the legacy database.py dict) into db_path.
+
+    `source` is a bank or the path of a json backend snapshot, read with
+    its journal so writes not yet compacted come along. With once=True the
+    import is skipped if this database was already migrated; the check
+    runs inside the write transaction so workers starting together cannot
+    import twice over each other's writes.
+    """
+    if isinstance(source, str):
+        source = QuestionBank(source)
+    bank = SQLiteBank(db_path)
+    with bank._lock, bank._transaction() as conn:
+        done = conn.execute("SELECT value FROM meta WHERE key = 'migrated'").fetchone()
+        if not (once and done):
+            conn.execute("DELETE FROM nodes")
+            import_tree(conn, legacy_tree(source), bank._ensure)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated', 1)")
+            bank._bump_version(conn)
+    bank.invalidate()
+    return bank
+
+
+if __name__ == '__main__':
+    src = sys.argv[1] if len(sys.argv) > 1 else 'data.json'
+    dst = sys.argv[2] if len(sys.argv) > 2 else 'questions.db'
+    migrated = migrate(src, dst)
+    conn = migrated._connect()
+    nodes = conn.execute("SELECT COUNT(*) FROM nodes").fetchone()[0]
+    questions = conn.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
+    print(f"Migrated {src} -> {dst}: {nodes} nodes, {questions} questions")
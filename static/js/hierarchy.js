@@ -0,0 +1,109 @@
+// Publication -> subject -> class -> chapter -> question type counts, fetched from
+// /hierarchy once per publication and kept for the life of the page. The browser
+// revalidates the response with its ETag, so coming back to a page costs a 304.
+const Hierarchy = (function () {
+    const publications = {};
+
+    function load(pub) {
+        if (!publications[pub]) {
+            publications[pub] = fetch('/hierarchy?publication=' + encodeURIComponent(pub))
+                .then(response => {
+                    if (!response.ok) throw new Error('HTTP ' + response.status);
+                    return response.json();
+                })
+                .then(data => data.tree)
+                .catch(error => {
+                    delete publications[pub];
+                    throw error;
+                });
+        }
+        return publications[pub];
+    }
+
+    function find(nodes, names) {
+        let node = { children: nodes };
+        for (const name of names) {
+            const list = node.children || [];
+            node = list.find(child => child.name === name);
+            if (!node) return null;
+        }
+        return node;
+    }
+
+    return {
+        // Names under a publication / subject / class, in bank order
+        children: function (pub, ...names) {
+            return load(pub).then(tree => {
+                const node = find(tree, names);
+                return node && node.children ? node.children.map(child => child.name) : [];
+            });
+        },
+
+        // {question type: number of questions} summed over the given chapters
+        questionTypes: function (pub, sub, cls, chapters) {
+            return load(pub).then(tree => {
+                const types = {};
+                chapters.forEach(chapter => {
+                    const node = find(tree, [sub, cls, chapter]);
+                    Object.entries((node && node.counts) || {}).forEach(([type, count]) => {
+                        types[type] = (types[type] || 0) + count;
+                    });
+                });
+                return types;
+            });
+        },
+
+        // One question type's list, fetched from /questions a page at a time. pager.items
+        // holds what has been loaded so far (index = position in the bank) and
+        // pager.version the bank version those indexes belong to.
+        questionPager: function (pub, sub, cls, chapter, qtype, pageSize) {
+            const pager = { items: [], total: 0, version: null, done: false };
+            pager.next = function () {
+                const params = new URLSearchParams({
+                    publication: pub, subject: sub, class_name: cls, chapter: chapter, qtype: qtype,
+                    offset: pager.items.length, limit: pageSize || 100
+                });
+                return fetch('/questions?' + params)
+                    .then(response => {
+                        if (!response.ok) throw new Error('HTTP ' + response.status);
+                        return response.json();
+                    })
+                    .then(page => {
+                        if (pager.version !== null && page.version !== pager.version) {
+                            // The bank changed between pages: start over so indexes stay right
+                            pager.items = [];
+                            pager.version = null;
+                            return pager.next();
+                        }
+                        pager.version = page.version;
+                        pager.items = pager.items.concat(page.items);
+                        pager.total = page.total;
+                        pager.done = pager.items.length >= page.total;
+                        return pager;
+                    });
+            };
+            return pager;
+        },
+
+        // <option>s for the loaded questions, plus a "more" entry while pages remain
+        questionOptions: function (pager, label) {
+            let html = '';
+            pager.items.forEach((item, index) => {
+                html += `<option value="${index}">${label(item, index)}</option>`;
+            });
+            if (!pager.done) {
+                html += `<option value="more">Load more (${pager.items.length} of ${pager.total} shown)...</option>`;
+            }
+            return html;
+        },
+
+        // Drop cached publications, e.g. after this page changed the bank
+        forget: function (pub) {
+            if (pub === undefined) {
+                Object.keys(publications).forEach(key => delete publications[key]);
+            } else {
+                delete publications[pub];
+            }
+        }
+    };
+})();
@@ -0,0 +1,384 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from codec import JSON
+from fileio import FileLock, install, write_temp
+from journal import Journal
+from models import RecordCache
+
+# Names of the levels in the bank, outermost first
+LEVELS = ('publication', 'subject', 'class_name', 'chapter', 'qtype')
+# Length of a chapter's path
+CHAPTER_DEPTH = LEVELS.index('chapter') + 1
+
+
+class ConflictError(Exception):
+    """The bank changed since the version the caller based its edit on."""
+
+
+def _node(data, path):
+    node = data
+    for name in path:
+        if not isinstance(node, dict) or name not in node:
+            return None
+        node = node[name]
+    return node
+
+
+def apply_mutation(data, op):
+    """Apply one mutation to a nested bank dict in place.
+
+    Returns True when the tree changed. Missing nodes are ignored for
+    deletes and renames, the same way the routes used to guard them.
+    """
+    kind = op['op']
+    path = list(op['path'])
+
+    if kind in ('ensure', 'add'):
+        node = data
+        for depth, name in enumerate(path):
+            leaf = depth == len(LEVELS) - 1
+            node = node.setdefault(name, [] if leaf else {})
+        if kind == 'add':
+            node.extend(op['items'])
+        return True
+
+    parent = _node(data, path[:-1])
+    if parent is None:
+        return False
+
+    if kind == 'rename':
+        if path[-1] not in parent:
+            return False
+        parent[op['name']] = parent.pop(path[-1])
+        return True
+
+    if kind == 'delete':
+        if path[-1] not in parent:
+            return False
+        del parent[path[-1]]
+        if op.get('prune') and len(path) > 1 and not parent:
+            grandparent = _node(data, path[:-2])
+            del grandparent[path[-2]]
+        return True
+
+    qlist = parent.get(path[-1]) if isinstance(parent, dict) else None
+    index = op['index']
+    if not isinstance(qlist, list) or not 0 <= index < len(qlist):
+        return False
+    if kind == 'replace':
+        qlist[index] = op['item']
+    elif kind == 'delete_item':
+        qlist.pop(index)
+    else:
+        raise ValueError(f"Unknown mutation: {kind}")
+    return True
+
+
+def copy_path(data, path):
+    """Shallow-copy the nodes along `path` so a mutation leaves `data` intact.
+
+    Readers holding the old root keep a consistent tree while the copy is
+    changed; only the dicts/lists on the path are duplicated.
+    """
+    root = dict(data)
+    node = root
+    for name in path:
+        child = node.get(name)
+        if isinstance(child, dict):
+            child = dict(child)
+        elif isinstance(child, list):
+            child = list(child)
+        else:
+            break
+        node[name] = child
+        node = child
+    return root
+
+
+class BankBase:
+    """Mutation API shared by the storage backends.
+
+    Every change goes through mutate() as a small JSON-serialisable op so a
+    backend only has to touch the part of the bank the op names. `version`
+    counts committed changes across all processes; passing it back as
+    expected_version makes the write fail with ConflictError if anything
+    changed in between (index-based edits rely on this).
+    """
+
+    def __init__(self):
+        self._records = RecordCache()
+        self._listeners = []
+        self._observers = []
+
+    def mutate(self, op, expected_version=None):
+        raise NotImplementedError
+
+    def subscribe(self, listener):
+        """Call listener(op, version) after each committed change.
+
+        `version` is the bank version the op produced; op is None when the
+        whole bank was replaced. Backends that keep a log of their ops also
+        pass on the writes of other processes as they read them; the others
+        cannot, so a listener keeping anything derived from the bank should
+        track the version and start over when it gets op None or a version
+        that is not one past the last it saw. Listeners run inside the
+        bank's locks, so they must be quick and must not call the bank.
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, op, version):
+        for listener in self._listeners:
+            listener(op, version)
+
+    def observe(self, listener):
+        """Call listener(operation, seconds) after each read ('load') or write ('save') of the stored bank.
+
+        Only actual storage I/O is reported, not reads served from memory.
+        Like subscribe() listeners, these may run inside the bank's locks.
+        """
+        self._observers.append(listener)
+
+    @contextmanager
+    def _timed(self, operation):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            for listener in self._observers:
+                listener(operation, seconds)
+
+    def ensure(self, path, expected_version=None):
+        return self.mutate({'op': 'ensure', 'path': list(path)}, expected_version)
+
+    def add_questions(self, path, items, expected_version=None):
+        return self.mutate({'op': 'add', 'path': list(path), 'items': list(items)},
+                           expected_version)
+
+    def replace_question(self, path, index, item, expected_version=None):
+        return self.mutate({'op': 'replace', 'path': list(path), 'index': index, 'item': item},
+                           expected_version)
+
+    def delete_question(self, path, index, expected_version=None):
+        return self.mutate({'op': 'delete_item', 'path': list(path), 'index': index},
+                           expected_version)
+
+    def rename(self, path, new_name, expected_version=None):
+        return self.mutate({'op': 'rename', 'path': list(path), 'name': new_name},
+                           expected_version)
+
+    def delete(self, path, prune=False, expected_version=None):
+        return self.mutate({'op': 'delete', 'path': list(path), 'prune': prune},
+                           expected_version)
+
+    # Question lists of one chapter ({qtype: [...]}); read-only
+    def chapter(self, path):
+        node = _node(self.load(), path)
+        return node if isinstance(node, dict) else {}
+
+    # Typed records of one chapter ({qtype: tuple}), normalised once per chapter change
+    def questions(self, path):
+        return self._records.get(path, self.chapter(path))
+
+    # Names directly under a node ([] for the root gives publications)
+    def children(self, path):
+        node = _node(self.load(), path)
+        return list(node.keys()) if isinstance(node, dict) else []
+
+
+class QuestionBank(BankBase):
+    """Question bank stored as a JSON snapshot plus an append-only journal.
+
+    The parsed tree is kept in memory and only re-read when the snapshot
+    changes on disk (mtime/size), the journal grows or is replaced, or
+    invalidate() is called. Mutations are appended to the journal and
+    fsync'd, so an insert costs O(1) I/O; once the journal passes
+    `compact_bytes` a background thread folds it back into the snapshot.
+
+    Writers from every process serialise on an flock()ed side file and
+    re-read the journal tail before applying their op, so concurrent
+    workers never lose each other's updates. Snapshots are replaced
+    atomically (temp file + fsync + rename).
+    """
+
+    def __init__(self, path, compact_bytes=1024 * 1024, codec=JSON):
+        super().__init__()
+        self.path = path
+        self.codec = codec
+        self.journal = Journal(path + '.journal')
+        self.file_lock = FileLock(path + '.lock')
+        self.compact_bytes = compact_bytes
+        self.generation = 0
+        self._version = 0
+        self._data = None
+        self._stamp = None
+        self._journal_ino = None
+        self._journal_offset = 0
+        self._journal_valid = False
+        self._compacting = False
+        self._lock = threading.RLock()
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'rb') as f:
+            return self.codec.loads(f.read())
+
+    def _refresh(self):
+        stamp = self._file_stamp()
+        journal_ino, journal_size = self.journal.stat()
+        if (self._data is None or stamp != self._stamp or journal_ino != self._journal_ino
+                or journal_size < self._journal_offset):
+            known = self._version if self._data is not None else None
+            with self._timed('load'):
+                data = self._read()
+                header, ops, end = self.journal.read()
+            base = header.get('seq', 0) if header else 0
+            seq = base + len(ops) if header else 0
+            valid = header is not None and header.get('base') == (list(stamp) if stamp else None)
+            if valid:
+                for op in ops:
+                    apply_mutation(data, op)
+            else:
+                # Stale journal left by an interrupted compaction: the
+                # snapshot already holds these ops. The next writer resets it.
+                end = journal_size
+            self._data, self._stamp, self._version = data, stamp, seq
+            self._journal_ino, self._journal_offset, self._journal_valid = journal_ino, end, valid
+            self.generation += 1
+            if valid and known is not None and base <= known <= seq:
+                # Another process compacted what we had already seen: the
+                # journal ops past our version are the only news
+                self._replayed(ops[known - base:], known)
+        elif journal_size != self._journal_offset:
+            # Another writer appended; replay just the new tail
+            with self._timed('load'):
+                _, ops, end = self.journal.read(self._journal_offset)
+            if ops:
+                data = self._data
+                for op in ops:
+                    data = copy_path(data, op['path'])
+                    apply_mutation(data, op)
+                self._data = data
+                self._version += len(ops)
+                self.generation += 1
+            self._journal_offset = end
+            self._replayed(ops, self._version - len(ops))
+
+    def _replayed(self, ops, version):
+        """Tell subscribers about ops other processes committed after `version`."""
+        for op in ops:
+            version += 1
+            self._notify(op, version)
+
+    # Cached tree - callers must treat it as read-only
+    def load(self):
+        with self._lock:
+            self._refresh()
+            return self._data
+
+    @property
+    def version(self):
+        with self._lock:
+            self._refresh()
+            return self._version
+
+    def _start_journal(self, stamp):
+        self._journal_offset = self.journal.reset(stamp, self._version)
+        self._journal_ino = self.journal.stat()[0]
+        self._journal_valid = True
+
+    def _install_snapshot(self, tmp):
+        st = os.stat(tmp)
+        stamp = (st.st_mtime_ns, st.st_size)
+        install(tmp, self.path)
+        self._stamp = stamp
+        self._start_journal(stamp)
+
+    def _snapshot_bytes(self, data):
+        return self.codec.dumps(data)
+
+    def seed_from(self, other):
+        """Create the snapshot from another bank if this one has never been written."""
+        with self.file_lock, self._lock:
+            if not os.path.exists(self.path) and not self.journal.exists():
+                self.save(other.load())
+
+    # Replace the whole bank
+    def save(self, data):
+        with self.file_lock, self._lock:
+            self._refresh()
+            self._version += 1
+            with self._timed('save'):
+                self._install_snapshot(write_temp(self.path, self._snapshot_bytes(data)))
+            self._data = data
+            self.generation += 1
+            self._notify(None, self._version)
+
+    def mutate(self, op, expected_version=None):
+        with self.file_lock, self._lock:
+            self._refresh()
+            if expected_version is not None and int(expected_version) != self._version:
+                raise ConflictError(f"bank is at version {self._version}, not {expected_version}")
+            data = copy_path(self._data, op['path'])
+            if not apply_mutation(data, op):
+                return False
+            if not self._journal_valid:
+                self._start_journal(self._stamp)
+            elif self.journal.size() != self._journal_offset:
+                # Drop a torn line left by a crashed writer
+                self.journal.truncate(self._journal_offset)
+            with self._timed('save'):
+                self._journal_offset = self.journal.append(op)
+            self._data = data
+            self._version += 1
+            self.generation += 1
+            self._notify(op, self._version)
+            if self._journal_offset > self.compact_bytes and not self._compacting:
+                self._compacting = True
+                threading.Thread(target=self.compact, daemon=True).start()
+            return True
+
+    def compact(self, attempts=3):
+        """Fold the journal into the snapshot.
+
+        Serialising happens outside the locks; if a write lands meanwhile
+        the attempt is retried, and the last attempt holds the locks
+        throughout so a busy writer cannot starve compaction.
+        """
+        try:
+            for attempt in range(attempts):
+                with self._lock:
+                    self._refresh()
+                    data, version = self._data, self._version
+                with self._timed('save'):
+                    tmp = write_temp(self.path, self._snapshot_bytes(data))
+                with self.file_lock, self._lock:
+                    self._refresh()
+                    if self._version == version and self._data is data:
+                        self._install_snapshot(tmp)
+                        return True
+                    os.remove(tmp)
+            with self.file_lock, self._lock:
+                self._refresh()
+                with self._timed('save'):
+                    self._install_snapshot(
+                        write_temp(self.path, self._snapshot_bytes(self._data)))
+                return True
+        finally:
+            self._compacting = False
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._data = None
@@ -0,0 +1,87 @@
+"""Hammer add_question/delete_question from several processes and threads.
+
+Runs against a scratch copy of data.json and checks that every question a
+worker added is present exactly once unless that worker deleted it, i.e.
+that no write was lost and no delete hit the wrong question.
+
+    python stress_writes.py --workers 4 --threads 4 --ops 50 --backend json
+"""
+import argparse
+import multiprocessing
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from harness import (WRITTEN, TestClient, add_question, check_writes, delete_question, load_app, question_list,
+                     scratch_bank)
+
+PATH = ['Stress', 'Load', 'class 1', 'Chapter 1', 'Answer the Following']
+
+
+def _thread(app, worker, thread, ops):
+    client = TestClient(app)
+    added, deleted, conflicts = [], [], 0
+    for n in range(ops):
+        text = f"w{worker}-t{thread}-q{n}"
+        if add_question(client, PATH, text) == WRITTEN:
+            added.append(text)
+        if n % 3 == 2 and len(added) > 1:
+            victim = added[-2]
+            status, attempts = delete_question(client, PATH, victim)
+            conflicts += max(attempts - 1, 0)
+            if status == WRITTEN:
+                deleted.append(victim)
+    return added, deleted, conflicts
+
+
+def worker(workdir, backend, worker_id, threads, ops, compact_bytes):
+    app = load_app(workdir, backend)
+    if hasattr(app.bank, 'compact_bytes'):
+        app.bank.compact_bytes = compact_bytes
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(lambda t: _thread(app, worker_id, t, ops), range(threads)))
+    added = [q for a, _, _ in results for q in a]
+    deleted = [q for _, d, _ in results for q in d]
+    return added, deleted, sum(c for _, _, c in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--ops', type=int, default=30, help='adds per thread')
+    parser.add_argument('--backend', choices=['json', 'sqlite', 'sharded'], default='json')
+    parser.add_argument('--compact-bytes', type=int, default=4096,
+                        help='small journal threshold so compaction runs during the test')
+    args = parser.parse_args()
+
+    workdir = scratch_bank('qb-stress-')
+    ctx = multiprocessing.get_context('spawn')
+    start = time.perf_counter()
+    with ctx.Pool(args.workers) as pool:
+        results = pool.starmap(worker, [
+            (workdir, args.backend, w, args.threads, args.ops, args.compact_bytes)
+            for w in range(args.workers)])
+    elapsed = time.perf_counter() - start
+
+    added = [q for a, _, _ in results for q in a]
+    deleted = [q for _, d, _ in results for q in d]
+    conflicts = sum(c for _, _, c in results)
+
+    # Re-open the bank from disk in a fresh process state
+    stored, _ = question_list(TestClient(load_app(workdir, args.backend)), PATH)
+    lost, extra = check_writes(stored, added, deleted)
+
+    writes = len(added) + len(deleted)
+    print(f"backend={args.backend} workers={args.workers} threads={args.threads} "
+          f"writes={writes} in {elapsed:.2f}s ({writes / elapsed:.0f}/s)")
+    print(f"stored={len(stored)} expected={len(added) - len(deleted)} "
+          f"version conflicts retried={conflicts}")
+    print(f"lost writes={sum(lost.values())} unexpected={sum(extra.values())}")
+    shutil.rmtree(workdir, ignore_errors=True)
+    return 1 if lost or extra else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
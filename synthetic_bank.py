@@ -0,0 +1,125 @@
+"""Generate synthetic question banks of any size for benchmarks and load tests.
+
+The tree has `publications` x `subjects` x `classes` x `chapters`, and
+every chapter holds `questions` entries of each question type in all the
+shapes the app reads: {question, answer} dicts and plain strings, MCQs with
+and without options, single- and multi-pair Match dicts and [left, right]
+lists, Full Form dicts and bare abbreviations. Every other chapter uses
+Devanagari text, and a few empty chapters and question types and a stray
+non-dict class are mixed in. The same arguments always give the same bank.
+
+    python synthetic_bank.py --publications 4 --subjects 3 --classes 5 --chapters 10 \\
+        --questions 40 -o big.json
+"""
+import argparse
+import json
+import random
+
+WORDS = ('light', 'water', 'plant', 'energy', 'river', 'computer', 'number', 'animal', 'shape',
+         'season', 'village', 'market', 'machine', 'garden', 'planet', 'history', 'language',
+         'keyboard', 'mountain', 'festival', 'triangle', 'mineral', 'weather', 'journey')
+HINDI = ('प्रकाश', 'पानी', 'पौधा', 'ऊर्जा', 'नदी', 'संगणक', 'संख्या', 'जानवर', 'आकार', 'मौसम',
+         'गाँव', 'बाज़ार', 'मशीन', 'बगीचा', 'ग्रह', 'इतिहास', 'भाषा', 'पर्वत')
+
+# Question types the generate form offers, in bank order
+QUESTION_TYPES = ("Fill in the Blanks", "True/False", "Match the Following", "Choose the Best Answer",
+                  "Answer the Following", "Full Form", "One Word Answer", "Short Answer",
+                  "Long Answer")
+
+
+def _phrase(rng, words, n):
+    return ' '.join(rng.choice(words) for _ in range(n))
+
+
+def make_item(qtype, n, rng, words):
+    """The n-th entry of a question type, cycling through the shapes that type comes in."""
+    text = f"{_phrase(rng, words, rng.randint(4, 12))} {n}"
+    answer = rng.choice(words)
+    shape = n % 3
+    if qtype == "Fill in the Blanks":
+        return {'question': f"{text} ______.", 'answer': answer} if shape else f"{text} ______."
+    if qtype == "True/False":
+        return {'question': text, 'answer': rng.choice(('True', 'False'))} if shape else text
+    if qtype == "Match the Following":
+        if shape == 0:
+            return [f"{text} L", f"{answer} R{n}"]
+        if shape == 1:
+            return {f"{text} L": f"{answer} R{n}"}
+        return {f"{text} L{i}": f"{rng.choice(words)} R{n}.{i}" for i in range(2)}
+    if qtype == "Choose the Best Answer":
+        if shape == 0:
+            return f"{text}?"
+        options = [f"{rng.choice(words)} {i}" for i in range(4)]
+        if shape == 1:
+            return {'question': f"{text}?", 'options': options, 'answer': rng.choice(options)}
+        return {'question': f"{text}?", 'options': [], 'answer': ''}
+    if qtype == "Full Form":
+        abbr = ''.join(word[0] for word in text.split()[:4]).upper() + str(n)
+        return abbr if shape == 0 else {abbr: text}
+    if qtype == "One Word Answer":
+        return {'question': f"{text}?", 'answer': answer} if shape else f"{text}?"
+    if qtype == "Long Answer":
+        return f"{text}. {_phrase(rng, words, 20)}?"
+    return f"{text}?"
+
+
+def make_chapter(questions, rng, words):
+    chapter = {}
+    for qtype in QUESTION_TYPES:
+        chapter[qtype] = [make_item(qtype, n, rng, words) for n in range(questions)]
+    return chapter
+
+
+def make_bank(publications=2, subjects=2, classes=3, chapters=5, questions=10, seed=0):
+    """{publication: {subject: {class: {chapter: {qtype: [entries]}}}}} of the given size."""
+    rng = random.Random(seed)
+    bank = {}
+    count = 0
+    for p in range(publications):
+        pub = bank[f"Publication {p + 1}"] = {}
+        for s in range(subjects):
+            sub = pub[f"Subject {s + 1}"] = {}
+            for c in range(classes):
+                cls = sub[f"class {c + 1}"] = {}
+                for ch in range(chapters):
+                    count += 1
+                    words = HINDI if count % 2 == 0 else WORDS
+                    name = f"Chapter {ch + 1}: {_phrase(rng, words, 2).title()}"
+                    if count % 50 == 0:
+                        cls[name] = {}  # a chapter with no questions yet
+                        continue
+                    chapter = cls[name] = make_chapter(questions, rng, words)
+                    if count % 7 == 0:
+                        chapter["Short Answer"] = []  # a type with no questions yet
+            if s == 0:
+                sub["Notes"] = "not a class"  # a stray non-dict node, which has no chapters
+    return bank
+
+
+def count_questions(bank):
+    return sum(len(items) for subjects in bank.values() for classes in subjects.values()
+               if isinstance(classes, dict) for chapters in classes.values()
+               if isinstance(chapters, dict) for chapter in chapters.values()
+               for items in chapter.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--publications', type=int, default=2)
+    parser.add_argument('--subjects', type=int, default=2)
+    parser.add_argument('--classes', type=int, default=3)
+    parser.add_argument('--chapters', type=int, default=5)
+    parser.add_argument('--questions', type=int, default=10, help='entries per question type and chapter')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default='synthetic.json')
+    args = parser.parse_args()
+
+    bank = make_bank(args.publications, args.subjects, args.classes, args.chapters, args.questions,
+                     args.seed)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(bank, f, ensure_ascii=False, separators=(',', ':'))
+    print(f"wrote {args.output}: {count_questions(bank)} entries")
+
+
+if __name__ == '__main__':
+    main()
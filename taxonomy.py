@@ -0,0 +1,160 @@
+import threading
+from collections import Counter
+
+from storage import CHAPTER_DEPTH, LEVELS
+
+
+class TaxonomyIndex:
+    """Child lists, per-chapter categories, question counts and distinct level names of a bank.
+
+    Lists are read from the bank the first time they are asked for and then
+    kept until a write touches them: the index subscribes to the bank, adds
+    new names as they are created and forgets only the nodes under a rename
+    or delete, whether this process or another wrote them (see
+    BankBase.subscribe).
+
+    Child lists keep the bank's order, which the dropdowns show; the
+    distinct subject/class/chapter sets are handed out sorted.
+    """
+
+    def __init__(self, bank):
+        self.bank = bank
+        self._lock = threading.Lock()
+        self._children = {}
+        self._counts = {}
+        self._distinct = None
+        self._version = None
+        bank.subscribe(self._on_change)
+
+    # Reads. The bank is never called with self._lock held: writers call
+    # _on_change with the bank's lock held, so the two locks must not nest
+    # the other way round.
+
+    def _sync(self):
+        version = self.bank.version
+        with self._lock:
+            if version != self._version:
+                self._reset(version)
+        return version
+
+    def _reset(self, version):
+        self._children.clear()
+        self._counts.clear()
+        self._distinct = None
+        self._version = version
+
+    def _remember(self, version, cache, key, value):
+        with self._lock:
+            if self._version == version:
+                cache[key] = value
+
+    def _cached_children(self, version, key):
+        with self._lock:
+            names = self._children.get(key)
+        if names is None:
+            names = tuple(self.bank.children(list(key)))
+            self._remember(version, self._children, key, names)
+        return names
+
+    def _chapter_counts(self, version, key):
+        with self._lock:
+            counts = self._counts.get(key)
+        if counts is None:
+            counts = {qtype: len(items) if isinstance(items, list) else 0
+                      for qtype, items in self.bank.chapter(list(key)).items()}
+            self._remember(version, self._counts, key, counts)
+        return dict(counts)
+
+    def children(self, path):
+        """Names directly under path, in bank order."""
+        version = self._sync()
+        return list(self._cached_children(version, tuple(path)))
+
+    def categories(self, chapter_paths):
+        """Sorted question types found in any of the given chapters."""
+        version = self._sync()
+        found = set()
+        for path in chapter_paths:
+            found.update(self._cached_children(version, tuple(path)))
+        return sorted(found)
+
+    def hierarchy(self, path=()):
+        """Nested {name: ...} skeleton under path down to {qtype: question count} per chapter."""
+        version = self._sync()
+
+        def walk(key):
+            if len(key) == CHAPTER_DEPTH:
+                return self._chapter_counts(version, key)
+            return {name: walk(key + (name,)) for name in self._cached_children(version, key)}
+
+        return walk(tuple(path)[:CHAPTER_DEPTH])
+
+    def distinct(self):
+        """Sorted distinct names per level: {'publication': [...], 'subject': [...], ...}."""
+        version = self._sync()
+        with self._lock:
+            counts = self._distinct
+        if counts is None:
+            counts = [Counter() for _ in range(CHAPTER_DEPTH)]
+            stack = [()]
+            while stack:
+                key = stack.pop()
+                for name in self._cached_children(version, key):
+                    counts[len(key)][name] += 1
+                    if len(key) + 1 < CHAPTER_DEPTH:
+                        stack.append(key + (name,))
+            with self._lock:
+                if self._version == version:
+                    self._distinct = counts
+        return {level: sorted(name for name, n in count.items() if n > 0)
+                for level, count in zip(LEVELS, counts)}
+
+    # Writes
+
+    def _forget(self, path):
+        """Drop the cached lists of path's parent and of everything under path."""
+        key = tuple(path)
+        self._children.pop(key[:-1], None)
+        self._counts.pop(key[:CHAPTER_DEPTH], None)
+        for cache in (self._children, self._counts):
+            for cached in [k for k in cache if k[:len(key)] == key]:
+                del cache[cached]
+
+    def _on_change(self, op, version):
+        with self._lock:
+            if op is None or self._version is None or version != self._version + 1:
+                self._reset(version)
+                return
+            self._version = version
+            kind, path = op['op'], tuple(op['path'])
+
+            if kind in ('ensure', 'add'):
+                for depth in range(1, len(path) + 1):
+                    parent, name = path[:depth - 1], path[depth - 1]
+                    names = self._children.get(parent)
+                    if names is None:
+                        # Parent never listed: whether name is new is unknown
+                        if depth <= CHAPTER_DEPTH:
+                            self._distinct = None
+                        continue
+                    if name not in names:
+                        self._children[parent] = names + (name,)
+                        if self._distinct is not None and depth <= CHAPTER_DEPTH:
+                            self._distinct[depth - 1][name] += 1
+                counts = self._counts.get(path[:CHAPTER_DEPTH])
+                if counts is not None and len(path) > CHAPTER_DEPTH:
+                    qtype = path[CHAPTER_DEPTH]
+                    counts[qtype] = counts.get(qtype, 0) + len(op.get('items', ()))
+            elif kind in ('rename', 'delete'):
+                self._forget(path)
+                pruned = kind == 'delete' and op.get('prune')
+                if pruned:
+                    # An emptied parent is removed along with it
+                    self._forget(path[:-1])
+                if pruned or len(path) <= CHAPTER_DEPTH:
+                    self._distinct = None
+            elif kind == 'delete_item':
+                counts = self._counts.get(path[:CHAPTER_DEPTH])
+                if counts is not None and len(path) == CHAPTER_DEPTH + 1 and counts.get(path[-1]):
+                    counts[path[-1]] -= 1
+            # replace leaves the taxonomy alone
@@ -0,0 +1,97 @@
+import itertools
+import random
+import time
+
+import pytest
+
+from blueprint import BlueprintError, allocate, solve_counts
+
+TYPES = [('Fill in the Blanks', 1, 0, 10), ('Short Answer', 2, 0, 5), ('Long Answer', 5, 1, 2)]
+
+
+def total(types, counts):
+    return sum(counts[qtype] * mark for qtype, mark, _, _ in types)
+
+
+@pytest.mark.parametrize('target', [5, 13, 20, 30])
+def test_counts_reach_the_target_within_bounds(target):
+    counts = solve_counts(TYPES, target)
+    assert total(TYPES, counts) == target
+    for qtype, _, low, high in TYPES:
+        assert low <= counts[qtype] <= high
+
+
+def test_prefers_an_even_split():
+    types = [('A', 1, 0, 10), ('B', 1, 0, 10)]
+    assert solve_counts(types, 10) == {'A': 5, 'B': 5}
+
+
+def test_finds_the_most_even_split():
+    rng = random.Random(3)
+    for _ in range(300):
+        types = [(f't{i}', rng.choice([0.5, 1, 2, 3, 5]), rng.randint(0, 2), 0) for i in range(rng.randint(1, 4))]
+        types = [(qtype, mark, low, low + rng.randint(1, 6)) for qtype, mark, low, _ in types]
+        target = rng.randint(2, 60) / 2
+        share = target / len(types)
+        costs = [sum((n * mark - share) ** 2 for n, (_, mark, _, _) in zip(counts, types))
+                 for counts in itertools.product(*(range(low, high + 1) for _, _, low, high in types))
+                 if abs(sum(n * mark for n, (_, mark, _, _) in zip(counts, types)) - target) < 1e-9]
+        if not costs:
+            with pytest.raises(BlueprintError):
+                solve_counts(types, target)
+            continue
+        counts = solve_counts(types, target)
+        assert total(types, counts) == pytest.approx(target)
+        assert sum((counts[qtype] * mark - share) ** 2 for qtype, mark, _, _ in types) == pytest.approx(min(costs))
+
+
+def test_large_pools_are_quick():
+    same = [(f'type {i}', 1, 0, 5000) for i in range(9)]
+    mixed = [(f'type {i}', mark, 0, 5000) for i, mark in enumerate([1, 1, 1, 2, 2, 2, 5, 5, 5])]
+    for types, target in [(same, 1000), (same, 5000), (mixed, 5000), (mixed, 19999)]:
+        start = time.perf_counter()
+        counts = solve_counts(types, target)
+        assert time.perf_counter() - start < 0.5
+        assert total(types, counts) == target
+
+
+def test_fixed_and_fractional_marks():
+    types = [('A', 0.5, 0, 10), ('B', 1, 3, 3)]
+    counts = solve_counts(types, 7.5)
+    assert counts['B'] == 3 and total(types, counts) == 7.5
+
+
+@pytest.mark.parametrize('target', [0, -4])
+def test_rejects_a_target_that_is_not_positive(target):
+    with pytest.raises(BlueprintError, match='above 0'):
+        solve_counts(TYPES, target)
+
+
+@pytest.mark.parametrize('target', [4, 31, 1e9, float('inf'), float('nan')])
+def test_rejects_targets_outside_the_limits_without_building_a_table(target):
+    start = time.perf_counter()
+    with pytest.raises(BlueprintError, match='allow 5 to 30'):
+        solve_counts(TYPES, target)
+    assert time.perf_counter() - start < 0.1
+
+
+def test_rejects_an_unreachable_target_inside_the_limits():
+    with pytest.raises(BlueprintError, match='no combination'):
+        solve_counts([('A', 2, 0, 10)], 7)
+
+
+def test_rejects_a_target_too_fine_for_the_table():
+    with pytest.raises(BlueprintError, match='too large'):
+        solve_counts([('A', 0.01, 0, 10 ** 7)], 5000)
+
+
+def test_rejects_impossible_bounds():
+    with pytest.raises(BlueprintError, match='at least 3'):
+        solve_counts([('A', 1, 3, 2)], 2)
+
+
+def test_allocate_is_proportional_and_capped():
+    assert allocate([10, 30], 8) == [2, 6]
+    assert allocate([1, 30], 10) == [0, 10]
+    assert allocate([2, 1], 10) == [2, 1]
+    assert allocate([0, 0], 3) == [0, 0]
@@ -0,0 +1,82 @@
+import itertools
+import os
+import random
+
+import pytest
+
+import exposure
+from exposure import DAY, ExposureSampler, FenwickTree, UsageHistory
+from models import Question
+
+
+def test_total_follows_updates():
+    tree = FenwickTree([1.0, 2.0, 3.0, 4.0, 5.0])
+    assert tree.total() == 15.0
+    tree.set(2, 0.0)
+    tree.set(4, 10.0)
+    assert tree.total() == 17.0
+    assert tree.weights == [1.0, 2.0, 0.0, 4.0, 10.0]
+
+
+@pytest.mark.parametrize('n', [1, 2, 7, 8, 9, 33])
+def test_find_matches_the_prefix_sums(n):
+    weights = [float(i % 4) for i in range(n)]
+    weights[-1] = 1.0
+    tree = FenwickTree(weights)
+    bounds = list(itertools.accumulate(weights))
+    for step in range(int(tree.total() * 4)):
+        target = step / 4
+        expected = next(i for i, bound in enumerate(bounds) if target < bound)
+        assert tree.find(target) == expected
+        assert weights[expected] > 0
+
+
+def test_find_never_lands_on_a_zero_weight_at_the_end():
+    tree = FenwickTree([0.1, 0.2, 0.0, 0.0])
+    assert tree.find(tree.total() * (1 - 1e-16)) == 1
+
+
+def test_sampling_follows_the_weights():
+    weights = [1.0, 0.0, 3.0, 6.0]
+    tree = FenwickTree(weights)
+    rng = random.Random(7)
+    draws = 20000
+    counts = [0] * len(weights)
+    for _ in range(draws):
+        counts[tree.find(rng.random() * tree.total())] += 1
+    assert counts[1] == 0
+    for weight, count in zip(weights, counts):
+        assert count / draws == pytest.approx(weight / 10, abs=0.015)
+
+
+def test_sampler_draws_distinct_questions_and_restores_the_weights(tmp_path):
+    history = UsageHistory(str(tmp_path / 'usage.log'))
+    sampler = ExposureSampler(history)
+    pool = tuple(Question(f'q{i}') for i in range(10))
+    drawn = sampler.draw(pool, 6, random.Random(1))
+    assert len(drawn) == 6 and len({r.question for r in drawn}) == 6
+    assert len(sampler.draw(pool, 20, random.Random(2))) == 10
+    assert sampler._entry(pool, 0)[2].total() == pytest.approx(10.0)
+
+
+def test_usage_log_compaction_is_bounded_and_pruned(tmp_path, monkeypatch):
+    now = [1_000_000_000.0]
+    monkeypatch.setattr(exposure.time, 'time', lambda: now[0])
+    path = str(tmp_path / 'usage.log')
+    history = UsageHistory(path, half_life_days=10, max_bytes=2000, keep_days=30)
+    history.record('old', {'Short Answer': ['old-q']})
+    for i in range(200):
+        now[0] += DAY
+        history.record(f'p{i}', {'Short Answer': [f'q{i % 5}']})
+        assert os.path.getsize(path) < 4000
+
+    assert history.recorded('old') is None
+    assert history.recorded('p199') == {'Short Answer': ['q4']}
+    assert history.recorded('p150') is None
+    assert history.exposure('old-q') == 0.0
+    assert history.exposure('q4') > 1.0
+
+    # Another process reading the compacted log sees the same state
+    other = UsageHistory(path, half_life_days=10, max_bytes=2000, keep_days=30)
+    assert other.recorded('p199') == {'Short Answer': ['q4']}
+    assert other.exposure('q4') == pytest.approx(history.exposure('q4'))
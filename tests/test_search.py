@@ -0,0 +1,125 @@
+import pytest
+
+from models import MATCH, MCQ
+from search import SearchIndex, tokenize
+from storage import QuestionBank
+
+CHAPTER = ['Publication', 'Science', 'class 5', 'Plants']
+OTHER = ['Publication', 'Science', 'class 5', 'Animals']
+NEPALI = ['Publication', 'Nepali', 'class 5', 'पाठ १']
+QUERIES = ['leaves', 'green leaves', 'roots', 'tiger', 'cat', 'mammal', 'कलम', 'photosynthesis']
+
+
+@pytest.fixture
+def bank(tmp_path):
+    bank = QuestionBank(str(tmp_path / 'data.json'))
+    bank.save({'Publication': {
+        'Science': {'class 5': {
+            'Plants': {
+                'Short Answer': [{'question': 'Why are leaves green?', 'answer': 'Chlorophyll'},
+                                 'What do roots do?'],
+                MCQ: [{'question': 'Plants make food by', 'answer': 'photosynthesis',
+                       'options': ['respiration', 'photosynthesis', 'digestion', 'roots']}],
+            },
+            'Animals': {
+                'Short Answer': ['Is a cat a mammal?'],
+                MATCH: [{'Tiger': 'Stripes'}, ['Zebra', 'Mammal']],
+            },
+        }},
+        'Nepali': {'class 5': {'पाठ १': {'Short Answer': ['कलम के हो?']}}},
+    }})
+    return bank
+
+
+def hits(index, query, **kwargs):
+    return [(tuple(r['path']), r['qtype'], r['index']) for r in index.search(query, **kwargs)[1]]
+
+
+def assert_matches_a_fresh_index(index, bank):
+    fresh = SearchIndex(bank)
+    for query in QUERIES:
+        assert index.search(query) == fresh.search(query), query
+
+
+def test_tokenize_keeps_devanagari_words_whole():
+    assert tokenize('कलम के हो? Leaves, GREEN।') == ['कलम', 'के', 'हो', 'leaves', 'green']
+
+
+def test_finds_text_answers_options_and_pairs(bank):
+    index = SearchIndex(bank)
+    assert hits(index, 'green leaves') == [(tuple(CHAPTER), 'Short Answer', 0)]
+    assert hits(index, 'chlorophyll') == [(tuple(CHAPTER), 'Short Answer', 0)]
+    assert hits(index, 'digestion') == [(tuple(CHAPTER), MCQ, 0)]
+    assert hits(index, 'stripes') == [(tuple(OTHER), MATCH, 0)]
+    assert hits(index, 'कलम') == [(tuple(NEPALI), 'Short Answer', 0)]
+    assert index.search('green elephants') == (0, [])
+    result = index.search('photosynthesis')[1][0]
+    assert result['options'] == ['respiration', 'photosynthesis', 'digestion', 'roots']
+
+
+def test_filters_and_paging(bank):
+    index = SearchIndex(bank)
+    assert len(hits(index, 'mammal')) == 2
+    assert hits(index, 'mammal', qtype=MATCH) == [(tuple(OTHER), MATCH, 1)]
+    assert hits(index, 'roots', filters=['Publication', 'Science', 'class 5', 'Animals']) == []
+    assert hits(index, 'roots', filters=['Publication', 'Science']) == hits(index, 'roots')
+    total, page = index.search('mammal', limit=1, offset=1)
+    assert total == 2 and len(page) == 1
+
+
+def test_results_follow_adds(bank):
+    index = SearchIndex(bank)
+    index.search('leaves')
+    bank.add_questions(CHAPTER + ['Short Answer'], ['Do leaves breathe?'])
+    bank.add_questions(['Publication', 'Science', 'class 6', 'Light', 'Short Answer'],
+                       ['Are leaves shiny?'])
+    assert len(hits(index, 'leaves')) == 3
+    assert_matches_a_fresh_index(index, bank)
+
+
+def test_results_follow_renames(bank):
+    index = SearchIndex(bank)
+    index.search('leaves')
+    bank.rename(CHAPTER, 'Green Plants')
+    assert hits(index, 'roots', qtype='Short Answer') == [
+        (('Publication', 'Science', 'class 5', 'Green Plants'), 'Short Answer', 1)]
+    bank.rename(['Publication', 'Science', 'class 5', 'Green Plants', 'Short Answer'], 'Long Answer')
+    assert hits(index, 'roots', qtype='Short Answer') == []
+    bank.rename(['Publication', 'Science'], 'EVS')
+    assert hits(index, 'tiger') == [(('Publication', 'EVS', 'class 5', 'Animals'), MATCH, 0)]
+    assert_matches_a_fresh_index(index, bank)
+
+
+def test_results_follow_deletes(bank):
+    index = SearchIndex(bank)
+    index.search('leaves')
+    bank.delete_question(CHAPTER + ['Short Answer'], 0)
+    assert hits(index, 'leaves') == []
+    assert hits(index, 'roots', qtype='Short Answer') == [(tuple(CHAPTER), 'Short Answer', 0)]
+    bank.delete(OTHER)
+    assert hits(index, 'tiger') == [] and hits(index, 'mammal') == []
+    bank.delete(['Publication', 'Nepali'])
+    assert hits(index, 'कलम') == []
+    assert_matches_a_fresh_index(index, bank)
+
+
+def test_another_processs_writes_update_the_index_in_place(bank, tmp_path):
+    index = SearchIndex(bank)
+    index.search('leaves')
+    built = index._index
+    other = QuestionBank(str(tmp_path / 'data.json'))
+    other.add_questions(CHAPTER + ['Short Answer'], ['Do leaves breathe?'])
+    other.rename(OTHER, 'Wild Animals')
+    other.delete_question(CHAPTER + ['Short Answer'], 0)
+    assert hits(index, 'leaves') == [(tuple(CHAPTER), 'Short Answer', 1)]
+    assert hits(index, 'tiger') == [(('Publication', 'Science', 'class 5', 'Wild Animals'), MATCH, 0)]
+    assert index._index is built
+    assert_matches_a_fresh_index(index, bank)
+
+
+def test_replacing_the_bank_rebuilds(bank):
+    index = SearchIndex(bank)
+    index.search('leaves')
+    bank.save({'Publication': {'Science': {'class 5': {'Plants': {'Short Answer': ['Name a tree']}}}}})
+    assert hits(index, 'leaves') == []
+    assert hits(index, 'tree') == [(tuple(CHAPTER), 'Short Answer', 0)]
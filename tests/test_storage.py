@@ -0,0 +1,114 @@
+import shutil
+
+import pytest
+
+from shards import ShardedBank
+from sqlite_store import SQLiteBank, migrate
+from storage import ConflictError, QuestionBank
+
+PATH = ['Publication', 'Subject', 'class 1', 'Chapter 1', 'Short Answer']
+
+
+def open_bank(backend, directory):
+    if backend == 'json':
+        return QuestionBank(str(directory / 'data.json'))
+    if backend == 'sqlite':
+        return SQLiteBank(str(directory / 'questions.db'))
+    return ShardedBank(str(directory / 'shards'))
+
+
+@pytest.fixture(params=['json', 'sqlite', 'sharded'])
+def backend(request):
+    return request.param
+
+
+def questions(bank):
+    return bank.chapter(PATH[:4]).get(PATH[4])
+
+
+def test_stale_version_conflicts(backend, tmp_path):
+    bank = open_bank(backend, tmp_path)
+    bank.add_questions(PATH, ['first'])
+    version = bank.version
+    assert bank.add_questions(PATH, ['second'], expected_version=version)
+    with pytest.raises(ConflictError):
+        bank.delete_question(PATH, 0, expected_version=version)
+    assert questions(bank) == ['first', 'second']
+    assert bank.delete_question(PATH, 0, expected_version=bank.version)
+    assert questions(bank) == ['second']
+
+
+def test_stale_version_conflicts_across_processes(backend, tmp_path):
+    # Two banks on the same files stand in for two worker processes
+    first, second = open_bank(backend, tmp_path), open_bank(backend, tmp_path)
+    first.add_questions(PATH, ['a', 'b'])
+    version = second.version
+    first.delete_question(PATH, 0)
+    with pytest.raises(ConflictError):
+        second.delete_question(PATH, 0, expected_version=version)
+    assert questions(second) == ['b']
+
+
+def test_journal_replay_skips_a_torn_append(tmp_path):
+    path = str(tmp_path / 'data.json')
+    bank = QuestionBank(path)
+    bank.add_questions(PATH, ['a', 'b'])
+    bank.replace_question(PATH, 1, 'B')
+    version = bank.version
+    # A writer crashed half-way through appending its op
+    with open(path + '.journal', 'ab') as f:
+        f.write(b'{"op":"add","path":["Publication","Sub')
+
+    reopened = QuestionBank(path)
+    assert questions(reopened) == ['a', 'B']
+    assert reopened.version == version
+    # The next write drops the torn line rather than appending after it
+    reopened.add_questions(PATH, ['c'])
+    assert questions(QuestionBank(path)) == ['a', 'B', 'c']
+    assert QuestionBank(path).version == version + 1
+
+
+def test_journal_replay_after_interrupted_compaction(tmp_path):
+    path = str(tmp_path / 'data.json')
+    bank = QuestionBank(path)
+    bank.add_questions(PATH, ['a'])
+    bank.add_questions(PATH, ['b'])
+    shutil.copy(path + '.journal', tmp_path / 'journal.old')
+    assert bank.compact()
+    # Crash after the new snapshot was installed but before the journal was reset
+    shutil.copy(tmp_path / 'journal.old', path + '.journal')
+
+    reopened = QuestionBank(path)
+    assert questions(reopened) == ['a', 'b']
+    reopened.add_questions(PATH, ['c'])
+    assert questions(QuestionBank(path)) == ['a', 'b', 'c']
+
+
+def test_replayed_writes_reach_subscribers(tmp_path):
+    path = str(tmp_path / 'data.json')
+    writer, reader = QuestionBank(path), QuestionBank(path)
+    writer.add_questions(PATH, ['a'])
+    seen = []
+    reader.version  # load before subscribing, as the app's indexes do
+    reader.subscribe(lambda op, version: seen.append((op and op['op'], version)))
+    writer.add_questions(PATH, ['b'])
+    writer.rename(PATH[:4], 'Chapter 2')
+    assert reader.version == writer.version
+    assert seen == [('add', 2), ('rename', 3)]
+
+
+def test_migration_to_sqlite_keeps_journaled_writes(tmp_path):
+    path = str(tmp_path / 'data.json')
+    bank = QuestionBank(path)
+    bank.save({'Publication': {'Subject': {'class 1': {'Chapter 1': {'Short Answer': ['a', 'b']}}}}})
+    bank.add_questions(PATH, ['c'])
+    bank.replace_question(PATH, 0, 'A')
+    bank.delete_question(PATH, 1)
+    bank.rename(['Publication', 'Subject'], 'Science')
+    assert QuestionBank(path).journal.read()[1]
+
+    migrated = migrate(path, str(tmp_path / 'questions.db'), once=True)
+    assert migrated.load() == bank.load()
+    # Later starts keep what was written to the database since
+    migrated.delete(['Publication', 'Science'])
+    assert migrate(path, str(tmp_path / 'questions.db'), once=True).load() == {'Publication': {}}
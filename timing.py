@@ -0,0 +1,90 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# The timer of the request being handled in this thread, if any
+_current = ContextVar('phase_timer', default=None)
+
+
+class PhaseTimer:
+    """Time one request spends in each named phase.
+
+    Phases nest: while an inner phase runs the outer one is paused, so every
+    phase holds only its own time and together they never add up to more
+    than the request took. Entering a phase again adds to its total.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self._stack = []
+        self._since = 0.0
+
+    def start(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            self._add(self._stack[-1], now - self._since)
+        self._stack.append(name)
+        self._since = now
+
+    def stop(self):
+        now = time.perf_counter()
+        self._add(self._stack.pop(), now - self._since)
+        self._since = now
+
+    @contextmanager
+    def phase(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop()
+
+    def _add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def server_timing(self):
+        """Server-Timing header value: `name;dur=<ms>` per phase, in the order first entered."""
+        return ', '.join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.phases.items())
+
+
+def activate(timer):
+    """Make `timer` the one phase() records into, in this thread (None for no timer)."""
+    _current.set(timer)
+
+
+@contextmanager
+def phase(name):
+    """Time a block as `name` in the active request's timer; does nothing without one."""
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    with timer.phase(name):
+        yield
+
+
+class PhaseStats:
+    """Running totals of phase timings per endpoint: count, total and slowest seconds."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def add(self, endpoint, timer):
+        with self._lock:
+            for name, seconds in timer.phases.items():
+                stat = self._stats.setdefault((endpoint, name), [0, 0.0, 0.0])
+                stat[0] += 1
+                stat[1] += seconds
+                stat[2] = max(stat[2], seconds)
+
+    def snapshot(self):
+        """{endpoint: {phase: {'count', 'total', 'mean', 'max'}}} in seconds."""
+        with self._lock:
+            stats = {key: list(stat) for key, stat in self._stats.items()}
+        result = {}
+        for (endpoint, name), (count, total, slowest) in sorted(stats.items()):
+            result.setdefault(endpoint, {})[name] = {
+                'count': count, 'total': total, 'mean': total / count, 'max': slowest}
+        return result